@@ -1,15 +1,28 @@
 import os
+import hmac
+import json
 import uuid
+import asyncio
 from datetime import datetime
 import logging
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS  # Import CORS
-from backend.app.core.file_management import save_uploaded_file, get_file_metadata
+from backend.app.core.file_management import save_uploaded_file, get_file_metadata, add_file_reference
+from ..core.chunked_upload import ChunkedUploadManager
+from ..core.dataset_cache import convert_to_columnar
+from ..core.dataset_profile import profile_dataset, format_profile
+from ..core.dataset_associations import dataset_associations, format_associations
+from ..core.dataset_sample import dataset_sample, format_sample
 from backend.app.core.user_management import ensure_session
 from ..services.code_execution_service import CodeExecutionService
-from ..core.notebook_manager import NotebookManager
-from ..config import settings
+from ..services.execution_scheduler import ExecutionScheduler
+from ..services.output_shaper import OutputShaper
+from ..services.chat_jobs import ChatJobQueue, JobLimitError
+from ..services.kernel_host import KernelHostClient, KernelHostRegistry, create_notebook_manager, require_authkey
+from ..config import settings, UPLOAD_FOLDER
 from ..core.prompt_loader import load_system_prompt
+from ..core.history_manager import HistoryManager
+from ..database.session_store import StoreBackedDict, session_store
 import cohere # Import the cohere library
 
 
@@ -25,6 +38,10 @@ class CohereModel:
             raise ValueError("COHERE_API_KEY environment variable is not set")
         
         self.client = cohere.Client(self.api_key)
+        # Used by the asyncio chat pipeline served from the ASGI entry point
+        self.async_client = cohere.AsyncClient(self.api_key)
+        # Caps concurrent async model calls, so many sessions in flight stay under the API's rate limits
+        self.call_slots = asyncio.Semaphore(settings.MAX_CONCURRENT_MODEL_CALLS) if settings.MAX_CONCURRENT_MODEL_CALLS > 0 else None
         self.system_prompt = load_system_prompt()
         
     def format_chat_history(self, messages):
@@ -90,27 +107,117 @@ class CohereModel:
         except Exception as e:
             logging.error(f"Error sending message to Cohere: {str(e)}")
             raise
+    
+    def stream_message(self, messages):
+        """Send a message to the Cohere API and yield the response as it is generated.
+        
+        Args:
+            messages: List of message objects with 'role' and 'content' keys
+            
+        Yields:
+            Chunks of the text response
+        """
+        try:
+            system_message, chat_history, current_message = self.format_chat_history(messages)
+            
+            # If no current message was specified, use the last user message
+            if current_message is None:
+                current_message = next((msg['content'] for msg in reversed(messages) 
+                                      if msg['role'] == 'user'), "")
+            
+            for event in self.client.chat_stream(
+                model=settings.COHERE_MODEL_NAME,
+                message=current_message,
+                chat_history=chat_history,
+                preamble=system_message
+            ):
+                if event.event_type == "text-generation":
+                    yield event.text
+        except Exception as e:
+            logging.error(f"Error streaming message from Cohere: {str(e)}")
+            raise
+    
+    async def astream_message(self, messages):
+        """Async version of ``stream_message``: awaits the Cohere API without holding a thread.
+        
+        Args:
+            messages: List of message objects with 'role' and 'content' keys
+            
+        Yields:
+            Chunks of the text response
+        """
+        try:
+            system_message, chat_history, current_message = self.format_chat_history(messages)
+            
+            # If no current message was specified, use the last user message
+            if current_message is None:
+                current_message = next((msg['content'] for msg in reversed(messages) 
+                                      if msg['role'] == 'user'), "")
+            
+            if self.call_slots is not None:
+                await self.call_slots.acquire()
+            try:
+                async for event in self.async_client.chat_stream(
+                    model=settings.COHERE_MODEL_NAME,
+                    message=current_message,
+                    chat_history=chat_history,
+                    preamble=system_message
+                ):
+                    if event.event_type == "text-generation":
+                        yield event.text
+            finally:
+                if self.call_slots is not None:
+                    self.call_slots.release()
+        except Exception as e:
+            logging.error(f"Error streaming message from Cohere: {str(e)}")
+            raise
             
 
 # Create a blueprint for chatbot routes
 chatbot_bp = Blueprint('chatbot', __name__)
 # Enable CORS with specific options
-CORS(chatbot_bp, resources={r"/*": {"origins": "*", "methods": ["GET", "POST"], "allow_headers": ["Content-Type", "Authorization"]}})
+CORS(chatbot_bp, resources={r"/*": {"origins": "*", "methods": ["GET", "POST", "PUT"], "allow_headers": ["Content-Type", "Authorization", "X-Chunk-Sha256"]}})
 
 # Initialize the chatbot model
 chatbot_model = CohereModel()
 
-# Store conversation history by paper_id
-conversation_history = {}
+# Store conversation history by paper_id (shared by all workers through the session store)
+conversation_history = StoreBackedDict(session_store, "conversation_history")
 
 # Track which paper_ids belong to each user
-user_papers = {}
+user_papers = StoreBackedDict(session_store, "user_papers")
+
+# Outcome of the background load of each uploaded dataset, with the kernel it was loaded into,
+# by paper_id and file path
+prefetch_status = StoreBackedDict(session_store, "dataset_prefetch")
+
+# Loads queued on this process's execution queue and not finished yet
+pending_prefetches = set()
 
 logger = logging.getLogger(__name__)
 
-# Initialize notebook manager and code execution service
-notebook_manager = NotebookManager(settings.NOTEBOOKS_DIR)
-code_execution_service = CodeExecutionService(notebook_manager)
+# Initialize notebook manager and code execution service. In remote mode the
+# kernels live in kernel host processes and each project sticks to one host.
+if settings.KERNEL_HOST_MODE == "remote":
+    notebook_manager = KernelHostClient(KernelHostRegistry(session_store), require_authkey(), settings.NOTEBOOKS_DIR)
+else:
+    notebook_manager = create_notebook_manager()
+execution_scheduler = ExecutionScheduler(notebook_manager, max_workers=settings.EXECUTION_WORKERS)
+output_shaper = OutputShaper(
+    os.path.join(settings.NOTEBOOKS_DIR, "outputs"),
+    max_block_chars=settings.MAX_BLOCK_OUTPUT_CHARS,
+    max_turn_chars=settings.MAX_TURN_OUTPUT_CHARS,
+)
+code_execution_service = CodeExecutionService(notebook_manager, execution_scheduler, output_shaper)
+
+# Resumable uploads of large datasets, assembled under the upload folder
+chunked_uploads = ChunkedUploadManager(UPLOAD_FOLDER, chunk_size=settings.UPLOAD_CHUNK_SIZE)
+
+# Keeps the history sent to the model under the token budget
+history_manager = HistoryManager(
+    token_budget=settings.HISTORY_TOKEN_BUDGET,
+    keep_recent_turns=settings.HISTORY_KEEP_RECENT_TURNS,
+)
 
 # Load system prompt content
 system_prompt_content = load_system_prompt()
@@ -125,25 +232,23 @@ def initiate_chat():
     if not user_id:
         return jsonify({"error": "user_id is required"}), 400
 
+    paper_id = create_chat_session(user_id)
+    return jsonify({"message": "Chat initiated", "user_id": user_id, "paper_id": paper_id}), 200
+
+
+def create_chat_session(user_id):
+    """Create a chat session with its notebook and return the new paper_id."""
     paper_id = str(uuid.uuid4())
     notebook_manager.ensure_notebook_exists(paper_id)
 
     # Initialize conversation history with system prompt
-    conversation_history[paper_id] = {
-        'messages': [{"role": "system", "content": system_prompt_content}],
-        'uploaded_files': []
-    }
-    
-    # Track this paper_id for the user
-    if user_id not in user_papers:
-        user_papers[user_id] = []
-    user_papers[user_id].append(paper_id)
+    conversation_history[paper_id] = new_chat_session()
+    track_paper(user_id, paper_id)
 
     # Initialize the dataframes dictionary in the notebook at chat start
     init_code = "dataframes = {}"
     code_execution_service.execute_code_in_notebook(paper_id, init_code)
-
-    return jsonify({"message": "Chat initiated", "user_id": user_id, "paper_id": paper_id}), 200
+    return paper_id
 
 
 @chatbot_bp.route('/upload_file', methods=['POST'])
@@ -178,17 +283,7 @@ def upload_file():
     # Ensure the session exists for this paper_id
     if paper_id not in conversation_history:
         logger.error(f"Chat session not found for paper_id: {paper_id}")
-        # Initialize a new conversation if it doesn't exist
-        conversation_history[paper_id] = {
-            'messages': [{"role": "system", "content": system_prompt_content}],
-            'uploaded_files': []
-        }
-        
-        # Track this paper_id for the user
-        if user_id not in user_papers:
-            user_papers[user_id] = []
-        if paper_id not in user_papers[user_id]:
-            user_papers[user_id].append(paper_id)
+    get_or_create_chat_session(user_id, paper_id)
 
     try:
         # Log the file details before saving
@@ -196,24 +291,10 @@ def upload_file():
         
         file_data = save_uploaded_file(file, user_id, paper_id)
         file_path = file_data['local_filepath']
-        original_filename = file_data['original_filename']
         
         logger.info(f"File saved successfully at: {file_path}")
         
-        # Store file information in the conversation history
-        uploaded_file_info = {
-            'original_filename': original_filename,
-            'file_path': file_path
-        }
-        conversation_history[paper_id]['uploaded_files'].append(uploaded_file_info)
-
-        return jsonify({
-            'message': f'File "{original_filename}" uploaded and saved successfully. AI will be informed about the file path.',
-            'file_id': file_data['file_id'],
-            'filename': original_filename,
-            'local_filepath': file_path,
-            'paper_id': paper_id,
-        }), 200
+        return jsonify(register_uploaded_file(paper_id, file_data)), 200
 
     except Exception as e:
         logger.error(f"File upload error: {e}")
@@ -222,77 +303,326 @@ def upload_file():
         return jsonify({'error': 'File upload failed', 'details': str(e)}), 500
 
 
-@chatbot_bp.route('/chat', methods=['POST'])
-def chat():
-    """Process a chat message and return the response."""
-    logger.info("Chat request from user detected")
+def register_uploaded_file(paper_id, file_data):
+    """Prepare a stored upload for analysis and tell the session about it.
     
-    user_id = request.json.get('user_id')
-    message = request.json.get('message')
-    paper_id = request.json.get('paper_id')
+    Args:
+        paper_id: The paper the file was uploaded to
+        file_data: Metadata of the stored file from file_management
+        
+    Returns:
+        dict: Response body describing the uploaded file
+    """
+    file_path = file_data['local_filepath']
+    original_filename = file_data['original_filename']
+    
+    # Convert the upload once to a columnar copy that kernels can memory-map
+    columnar_path = None
+    try:
+        columnar_path = convert_to_columnar(
+            file_path, settings.DATASET_CACHE_DIR, key=file_data['content_hash']
+        )
+    except Exception as e:
+        logger.warning(f"Could not convert '{file_path}' to the columnar cache: {e}")
+    
+    # Profile the data now so the model does not spend its first turns on df.info() and describe()
+    profile_summary = None
+    associations_summary = None
+    sample_rows = None
+    if columnar_path:
+        try:
+            profile = profile_dataset(columnar_path, settings.DATASET_CACHE_DIR, file_data['content_hash'])
+            profile_summary = format_profile(profile)
+        except Exception as e:
+            logger.warning(f"Could not profile '{file_path}': {e}")
+        
+        # Precompute the pairwise associations the exploratory phase would otherwise build one pair at a time
+        try:
+            associations = dataset_associations(
+                columnar_path, cache_dir=settings.DATASET_CACHE_DIR, key=file_data['content_hash']
+            )
+            associations_summary = format_associations(associations)
+        except Exception as e:
+            logger.warning(f"Could not compute associations for '{file_path}': {e}")
+        
+        # A few representative rows, so the model does not have to print df.head()
+        try:
+            sample = dataset_sample(
+                columnar_path, max_bytes=settings.SAMPLE_PROMPT_BYTES,
+                cache_dir=settings.DATASET_CACHE_DIR, key=file_data['content_hash']
+            )
+            sample_rows = format_sample(sample)
+        except Exception as e:
+            logger.warning(f"Could not sample '{file_path}': {e}")
+    
+    # Store file information in the conversation history
+    uploaded_file_info = {
+        'original_filename': original_filename,
+        'file_path': file_path,
+        'columnar_path': os.path.abspath(columnar_path) if columnar_path else None,
+        'profile': profile_summary,
+        'associations': associations_summary,
+        'sample': sample_rows
+    }
+    added = []
+
+    def add_file(chat_session):
+        # Re-run on the latest session if a concurrent turn or upload changed it
+        added.clear()
+        already_uploaded = any(
+            info['file_path'] == file_path and info['original_filename'] == original_filename
+            for info in chat_session['uploaded_files']
+        )
+        if not already_uploaded:
+            uploaded_file_info['dataframe_name'] = unique_dataframe_name(
+                original_filename, chat_session['uploaded_files']
+            )
+            chat_session['uploaded_files'].append(uploaded_file_info)
+            added.append(uploaded_file_info)
+        return chat_session
+
+    conversation_history.modify(paper_id, add_file)
+    if added:
+        prefetch_dataset(paper_id, uploaded_file_info)
+
+    return {
+        'message': f'File "{original_filename}" uploaded and saved successfully. AI will be informed about the file path.',
+        'file_id': file_data['file_id'],
+        'filename': original_filename,
+        'local_filepath': file_path,
+        'content_hash': file_data['content_hash'],
+        'paper_id': paper_id,
+    }
 
-    if not user_id:
-        return jsonify({"error": "user_id is required"}), 400
-    if not message:
-        return jsonify({"error": "message is required"}), 400
-    if not paper_id:
-        return jsonify({"error": "paper_id is required"}), 400
 
-    # Get or initialize the chat session
-    if paper_id not in conversation_history:
-        conversation_history[paper_id] = {
-            'messages': [{"role": "system", "content": system_prompt_content}],
-            'uploaded_files': []
-        }
-        
-        # Track this paper_id for the user
-        if user_id not in user_papers:
-            user_papers[user_id] = []
-        if paper_id not in user_papers[user_id]:
-            user_papers[user_id].append(paper_id)
+def dataframe_name(file_info):
+    """Key of an uploaded file in the notebook's ``dataframes`` dict."""
+    return file_info.get('dataframe_name') or os.path.splitext(file_info['original_filename'])[0]
 
-    chat_session_data = conversation_history[paper_id]
-    messages = chat_session_data['messages']
-    uploaded_files = chat_session_data['uploaded_files']
 
-    # Construct file context prompt
-    file_context_prompt = ""
-    if uploaded_files:
-        file_context_prompt = "You have access to the following files:\n"
-        for file_info in uploaded_files:
-            file_context_prompt += f"- '{file_info['original_filename']}' at path '{file_info['file_path']}'\n"
-        file_context_prompt += "\nConsider these files for any analysis or operations requested by the user."
+def unique_dataframe_name(filename, uploaded_files):
+    """Name for a new upload's DataFrame that no other file of the session uses.
+    
+    ``cohort.csv`` and ``cohort.xlsx`` would otherwise load into the same
+    ``dataframes`` entry, the second replacing the first.
+    """
+    taken = {dataframe_name(file_info) for file_info in uploaded_files}
+    base = name = os.path.splitext(filename)[0]
+    suffix = 2
+    while name in taken:
+        name = f"{base}_{suffix}"
+        suffix += 1
+    return name
 
-    # Combine user message with file context
-    full_message = message + "\n\n" + file_context_prompt if file_context_prompt else message
 
-    # Add user message to the history
-    messages.append({"role": "user", "content": full_message})
+def prefetch_key(paper_id, file_info):
+    """Key of an uploaded file in ``prefetch_status``."""
+    return f"{paper_id}:{file_info['file_path']}"
+
 
-    # Get AI response
+def prefetch_dataset(paper_id, file_info):
+    """Load an uploaded dataset into the session's kernel in the background.
+    
+    The load is queued on the project's execution queue, so it starts a kernel
+    (from the pool if there is one) and runs before any code from the next chat
+    turn. By the time the model's first block runs, the data is in memory.
+    """
+    if not settings.ENABLE_CODE_EXECUTION:
+        return
+    path = file_info['columnar_path'] or file_info['file_path']
+    code = f"load_compact({path!r}, {dataframe_name(file_info)!r})"
+    key = prefetch_key(paper_id, file_info)
+    pending_prefetches.add(key)
+
+    def on_done(future):
+        pending_prefetches.discard(key)
+        result = None if future.exception() else future.result()
+        if result and result['success']:
+            prefetch_status[key] = {'status': 'loaded', 'kernel_id': result.get('kernel_id')}
+            logger.info(f"Prefetched '{file_info['original_filename']}' for paper {paper_id}")
+        else:
+            prefetch_status[key] = {'status': 'failed', 'kernel_id': None}
+            error = future.exception() or result.get('error')
+            logger.warning(f"Could not prefetch '{file_info['original_filename']}' for paper {paper_id}: {error}")
+
+    execution_scheduler.submit_code(paper_id, code).add_done_callback(on_done)
+
+
+@chatbot_bp.route('/upload/initiate', methods=['POST'])
+def initiate_upload():
+    """Start a resumable chunked upload, or resume the one in progress for the same file."""
+    data = request.json or {}
+    missing = [field for field in ('user_id', 'paper_id', 'filename', 'total_size') if data.get(field) in (None, '')]
+    if missing:
+        return jsonify({'error': f"{', '.join(missing)} required"}), 400
+
+    get_or_create_chat_session(data['user_id'], data['paper_id'])
     try:
-        ai_response = chatbot_model.send_message(messages)
-        # Add assistant response to the history
-        messages.append({"role": "assistant", "content": ai_response})
-    except Exception as e:
-        logger.error(f"Error processing message: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": f"Error processing message: {str(e)}"}), 500
+        upload_status = chunked_uploads.initiate(
+            data['user_id'], data['paper_id'], data['filename'], int(data['total_size']), data.get('sha256')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(upload_status), 200
 
-    # Handle code execution if enabled
-    if settings.ENABLE_CODE_EXECUTION:
-        try:
-            # Get the last assistant response
-            ai_response = messages[-1]["content"]
-            
-            has_code, execution_output = code_execution_service.execute_code_blocks(
-                paper_id, ai_response
+
+@chatbot_bp.route('/upload/<upload_id>/chunk/<int:index>', methods=['PUT'])
+def put_upload_chunk(upload_id, index):
+    """Receive one chunk of an upload as the raw request body."""
+    try:
+        upload_status = chunked_uploads.put_chunk(
+            upload_id, index, request.get_data(cache=False), request.headers.get('X-Chunk-Sha256')
+        )
+    except KeyError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'upload_id': upload_id,
+        'received_chunks': len(upload_status['received_chunks']),
+        'total_chunks': upload_status['total_chunks'],
+    }), 200
+
+
+@chatbot_bp.route('/upload/<upload_id>', methods=['GET'])
+def get_upload_status(upload_id):
+    """Report which chunks of an upload have been received."""
+    try:
+        upload_status = chunked_uploads.status(upload_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if upload_status is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(upload_status), 200
+
+
+@chatbot_bp.route('/upload/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Verify an assembled upload and add it to its session."""
+    try:
+        result = chunked_uploads.complete(upload_id)
+    except KeyError:
+        return jsonify({'error': 'Upload not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+
+    file_data = add_file_reference(
+        result['user_id'], result['paper_id'], result['filename'], result['content_hash'],
+        result['local_filepath'], result['size'], result['deduplicated']
+    )
+    get_or_create_chat_session(result['user_id'], result['paper_id'])
+    return jsonify(register_uploaded_file(result['paper_id'], file_data)), 200
+
+
+def new_chat_session():
+    """Conversation state of a new session."""
+    return {
+        'messages': [{"role": "system", "content": system_prompt_content}],
+        'uploaded_files': []
+    }
+
+
+def track_paper(user_id, paper_id):
+    """Record that a paper belongs to a user."""
+    def add_paper(papers):
+        if paper_id not in papers:
+            papers.append(paper_id)
+        return papers
+
+    user_papers.modify(user_id, add_paper, default=list)
+
+
+def get_or_create_chat_session(user_id, paper_id):
+    """Return the conversation state for a paper, creating it if needed."""
+    if paper_id not in conversation_history:
+        conversation_history.setdefault(paper_id, new_chat_session())
+        track_paper(user_id, paper_id)
+    
+    return conversation_history[paper_id]
+
+
+def append_messages(paper_id, *new_messages):
+    """Append messages to a paper's history and return the updated conversation state.
+    
+    Only the new messages are added to whatever is stored, so files registered
+    by another worker while a turn runs are kept.
+    """
+    def append(chat_session):
+        chat_session['messages'].extend(new_messages)
+        return chat_session
+
+    return conversation_history.modify(paper_id, append)
+
+
+def dataset_loaded(paper_id, file_info):
+    """Whether an uploaded dataset is in the session's kernel, or will be before the turn's code runs.
+    
+    A load only counts while the kernel it ran in is alive: after a restart,
+    an eviction or a move to another host the data has to be loaded again.
+    """
+    key = prefetch_key(paper_id, file_info)
+    if key in pending_prefetches:
+        # Queued on this process's execution queue, ahead of any code from the turn
+        return True
+    status = prefetch_status.get(key)
+    if not isinstance(status, dict) or status['status'] != 'loaded' or status['kernel_id'] is None:
+        return False
+    return status['kernel_id'] == notebook_manager.kernel_id(paper_id)
+
+
+def build_file_context(paper_id, uploaded_files):
+    """Describe the uploaded files of a paper to the model."""
+    if not uploaded_files:
+        return ""
+    file_context_prompt = "You have access to the following files:\n"
+    for file_info in uploaded_files:
+        file_context_prompt += f"- '{file_info['original_filename']}' at path '{file_info['file_path']}'\n"
+        name = dataframe_name(file_info)
+        if dataset_loaded(paper_id, file_info):
+            file_context_prompt += (
+                f"  Already loaded in the notebook as `dataframes['{name}']` (with compacted dtypes); "
+                f"use it directly instead of reading the file again.\n"
+            )
+        elif file_info.get('columnar_path'):
+            file_context_prompt += (
+                f"  Load it with `load_compact('{file_info['columnar_path']}', '{name}')` (already available in "
+                f"the notebook): it reads the fast columnar copy, shrinks the dtypes and stores the result in "
+                f"`dataframes['{name}']`.\n"
+            )
+        if file_info.get('profile'):
+            profile = file_info['profile'].replace("\n", "\n    ")
+            file_context_prompt += f"  Profile (computed at upload, no need to run info() or describe()):\n    {profile}\n"
+        if file_info.get('associations'):
+            associations = file_info['associations'].replace("\n", "\n    ")
+            file_context_prompt += (
+                f"  Strongest column associations (BH-adjusted; full table via "
+                f"`dataset_associations('{file_info['columnar_path']}')` or `association_matrix(...)`):\n    {associations}\n"
             )
+        if file_info.get('sample'):
+            sample = file_info['sample'].replace("\n", "\n    ")
+            file_context_prompt += (
+                f"  Representative rows (stratified: rare categories, extremes and missing values; "
+                f"use `stratified_sample(dataframes['{name}'])` rather than head() to see more):\n    {sample}\n"
+            )
+    file_context_prompt += "\nConsider these files for any analysis or operations requested by the user."
+    return file_context_prompt
+
+
+def with_file_context(messages, file_context_prompt):
+    """Messages to send to the model, with the file context added to the system prompt.
+    
+    The context goes out once per call instead of being stored with every user
+    message, and it is never counted against the history budget.
+    """
+    if not file_context_prompt or not messages or messages[0]['role'] != 'system':
+        return messages
+    system_message = dict(messages[0], content=messages[0]['content'] + "\n\n" + file_context_prompt)
+    return [system_message] + messages[1:]
 
-            if has_code:
-                # This is an intermediate response with code - we need to send it back to the AI
-                follow_up_prompt = f"""BLOCK_RESPONSE
+
+def block_response_prompt(execution_output):
+    """Build the follow-up prompt that feeds execution results back to the model."""
+    return f"""BLOCK_RESPONSE
 
                     
 Here are the results of executing your code:
@@ -300,41 +630,349 @@ Here are the results of executing your code:
                     
 Perform the next step of your analysis based on these results, or provide your final answer if the analysis is complete.
                     """
-                
-                # Add execution results to messages
-                messages.append({"role": "user", "content": follow_up_prompt})
-                
-                # Get the AI's next response based on code execution output
-                ai_response = chatbot_model.send_message(messages)
-                messages.append({"role": "assistant", "content": ai_response})
-
-                # Check for more code blocks recursively
-                while settings.ENABLE_CODE_EXECUTION:
-                    has_more_code, more_execution_output = code_execution_service.execute_code_blocks(
-                        paper_id, ai_response
-                    )
-
-                    if not has_more_code:
-                        # No more code blocks - we have the final response
-                        break
-
-                    # Another round of code execution
-                    follow_up_prompt = f"""BLOCK_RESPONSE
 
-                    
-Here are the results of executing your code:
-{more_execution_output}
-                    
-Perform the next step of your analysis based on these results, or provide your final answer if the analysis is complete.
-                    """
-                    messages.append({"role": "user", "content": follow_up_prompt})
 
-                    ai_response = chatbot_model.send_message(messages)
-                    messages.append({"role": "assistant", "content": ai_response})
-                
+def model_reply(paper_id, messages, file_context_prompt=""):
+    """Stream the model's reply, executing its code blocks as soon as they are complete.
+    
+    Yields text and code execution events while the model is generating.
+    The file context, if any, is added to the system prompt of the call.
+    
+    Returns:
+        Tuple of (full response text, execution output or None if the reply had no code)
+        as the generator's return value
+    """
+    chunks = []
+    execution_output = None
+
+    # Send a condensed copy of the history; the stored conversation stays complete
+    compacted_messages, history_report = history_manager.compact(with_file_context(messages, file_context_prompt))
+    yield dict(type='history', **history_report)
+
+    def text_chunks():
+        for chunk in chatbot_model.stream_message(compacted_messages):
+            chunks.append(chunk)
+            yield chunk
+
+    if settings.ENABLE_CODE_EXECUTION:
+        for event in code_execution_service.stream_pipelined_blocks(paper_id, text_chunks()):
+            if event['type'] == 'execution_output':
+                execution_output = event['output']
+            else:
+                yield event
+    else:
+        for chunk in text_chunks():
+            yield {'type': 'text', 'text': chunk}
+
+    return "".join(chunks), execution_output
+
+
+def run_chat_turn(user_id, paper_id, message):
+    """Run one chat turn: the model call plus the code execution loop.
+    
+    Yields event dictionaries as the turn progresses: the model's text as it
+    is generated, and code blocks with their kernel output as they run. Code
+    blocks start executing while the model is still writing the rest of its
+    reply. The last event is of type ``done`` and carries the final response.
+    
+    Args:
+        user_id: The ID of the user
+        paper_id: The ID of the paper/project
+        message: The user's message
+    """
+    chat_session_data = get_or_create_chat_session(user_id, paper_id)
+
+    # Described to the model with each call rather than stored in the history
+    file_context_prompt = build_file_context(paper_id, chat_session_data['uploaded_files'])
+
+    # Add user message to the history
+    messages = append_messages(paper_id, {"role": "user", "content": message})['messages']
+
+    # Keep feeding execution results back until the model replies without code
+    while True:
+        ai_response, execution_output = yield from model_reply(paper_id, messages, file_context_prompt)
+        messages = append_messages(paper_id, {"role": "assistant", "content": ai_response})['messages']
+        yield {'type': 'message', 'content': ai_response}
+
+        if execution_output is None:
+            # No more code blocks - we have the final response
+            break
+
+        # Add execution results to messages for the AI's next response
+        messages = append_messages(paper_id, {"role": "user", "content": block_response_prompt(execution_output)})['messages']
+
+    yield {'type': 'done', 'response': ai_response, 'project_id': paper_id}
+
+
+async def amodel_reply(paper_id, messages, file_context_prompt=""):
+    """Async version of ``model_reply`` for the asyncio chat pipeline.
+    
+    Yields the same events. Async generators cannot return a value, so the
+    last event is of type ``reply`` and carries the full ``response`` text and
+    the ``execution_output`` (None if the reply had no code).
+    """
+    chunks = []
+    execution_output = None
+
+    # Send a condensed copy of the history; the stored conversation stays complete
+    compacted_messages, history_report = history_manager.compact(with_file_context(messages, file_context_prompt))
+    yield dict(type='history', **history_report)
+
+    async def text_chunks():
+        async for chunk in chatbot_model.astream_message(compacted_messages):
+            chunks.append(chunk)
+            yield chunk
+
+    if settings.ENABLE_CODE_EXECUTION:
+        async for event in code_execution_service.astream_pipelined_blocks(paper_id, text_chunks()):
+            if event['type'] == 'execution_output':
+                execution_output = event['output']
+            else:
+                yield event
+    else:
+        async for chunk in text_chunks():
+            yield {'type': 'text', 'text': chunk}
+
+    yield {'type': 'reply', 'response': "".join(chunks), 'execution_output': execution_output}
+
+
+async def arun_chat_turn(user_id, paper_id, message):
+    """Async version of ``run_chat_turn``, yielding the same events.
+    
+    Model calls and kernel executions are awaited instead of blocking a
+    request thread, so one process can keep many slow analyses in flight.
+    Session store reads and writes run in the default thread pool.
+    
+    Args:
+        user_id: The ID of the user
+        paper_id: The ID of the paper/project
+        message: The user's message
+    """
+    chat_session_data = await asyncio.to_thread(get_or_create_chat_session, user_id, paper_id)
+
+    # Described to the model with each call rather than stored in the history
+    file_context_prompt = await asyncio.to_thread(build_file_context, paper_id, chat_session_data['uploaded_files'])
+
+    # Add user message to the history
+    chat_session_data = await asyncio.to_thread(append_messages, paper_id, {"role": "user", "content": message})
+    messages = chat_session_data['messages']
+
+    # Keep feeding execution results back until the model replies without code
+    while True:
+        async for event in amodel_reply(paper_id, messages, file_context_prompt):
+            if event['type'] == 'reply':
+                ai_response, execution_output = event['response'], event['execution_output']
+            else:
+                yield event
+        chat_session_data = await asyncio.to_thread(append_messages, paper_id, {"role": "assistant", "content": ai_response})
+        messages = chat_session_data['messages']
+        yield {'type': 'message', 'content': ai_response}
+
+        if execution_output is None:
+            # No more code blocks - we have the final response
+            break
+
+        # Add execution results to messages for the AI's next response
+        chat_session_data = await asyncio.to_thread(
+            append_messages, paper_id, {"role": "user", "content": block_response_prompt(execution_output)}
+        )
+        messages = chat_session_data['messages']
+
+    yield {'type': 'done', 'response': ai_response, 'project_id': paper_id}
+
+
+def chat_request_error(payload):
+    """Return why a chat request is invalid, or None if it has all required fields."""
+    for field in ('user_id', 'message', 'paper_id'):
+        if not payload.get(field):
+            return f"{field} is required"
+    return None
+
+
+def validate_chat_request(payload):
+    """Return an error response tuple if a chat request is missing fields, else None."""
+    error = chat_request_error(payload)
+    if error:
+        return jsonify({"error": error}), 400
+    return None
+
+
+# Background chat turns for long analyses; clients poll instead of holding the connection
+chat_jobs = ChatJobQueue(
+    session_store, run_chat_turn,
+    max_workers=settings.CHAT_JOB_WORKERS,
+    max_active_per_user=settings.MAX_ACTIVE_JOBS_PER_USER,
+)
+
+
+def submit_chat_job(user_id, paper_id, message):
+    """Queue a chat turn as a background job and return the response tuple."""
+    try:
+        job = chat_jobs.submit(user_id, paper_id, message)
+    except JobLimitError as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify(job), 202
+
+
+@chatbot_bp.route('/chat', methods=['POST'])
+def chat():
+    """Process a chat message and return the response.
+    
+    With ``"job": true`` in the request the turn runs in the background
+    instead, and the response is the job's status (see ``/chat/jobs``).
+    """
+    logger.info("Chat request from user detected")
+    
+    error_response = validate_chat_request(request.json)
+    if error_response:
+        return error_response
+
+    user_id = request.json.get('user_id')
+    message = request.json.get('message')
+    paper_id = request.json.get('paper_id')
+
+    if request.json.get('job'):
+        return submit_chat_job(user_id, paper_id, message)
+
+    try:
+        for event in run_chat_turn(user_id, paper_id, message):
+            if event['type'] == 'done':
+                # Return the final response to the user
+                return jsonify({"response": event['response'], "project_id": paper_id})
+    except Exception as e:
+        logger.error(f"Error processing message: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Error processing message: {str(e)}"}), 500
+
+
+@chatbot_bp.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Process a chat message and stream the turn as Server-Sent Events.
+    
+    Emits ``text`` (model output as it is generated), ``message`` (a complete
+    model reply), ``code``, ``output`` (kernel output as it arrives),
+    ``result`` and finally ``done`` or ``error`` events.
+    """
+    logger.info("Streaming chat request from user detected")
+    
+    error_response = validate_chat_request(request.json)
+    if error_response:
+        return error_response
+
+    user_id = request.json.get('user_id')
+    message = request.json.get('message')
+    paper_id = request.json.get('paper_id')
+
+    def generate():
+        try:
+            for event in run_chat_turn(user_id, paper_id, message):
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
         except Exception as e:
-            logger.error(f"Error during code execution: {str(e)}")
-            return jsonify({"error": f"Error during code execution: {str(e)}"}), 500
+            logger.error(f"Error processing streamed message: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@chatbot_bp.route('/chat/jobs', methods=['POST'])
+def create_chat_job():
+    """Start a chat turn in the background and return its job id at once."""
+    error_response = validate_chat_request(request.json)
+    if error_response:
+        return error_response
+    return submit_chat_job(request.json['user_id'], request.json['paper_id'], request.json['message'])
+
+
+@chatbot_bp.route('/chat/jobs', methods=['GET'])
+def list_chat_jobs():
+    """List the jobs of a user."""
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+    return jsonify({"jobs": chat_jobs.user_jobs(user_id)}), 200
+
+
+@chatbot_bp.route('/chat/jobs/<job_id>', methods=['GET'])
+def get_chat_job(job_id):
+    """Return the state of a job."""
+    job = chat_jobs.status(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
 
-    # Return the final response to the user
-    return jsonify({"response": ai_response, "project_id": paper_id}) 
\ No newline at end of file
+
+@chatbot_bp.route('/chat/jobs/<job_id>/transcript', methods=['GET'])
+def get_chat_job_transcript(job_id):
+    """Return the job's transcript so far: replies, code blocks, their output and results.
+    
+    Pass ``since`` (the ``next`` value of the previous call) to only get new
+    entries. The last entry may still grow while its block is running.
+    """
+    job = chat_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    since = request.args.get('since', 0, type=int)
+    transcript = job['transcript']
+    return jsonify({
+        "status": job['status'],
+        "transcript": transcript[since:],
+        "next": len(transcript),
+    }), 200
+
+
+@chatbot_bp.route('/chat/jobs/<job_id>/result', methods=['GET'])
+def get_chat_job_result(job_id):
+    """Return the final response of a finished job, or 202 while it is still running."""
+    job = chat_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job['status'] == 'failed':
+        return jsonify({"error": f"Error processing message: {job['error']}", "status": job['status']}), 500
+    if job['status'] != 'done':
+        return jsonify(chat_jobs.status(job_id)), 202
+    return jsonify({"response": job['response'], "project_id": job['paper_id']}), 200
+
+
+@chatbot_bp.route('/chat/notebook/<paper_id>', methods=['GET'])
+def download_notebook(paper_id):
+    """Return the project's notebook, compacting any journaled cells into it first."""
+    if paper_id not in conversation_history:
+        return jsonify({"error": "Chat session not found"}), 404
+
+    notebook_path = notebook_manager.compact_notebook(paper_id)
+    return send_file(os.path.abspath(notebook_path), mimetype='application/x-ipynb+json',
+                     as_attachment=True, download_name=f"{paper_id}.ipynb")
+
+
+@chatbot_bp.route('/chat/outputs/<paper_id>/<output_id>', methods=['GET'])
+def download_output(paper_id, output_id):
+    """Return the full, untruncated output of a code block."""
+    output_path = output_shaper.get_output_path(paper_id, output_id)
+    if output_path is None or not os.path.exists(output_path):
+        return jsonify({"error": "Output not found"}), 404
+    return send_file(os.path.abspath(output_path), mimetype='text/plain')
+
+
+def admin_request_error():
+    """Return an error response tuple unless the request carries the operator token, else None.
+    
+    Admin responses list live project ids, which are enough to download a
+    session's notebook and outputs, so they are never served without it.
+    """
+    if not settings.ADMIN_TOKEN:
+        return jsonify({"error": "Admin routes are disabled; set ADMIN_TOKEN to enable them"}), 403
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        return jsonify({"error": "Invalid or missing admin token"}), 401
+    return None
+
+
+@chatbot_bp.route('/admin/kernels', methods=['GET'])
+def kernel_stats():
+    """Report live kernel count and memory usage for operators."""
+    error = admin_request_error()
+    if error:
+        return error
+    return jsonify(notebook_manager.kernel_stats()), 200
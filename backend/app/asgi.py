@@ -0,0 +1,146 @@
+"""ASGI entry point serving the chat pipeline on asyncio.
+
+``/chat`` and ``/chat/stream`` run ``arun_chat_turn`` on the event loop, so a
+turn waiting on the model or a kernel does not hold a thread and one process
+can keep many analyses in flight. Every other route is served by the Flask
+app on a thread pool.
+
+Run with ``uvicorn backend.app.asgi:app --port 8080`` or, with several
+workers, ``gunicorn -k uvicorn.workers.UvicornWorker backend.app.asgi:app``.
+"""
+import json
+import asyncio
+import logging
+
+from a2wsgi import WSGIMiddleware
+
+from .main import app as flask_app
+from .api.chatbot import arun_chat_turn, chat_request_error, chat_jobs
+from .services.chat_jobs import JobLimitError
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Flask routes (uploads, notebooks, admin) keep running on threads
+wsgi_app = WSGIMiddleware(flask_app, workers=settings.WSGI_THREADS)
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+async def read_json(receive):
+    """Read the whole request body and decode it as JSON."""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError("Client disconnected before sending the request body")
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return json.loads(body or b'{}')
+
+
+async def send_json(send, status, payload):
+    """Send a complete JSON response."""
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + CORS_HEADERS,
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def chat(payload, send):
+    """Process a chat message and return the response, or queue it as a job if ``"job": true``."""
+    logger.info("Chat request from user detected")
+    paper_id = payload['paper_id']
+    if payload.get('job'):
+        try:
+            job = await asyncio.to_thread(chat_jobs.submit, payload['user_id'], paper_id, payload['message'])
+        except JobLimitError as e:
+            await send_json(send, 429, {"error": str(e)})
+            return
+        await send_json(send, 202, job)
+        return
+
+    try:
+        async for event in arun_chat_turn(payload['user_id'], paper_id, payload['message']):
+            if event['type'] == 'done':
+                # Return the final response to the user
+                await send_json(send, 200, {"response": event['response'], "project_id": paper_id})
+                return
+    except Exception as e:
+        logger.exception(f"Error processing message: {str(e)}")
+        await send_json(send, 500, {"error": f"Error processing message: {str(e)}"})
+
+
+async def chat_stream(payload, send):
+    """Process a chat message and stream the turn as Server-Sent Events (same events as the Flask route)."""
+    logger.info("Streaming chat request from user detected")
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')] + CORS_HEADERS,
+    })
+
+    async def send_event(event):
+        data = f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        await send({'type': 'http.response.body', 'body': data.encode(), 'more_body': True})
+
+    try:
+        async for event in arun_chat_turn(payload['user_id'], payload['paper_id'], payload['message']):
+            await send_event(event)
+    except Exception as e:
+        logger.error(f"Error processing streamed message: {str(e)}")
+        await send_event({'type': 'error', 'error': str(e)})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+# POST routes served on the event loop; everything else goes to Flask
+ASYNC_ROUTES = {
+    '/chat': chat,
+    '/chat/stream': chat_stream,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """The ASGI application."""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    handler = None
+    if scope['type'] == 'http' and scope['method'] == 'POST':
+        handler = ASYNC_ROUTES.get(scope['path'])
+    if handler is None:
+        await wsgi_app(scope, receive, send)
+        return
+
+    try:
+        payload = await read_json(receive)
+    except ConnectionError:
+        return
+    except ValueError:
+        await send_json(send, 400, {"error": "Request body must be JSON"})
+        return
+    if not isinstance(payload, dict):
+        await send_json(send, 400, {"error": "Request body must be a JSON object"})
+        return
+
+    error = chat_request_error(payload)
+    if error:
+        await send_json(send, 400, {"error": error})
+        return
+    await handler(payload, send)
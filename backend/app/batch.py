@@ -0,0 +1,319 @@
+"""Batch hypothesis generation over many datasets.
+
+Runs the standard analysis on every dataset of a directory or manifest, each
+in its own chat session and kernel, several at a time, and writes the
+hypotheses and the notebook of each dataset to the output directory.
+Progress is saved in ``batch_state.json`` there, so running the same command
+again after a crash skips the datasets that are finished and restarts the
+others in fresh sessions.
+
+    python -m backend.app.batch cohorts/ --output batch_results --parallel 4
+
+A manifest is a text file with one dataset path per line (relative to the
+manifest; blank lines and lines starting with ``#`` are ignored).
+"""
+import os
+import re
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Files picked up when the source is a directory
+DATASET_EXTENSIONS = ('.csv', '.tsv', '.txt', '.xlsx', '.xls', '.parquet')
+
+DEFAULT_MESSAGE = (
+    "Run your full analysis of the uploaded dataset: understand and clean the data, explore it and the "
+    "relationships between its variables, and finish with your hypotheses."
+)
+
+# Hypotheses are fenced markdown blocks starting with this title (see the system prompt)
+HYPOTHESIS_PATTERN = re.compile(r'```markdown\s*(### Hypothesis:.*?)```', re.DOTALL)
+
+STATE_FILE = "batch_state.json"
+REPORT_FILE = "batch_report.json"
+
+# Seconds between progress reports while the batch runs
+REPORT_INTERVAL = 60
+
+
+def find_datasets(source: str) -> List[str]:
+    """List the datasets of a directory (recursively) or a manifest file."""
+    if os.path.isdir(source):
+        datasets = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            datasets.extend(
+                os.path.join(root, name) for name in sorted(files)
+                if name.lower().endswith(DATASET_EXTENSIONS) and not name.startswith('.')
+            )
+        return datasets
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r') as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base_dir, line) for line in lines if line and not line.startswith('#')]
+
+
+def extract_hypotheses(messages: List[Dict[str, str]]) -> List[str]:
+    """Hypotheses written by the model over a conversation, in order."""
+    hypotheses = []
+    for message in messages:
+        if message['role'] == 'assistant':
+            hypotheses.extend(block.strip() for block in HYPOTHESIS_PATTERN.findall(message['content']))
+    return hypotheses
+
+
+class BatchState:
+    """Status of every dataset of a batch, saved after each change."""
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                self.datasets: Dict[str, Dict[str, Any]] = json.load(f)['datasets']
+        except FileNotFoundError:
+            self.datasets = {}
+
+    def get(self, key: str) -> Dict[str, Any]:
+        return self.datasets.get(key, {})
+
+    def update(self, key: str, **fields):
+        self.datasets.setdefault(key, {}).update(fields)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'datasets': self.datasets}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class Throughput:
+    """Counts what the batch has done so far, for progress reports."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.started_at = time.time()
+        self.skipped = 0
+        self.done = 0
+        self.failed = 0
+        self.running = 0
+        self.model_replies = 0
+        self.code_blocks = 0
+        self.kernel_seconds = 0.0
+        self.dataset_seconds = 0.0
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.time() - self.started_at
+        finished = self.done + self.failed
+        return {
+            'datasets': self.total,
+            'done': self.done,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'running': self.running,
+            'remaining': self.total - self.skipped - finished - self.running,
+            'elapsed_seconds': round(elapsed, 1),
+            'datasets_per_hour': round(finished * 3600 / elapsed, 2) if elapsed else 0.0,
+            'mean_seconds_per_dataset': round(self.dataset_seconds / finished, 1) if finished else None,
+            'model_replies': self.model_replies,
+            'code_blocks': self.code_blocks,
+            'kernel_seconds': round(self.kernel_seconds, 1),
+        }
+
+    def summary(self) -> str:
+        report = self.report()
+        return (f"{report['done'] + report['skipped']}/{report['datasets']} done "
+                f"({report['skipped']} from an earlier run), {report['failed']} failed, {report['running']} running | "
+                f"{report['datasets_per_hour']} datasets/h, {report['model_replies']} model replies, "
+                f"{report['code_blocks']} code blocks, {report['kernel_seconds']}s in kernels")
+
+
+class BatchRunner:
+    """Runs the analysis of many datasets, ``parallel`` sessions at a time."""
+
+    def __init__(self, chatbot, output_dir: str, parallel: int = 4, user_id: str = "batch",
+                 message: str = DEFAULT_MESSAGE):
+        """Initialize the runner.
+
+        Args:
+            chatbot: The ``backend.app.api.chatbot`` module, whose sessions and kernels run the analyses
+            output_dir: Directory receiving one folder per dataset plus the batch state and report
+            parallel: Datasets analysed at the same time, each with its own kernel and model calls
+            user_id: User owning the batch's sessions
+            message: Message starting the analysis of each dataset
+        """
+        self.chatbot = chatbot
+        self.output_dir = output_dir
+        self.parallel = parallel
+        self.user_id = user_id
+        self.message = message
+        os.makedirs(output_dir, exist_ok=True)
+        self.state = BatchState(os.path.join(output_dir, STATE_FILE))
+        self._claimed = set()
+
+    def _ingest(self, paper_id: str, path: str, content_hash: str):
+        """Store a dataset and attach it to a session, as an upload would."""
+        from .core.file_management import store_blob, add_file_reference
+        from .config import UPLOAD_FOLDER
+
+        with open(path, 'rb') as f:
+            stored_hash, blob_path, size, existed = store_blob(f, UPLOAD_FOLDER, os.path.splitext(path)[1])
+        if stored_hash != content_hash:
+            raise RuntimeError(f"{path} changed while the batch was running")
+        file_data = add_file_reference(self.user_id, paper_id, os.path.basename(path), stored_hash, blob_path, size, existed)
+        self.chatbot.register_uploaded_file(paper_id, file_data)
+
+    def _write_results(self, paper_id: str, dataset_dir: str, response: str) -> int:
+        """Write the hypotheses, final response and notebook of a session. Returns the number of hypotheses."""
+        os.makedirs(dataset_dir, exist_ok=True)
+        messages = self.chatbot.conversation_history[paper_id]['messages']
+        hypotheses = extract_hypotheses(messages)
+        with open(os.path.join(dataset_dir, "hypotheses.md"), 'w') as f:
+            f.write("\n\n".join(hypotheses) + "\n" if hypotheses else "No hypotheses were formulated.\n")
+        with open(os.path.join(dataset_dir, "response.md"), 'w') as f:
+            f.write(response)
+
+        notebook_manager = self.chatbot.notebook_manager
+        shutil.copyfile(notebook_manager.compact_notebook(paper_id), os.path.join(dataset_dir, "analysis.ipynb"))
+        return len(hypotheses)
+
+    def _release_kernel(self, paper_id: str):
+        """Free a session's kernel for the datasets still waiting, whether or not its analysis succeeded."""
+        try:
+            self.chatbot.notebook_manager.shutdown_kernel(paper_id)
+        except Exception as e:
+            logger.error(f"Could not shut down the kernel of session {paper_id}: {e}")
+
+    async def analyze(self, path: str, stats: Throughput):
+        """Analyse one dataset in a new session, unless an earlier run already finished it."""
+        from .core.file_management import hash_file
+
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            content_hash = await asyncio.to_thread(hash_file, path)
+        except Exception as e:
+            # Missing or unreadable: recorded under its name so the rest of the batch goes on
+            logger.error(f"{os.path.basename(path)} failed: {e}")
+            stats.failed += 1
+            self.state.update(name, path=path, status='failed', error=str(e), finished_at=time.time())
+            return
+        key = f"{name}-{content_hash[:12]}"
+        dataset_dir = os.path.join(self.output_dir, key)
+        if self.state.get(key).get('status') == 'done' or key in self._claimed:
+            # Finished by an earlier run, or listed twice
+            stats.skipped += 1
+            return
+        self._claimed.add(key)
+
+        stats.running += 1
+        started_at = time.time()
+        self.state.update(key, path=path, content_hash=content_hash, status='running', error=None,
+                          started_at=started_at, output_dir=dataset_dir)
+        response = None
+        paper_id = None
+        model_replies = code_blocks = 0
+        try:
+            paper_id = await asyncio.to_thread(self.chatbot.create_chat_session, self.user_id)
+            self.state.update(key, paper_id=paper_id)
+            await asyncio.to_thread(self._ingest, paper_id, path, content_hash)
+
+            async for event in self.chatbot.arun_chat_turn(self.user_id, paper_id, self.message):
+                if event['type'] == 'message':
+                    model_replies += 1
+                    stats.model_replies += 1
+                elif event['type'] == 'code':
+                    code_blocks += 1
+                    stats.code_blocks += 1
+                elif event['type'] == 'result':
+                    stats.kernel_seconds += (event.get('timing') or {}).get('run_time', 0)
+                elif event['type'] == 'done':
+                    response = event['response']
+
+            hypotheses = await asyncio.to_thread(self._write_results, paper_id, dataset_dir, response or "")
+            status = {'status': 'done', 'hypotheses': hypotheses}
+            stats.done += 1
+            logger.info(f"{os.path.basename(path)}: {hypotheses} hypotheses in {time.time() - started_at:.0f}s")
+        except Exception as e:
+            logger.error(f"{os.path.basename(path)} failed: {e}")
+            status = {'status': 'failed', 'error': str(e)}
+            stats.failed += 1
+        finally:
+            stats.running -= 1
+            if paper_id is not None:
+                await asyncio.to_thread(self._release_kernel, paper_id)
+
+        duration = time.time() - started_at
+        stats.dataset_seconds += duration
+        self.state.update(key, finished_at=time.time(), seconds=round(duration, 1), model_replies=model_replies,
+                          code_blocks=code_blocks, **status)
+
+    async def _report_progress(self, stats: Throughput):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            logger.info(stats.summary())
+
+    async def run(self, datasets: List[str]) -> Dict[str, Any]:
+        """Analyse every dataset and return the throughput report."""
+        stats = Throughput(len(datasets))
+        slots = asyncio.Semaphore(self.parallel)
+
+        async def analyze_in_slot(path):
+            async with slots:
+                await self.analyze(path, stats)
+
+        reporter = asyncio.create_task(self._report_progress(stats))
+        try:
+            await asyncio.gather(*(analyze_in_slot(path) for path in datasets))
+        finally:
+            reporter.cancel()
+
+        report = stats.report()
+        with open(os.path.join(self.output_dir, REPORT_FILE), 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Batch finished: {stats.summary()}")
+        return report
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Generate hypotheses for many datasets")
+    parser.add_argument("source", help="Directory of datasets, or a manifest listing one dataset path per line")
+    parser.add_argument("--output", default="batch_results", help="Directory for the results and the batch state")
+    parser.add_argument("--parallel", type=int, default=4, help="Datasets analysed at the same time")
+    parser.add_argument("--kernels", type=int, default=None,
+                        help="Kernels executing code at the same time (defaults to EXECUTION_WORKERS)")
+    parser.add_argument("--model-calls", type=int, default=None,
+                        help="Model calls in flight at the same time (defaults to MAX_CONCURRENT_MODEL_CALLS)")
+    parser.add_argument("--user-id", default="batch", help="User owning the sessions")
+    parser.add_argument("--message", default=DEFAULT_MESSAGE, help="Message starting each analysis")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    # Settings are read when the app modules are imported
+    if args.kernels:
+        os.environ["EXECUTION_WORKERS"] = str(args.kernels)
+    if args.model_calls:
+        os.environ["MAX_CONCURRENT_MODEL_CALLS"] = str(args.model_calls)
+    from .api import chatbot
+    from .config import settings
+
+    if 0 < settings.MAX_KERNELS < args.parallel:
+        logger.warning(f"--parallel {args.parallel} exceeds MAX_KERNELS={settings.MAX_KERNELS}: "
+                       f"kernels will be evicted and restored while their analyses run")
+
+    datasets = find_datasets(args.source)
+    logger.info(f"Analysing {len(datasets)} datasets, {args.parallel} at a time")
+    runner = BatchRunner(chatbot, args.output, parallel=args.parallel, user_id=args.user_id, message=args.message)
+    try:
+        report = asyncio.run(runner.run(datasets))
+    finally:
+        chatbot.notebook_manager.cleanup()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -29,11 +29,42 @@ class Settings:
     
     # Add new settings for notebooks and code execution
     NOTEBOOKS_DIR: str = os.getenv("NOTEBOOKS_DIR", "notebooks")
+    SAMPLE_PROMPT_BYTES: int = int(os.getenv("SAMPLE_PROMPT_BYTES", "2000"))  # sample rows shown to the model per file
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))  # bytes per chunk of a resumable upload
+    DATASET_CACHE_DIR: str = os.getenv("DATASET_CACHE_DIR", "dataset_cache")  # columnar copies of uploads
     MAX_CODE_EXECUTION_TIME: int = int(os.getenv("MAX_CODE_EXECUTION_TIME", "30"))  # seconds
     ENABLE_CODE_EXECUTION: bool = os.getenv("ENABLE_CODE_EXECUTION", "True").lower() == "true"
+    KERNEL_POOL_SIZE: int = int(os.getenv("KERNEL_POOL_SIZE", "2"))  # pre-warmed idle kernels, 0 disables
+    MAX_KERNELS: int = int(os.getenv("MAX_KERNELS", "20"))  # live kernels before LRU eviction, 0 means unlimited
+    MAX_KERNEL_MEMORY_MB: int = int(os.getenv("MAX_KERNEL_MEMORY_MB", "0"))  # combined kernel RSS limit, 0 means unlimited
+    HIBERNATE_IDLE_SECONDS: int = int(os.getenv("HIBERNATE_IDLE_SECONDS", "0"))  # snapshot and stop idle kernels, 0 disables
+    CHECKPOINT_EVERY_CELLS: int = int(os.getenv("CHECKPOINT_EVERY_CELLS", "10"))  # namespace checkpoint interval, 0 disables
+    REPLAY_TIME_BUDGET: float = float(os.getenv("REPLAY_TIME_BUDGET", "60"))  # seconds spent replaying cells on restart
+    EXECUTION_WORKERS: int = int(os.getenv("EXECUTION_WORKERS", "4"))  # projects executing code in parallel
+    WSGI_THREADS: int = int(os.getenv("WSGI_THREADS", "8"))  # threads serving the Flask routes under the ASGI entry point
+    CHAT_JOB_WORKERS: int = int(os.getenv("CHAT_JOB_WORKERS", "4"))  # background chat turns running per process
+    MAX_ACTIVE_JOBS_PER_USER: int = int(os.getenv("MAX_ACTIVE_JOBS_PER_USER", "2"))  # queued or running jobs per user
+    MAX_BLOCK_OUTPUT_CHARS: int = int(os.getenv("MAX_BLOCK_OUTPUT_CHARS", "4000"))  # output per code block fed back to the model
+    MAX_TURN_OUTPUT_CHARS: int = int(os.getenv("MAX_TURN_OUTPUT_CHARS", "12000"))  # output per reply fed back to the model
+    
+    # Session state shared by all workers: sqlite:///<path> or memory:// (single worker only)
+    SESSION_STORE_URL: str = os.getenv("SESSION_STORE_URL", "sqlite:///sessions.db")
+    SESSION_CACHE_SIZE: int = int(os.getenv("SESSION_CACHE_SIZE", "1000"))  # entries in each worker's read-through cache
+    
+    # Where kernels run: "local" (in each web worker) or "remote" (dedicated kernel host processes)
+    KERNEL_HOST_MODE: str = os.getenv("KERNEL_HOST_MODE", "local")
+    KERNEL_HOST_AUTHKEY: str = os.getenv("KERNEL_HOST_AUTHKEY", "")  # secret shared by web workers and hosts; required in remote mode
+    
+    # Bearer token for the operator routes under /admin; they are disabled while it is empty
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
     
     # Cohere settings
     COHERE_MODEL_NAME = os.environ.get("COHERE_MODEL_NAME", "command-r-plus")
+    MAX_CONCURRENT_MODEL_CALLS: int = int(os.getenv("MAX_CONCURRENT_MODEL_CALLS", "0"))  # async model calls in flight per process, 0 means unlimited
+    
+    # Conversation history sent to the model
+    HISTORY_TOKEN_BUDGET: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "12000"))  # estimated tokens, excluding system prompt
+    HISTORY_KEEP_RECENT_TURNS: int = int(os.getenv("HISTORY_KEEP_RECENT_TURNS", "2"))  # user turns kept verbatim
     
     # ... rest of the settings class ...
 
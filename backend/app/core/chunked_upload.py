@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from typing import Any, Dict, Optional
+
+from .file_management import adopt_blob, hash_file
+
+logger = logging.getLogger(__name__)
+
+# Subdirectory of the upload folder holding uploads that are still in progress
+PARTIAL_DIR = "partial"
+
+
+class ChunkedUploadManager:
+    """Resumable uploads sent as fixed-size chunks.
+
+    Every upload in progress is a directory holding its state, a data file of
+    the final size and one marker file per chunk received. Chunks are written
+    at their offset in the data file, so they can arrive in any order and in
+    parallel, from any worker process. A client that loses its connection asks
+    for the status and sends only the chunks that are missing. Once all chunks
+    are in, the assembled file is checked against the declared size and hash
+    and moved into the content-addressed blob store.
+    """
+
+    def __init__(self, upload_folder: str, chunk_size: int = 8 * 1024 * 1024, max_age_seconds: int = 24 * 3600):
+        """Initialize the manager.
+
+        Args:
+            upload_folder: Root folder of the uploads
+            chunk_size: Size of every chunk except the last one, in bytes
+            max_age_seconds: Uploads untouched for longer than this are discarded
+        """
+        self.upload_folder = upload_folder
+        self.chunk_size = chunk_size
+        self.max_age_seconds = max_age_seconds
+
+    def _upload_dir(self, upload_id: str) -> str:
+        if not upload_id.isalnum():
+            raise ValueError(f"Invalid upload id: {upload_id}")
+        return os.path.join(self.upload_folder, PARTIAL_DIR, upload_id)
+
+    def _read_state(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self._upload_dir(upload_id), "state.json"), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _received_chunks(self, upload_id: str):
+        chunks_dir = os.path.join(self._upload_dir(upload_id), "chunks")
+        try:
+            return sorted(int(name) for name in os.listdir(chunks_dir) if name.isdigit())
+        except FileNotFoundError:
+            return []
+
+    def initiate(self, user_id: str, paper_id: str, filename: str, total_size: int,
+                 sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Start an upload, or return the one already in progress for the same file.
+
+        Args:
+            user_id: The ID of the user uploading the file
+            paper_id: The ID of the paper or project the file belongs to
+            filename: Original name of the file
+            total_size: Size of the whole file in bytes
+            sha256: SHA-256 hash of the whole file, checked when the upload completes.
+                When given, re-initiating the same upload resumes it.
+
+        Returns:
+            Status of the upload (see ``status``)
+        """
+        if total_size < 0:
+            raise ValueError("total_size must not be negative")
+        self.discard_stale()
+
+        if sha256:
+            # Deterministic id: a client that crashed picks up where it left off
+            key = f"{user_id}\0{paper_id}\0{filename}\0{total_size}\0{sha256.lower()}"
+            upload_id = hashlib.sha256(key.encode()).hexdigest()[:32]
+        else:
+            upload_id = os.urandom(16).hex()
+
+        upload_dir = self._upload_dir(upload_id)
+        if self._read_state(upload_id) is None:
+            os.makedirs(os.path.join(upload_dir, "chunks"), exist_ok=True)
+            with open(os.path.join(upload_dir, "data"), 'wb') as f:
+                f.truncate(total_size)
+
+            state = {
+                'upload_id': upload_id,
+                'user_id': user_id,
+                'paper_id': paper_id,
+                'filename': filename,
+                'total_size': total_size,
+                'sha256': sha256.lower() if sha256 else None,
+                'chunk_size': self.chunk_size,
+                'total_chunks': max(1, -(-total_size // self.chunk_size)),
+                'created_at': time.time(),
+            }
+            tmp_path = os.path.join(upload_dir, "state.json.tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, os.path.join(upload_dir, "state.json"))
+            logger.info(f"Initiated upload {upload_id} of '{filename}' ({total_size} bytes) for paper {paper_id}")
+
+        return self.status(upload_id)
+
+    def put_chunk(self, upload_id: str, index: int, data: bytes, chunk_sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Write one chunk of an upload.
+
+        Args:
+            upload_id: The upload identifier
+            index: Zero-based position of the chunk
+            data: Content of the chunk
+            chunk_sha256: Optional SHA-256 hash of the chunk, checked before it is written
+
+        Returns:
+            Status of the upload
+        """
+        state = self._read_state(upload_id)
+        if state is None:
+            raise KeyError(upload_id)
+        if not 0 <= index < state['total_chunks']:
+            raise ValueError(f"Chunk index {index} is out of range (0-{state['total_chunks'] - 1})")
+
+        offset = index * state['chunk_size']
+        expected_size = min(state['chunk_size'], state['total_size'] - offset)
+        if len(data) != expected_size:
+            raise ValueError(f"Chunk {index} has {len(data)} bytes, expected {expected_size}")
+        digest = hashlib.sha256(data).hexdigest()
+        if chunk_sha256 and digest != chunk_sha256.lower():
+            raise ValueError(f"Chunk {index} does not match its checksum")
+
+        upload_dir = self._upload_dir(upload_id)
+        try:
+            fd = os.open(os.path.join(upload_dir, "data"), os.O_WRONLY)
+        except FileNotFoundError:
+            # Completed (or being completed) by another request
+            raise KeyError(upload_id)
+        try:
+            os.pwrite(fd, data, offset)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        # The marker is written last, so a chunk only counts once its bytes are on disk
+        with open(os.path.join(upload_dir, "chunks", str(index)), 'w') as f:
+            f.write(digest)
+        return self.status(upload_id)
+
+    def status(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """Describe an upload in progress, or None if it does not exist.
+
+        Returns:
+            Dict with the upload's parameters plus ``received_chunks`` and ``missing_chunks``
+        """
+        state = self._read_state(upload_id)
+        if state is None:
+            return None
+        received = self._received_chunks(upload_id)
+        received_set = set(received)
+        return {
+            **state,
+            'received_chunks': received,
+            'missing_chunks': [index for index in range(state['total_chunks']) if index not in received_set],
+        }
+
+    def complete(self, upload_id: str) -> Dict[str, Any]:
+        """Verify the assembled file and move it into the blob store.
+
+        Only one of several concurrent calls completes the upload; it claims the
+        data file by renaming it first.
+
+        Returns:
+            Dict with the upload's ``user_id``, ``paper_id``, ``filename``,
+            ``content_hash``, ``local_filepath``, ``size`` and ``deduplicated``
+
+        Raises:
+            KeyError: If there is no such upload, or it was completed meanwhile
+            ValueError: If the upload is incomplete, invalid or being completed by another request
+        """
+        status = self.status(upload_id)
+        if status is None:
+            raise KeyError(upload_id)
+        if status['missing_chunks']:
+            raise ValueError(f"Upload is missing {len(status['missing_chunks'])} chunks")
+
+        upload_dir = self._upload_dir(upload_id)
+        data_path = os.path.join(upload_dir, "data")
+        completing_path = f"{data_path}.completing"
+        try:
+            os.rename(data_path, completing_path)
+        except FileNotFoundError:
+            if self._read_state(upload_id) is None:
+                raise KeyError(upload_id)
+            raise ValueError("Upload is already being completed")
+
+        try:
+            size = os.path.getsize(completing_path)
+            if size != status['total_size']:
+                os.replace(completing_path, data_path)
+                raise ValueError(f"Assembled file has {size} bytes, expected {status['total_size']}")
+            content_hash = hash_file(completing_path)
+            if status['sha256'] and content_hash != status['sha256']:
+                # Every chunk matched when it arrived, so the data cannot be trusted; start over
+                shutil.rmtree(upload_dir, ignore_errors=True)
+                raise ValueError("Assembled file does not match the declared SHA-256 hash")
+
+            ext = os.path.splitext(status['filename'])[1]
+            blob_path, deduplicated = adopt_blob(completing_path, self.upload_folder, content_hash, ext)
+        except OSError:
+            # Give the data back so the client can try again
+            if os.path.exists(completing_path):
+                os.replace(completing_path, data_path)
+            raise
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        logger.info(f"Completed upload {upload_id} of '{status['filename']}' as blob {content_hash[:12]}")
+
+        return {
+            'user_id': status['user_id'],
+            'paper_id': status['paper_id'],
+            'filename': status['filename'],
+            'content_hash': content_hash,
+            'local_filepath': blob_path,
+            'size': size,
+            'deduplicated': deduplicated,
+        }
+
+    def discard_stale(self):
+        """Remove uploads that have not received a chunk for ``max_age_seconds``."""
+        partial_dir = os.path.join(self.upload_folder, PARTIAL_DIR)
+        if not os.path.isdir(partial_dir):
+            return
+        cutoff = time.time() - self.max_age_seconds
+        for upload_id in os.listdir(partial_dir):
+            upload_dir = os.path.join(partial_dir, upload_id)
+            try:
+                last_activity = os.path.getmtime(os.path.join(upload_dir, "chunks"))
+            except OSError:
+                try:
+                    last_activity = os.path.getmtime(upload_dir)
+                except OSError:
+                    # Completed or discarded by another request meanwhile
+                    continue
+            if last_activity < cutoff:
+                logger.info(f"Discarding stale upload {upload_id}")
+                shutil.rmtree(upload_dir, ignore_errors=True)
@@ -0,0 +1,312 @@
+import os
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from .dataset_cache import load_dataset
+
+logger = logging.getLogger(__name__)
+
+# Extension of the cached association tables, after the dataset key and method
+ASSOCIATIONS_EXT = ".json"
+
+# Text columns with more distinct values than this (identifiers, free text) are left out
+MAX_CATEGORIES = 50
+
+# Larger datasets are reduced to a fixed random sample of rows
+MAX_ROWS = 200000
+
+# Pairs need at least this many rows where both columns are present
+MIN_PAIR_ROWS = 3
+
+
+def benjamini_hochberg(p_values: np.ndarray) -> np.ndarray:
+    """Adjust p-values for multiple testing with the Benjamini-Hochberg procedure.
+
+    Missing p-values stay missing and do not count towards the number of tests.
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    q_values = np.full(len(p_values), np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    if len(tested) == 0:
+        return q_values
+
+    order = tested[np.argsort(p_values[tested])]
+    ranked = p_values[order] * len(tested) / np.arange(1, len(tested) + 1)
+    # q-values are monotone: each is the smallest adjusted value at or above its rank
+    q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q_values
+
+
+def _split_columns(df: pd.DataFrame, max_categories: int) -> Tuple[List[str], List[str]]:
+    """Split the columns that can be tested into numeric and categorical ones."""
+    numeric, categorical = [], []
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_bool_dtype(column) or not pd.api.types.is_numeric_dtype(column):
+            if pd.api.types.is_datetime64_any_dtype(column):
+                continue
+            if 2 <= column.nunique(dropna=True) <= max_categories:
+                categorical.append(name)
+        elif column.nunique(dropna=True) >= 2:
+            numeric.append(name)
+    return numeric, categorical
+
+
+def _pairwise_pearson(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Pearson correlation of every pair of columns over the rows where both are present.
+
+    Args:
+        values: Array of shape (rows, columns) with NaN for missing values
+
+    Returns:
+        Tuple of (correlation matrix, matrix of pairwise row counts)
+    """
+    mask = ~np.isnan(values)
+    # Centre each column first so the sums below do not lose precision
+    centred = np.where(mask, values - np.nanmean(values, axis=0), 0.0)
+    weights = mask.astype(float)
+
+    n = weights.T @ weights
+    sum_x = centred.T @ weights            # sum of column i over rows where column j is present
+    sum_xx = (centred * centred).T @ weights
+    sum_xy = centred.T @ centred
+
+    covariance = n * sum_xy - sum_x * sum_x.T
+    variance = n * sum_xx - sum_x ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = covariance / np.sqrt(variance * variance.T)
+    r[n < MIN_PAIR_ROWS] = np.nan
+    return np.clip(r, -1.0, 1.0), n
+
+
+def _pairwise_spearman(values: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Spearman correlation of every pair of columns, ranking each pair over the rows where both are present.
+
+    Ranking each column once over all its rows would skew the ranks of every
+    pair in which the other column has gaps.
+
+    Args:
+        values: Numeric columns, with NaN for missing values
+
+    Returns:
+        Tuple of (correlation matrix, matrix of pairwise row counts)
+    """
+    weights = values.notna().to_numpy(dtype=float)
+    r = values.corr(method='spearman', min_periods=MIN_PAIR_ROWS).to_numpy(dtype=float)
+    return np.clip(r, -1.0, 1.0), weights.T @ weights
+
+
+def _correlation_p_values(r: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """Two-sided p-values of correlation coefficients from the t distribution."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = r * np.sqrt((n - 2) / (1.0 - r ** 2))
+    return 2 * stats.t.sf(np.abs(t), np.maximum(n - 2, 1))
+
+
+def _cramers_v(codes_a: np.ndarray, codes_b: np.ndarray) -> Tuple[float, int, float]:
+    """Cramér's V between two factorized columns, with its chi-squared p-value."""
+    valid = (codes_a >= 0) & (codes_b >= 0)
+    a, b = codes_a[valid], codes_b[valid]
+    n = len(a)
+    if n < MIN_PAIR_ROWS:
+        return np.nan, n, np.nan
+
+    # Only levels present in this pair's rows count
+    _, a = np.unique(a, return_inverse=True)
+    _, b = np.unique(b, return_inverse=True)
+    rows, cols = a.max() + 1, b.max() + 1
+    if rows < 2 or cols < 2:
+        return np.nan, n, np.nan
+
+    observed = np.bincount(a * cols + b, minlength=rows * cols).reshape(rows, cols)
+    expected = np.outer(observed.sum(axis=1), observed.sum(axis=0)) / n
+    chi2 = float(((observed - expected) ** 2 / expected).sum())
+    v = np.sqrt(chi2 / (n * (min(rows, cols) - 1)))
+    return float(v), n, float(stats.chi2.sf(chi2, (rows - 1) * (cols - 1)))
+
+
+def _correlation_ratio(codes: np.ndarray, values: np.ndarray) -> Tuple[float, int, float]:
+    """Correlation ratio (eta) of a numeric column across the levels of a categorical one."""
+    valid = (codes >= 0) & ~np.isnan(values)
+    groups, x = codes[valid], values[valid]
+    n = len(x)
+    _, groups = np.unique(groups, return_inverse=True)
+    k = groups.max() + 1 if n else 0
+    if n < MIN_PAIR_ROWS or k < 2 or n <= k:
+        return np.nan, n, np.nan
+
+    counts = np.bincount(groups, minlength=k)
+    means = np.bincount(groups, weights=x, minlength=k) / counts
+    grand_mean = x.mean()
+    ss_between = float((counts * (means - grand_mean) ** 2).sum())
+    ss_total = float(((x - grand_mean) ** 2).sum())
+    if ss_total == 0:
+        return np.nan, n, np.nan
+
+    eta = np.sqrt(ss_between / ss_total)
+    ss_within = ss_total - ss_between
+    if ss_within <= 0:
+        return float(eta), n, 0.0
+    f = (ss_between / (k - 1)) / (ss_within / (n - k))
+    return float(eta), n, float(stats.f.sf(f, k - 1, n - k))
+
+
+def compute_associations(df: pd.DataFrame, method: str = 'spearman', max_categories: int = MAX_CATEGORIES,
+                         max_rows: int = MAX_ROWS) -> pd.DataFrame:
+    """Measure the association between every pair of columns.
+
+    Numeric pairs use Pearson or Spearman correlation, categorical pairs use
+    Cramér's V, and numeric/categorical pairs use the point-biserial
+    correlation for two-level categories and the correlation ratio (eta) for
+    more levels. Every pair uses the rows where both columns are present.
+    The p-values are adjusted for the number of pairs tested with the
+    Benjamini-Hochberg procedure.
+
+    Args:
+        df: The dataset
+        method: 'spearman' or 'pearson', for numeric pairs
+        max_categories: Text columns with more distinct values are left out
+        max_rows: Larger datasets are reduced to a fixed random sample of this many rows
+
+    Returns:
+        DataFrame with one row per pair: column_a, column_b, measure, value,
+        strength (absolute value), n, p_value and q_value, strongest first
+    """
+    if method not in ('spearman', 'pearson'):
+        raise ValueError(f"Unknown correlation method: {method}")
+    if len(df) > max_rows:
+        df = df.sample(max_rows, random_state=0)
+
+    numeric, categorical = _split_columns(df, max_categories)
+    codes = {name: pd.factorize(df[name], sort=True)[0] for name in categorical}
+    binary = [name for name in categorical if codes[name].max() == 1]
+    pairs: List[Dict[str, Any]] = []
+
+    def add(column_a, column_b, measure, value, n, p_value):
+        pairs.append({'column_a': column_a, 'column_b': column_b, 'measure': measure,
+                      'value': value, 'n': int(n), 'p_value': p_value})
+
+    # Numeric pairs, all at once
+    if len(numeric) >= 2:
+        if method == 'spearman':
+            r, n = _pairwise_spearman(df[numeric].astype(float))
+        else:
+            r, n = _pairwise_pearson(df[numeric].to_numpy(dtype=float, na_value=np.nan))
+        p = _correlation_p_values(r, n)
+        for i, j in zip(*np.triu_indices(len(numeric), k=1)):
+            add(numeric[i], numeric[j], method, r[i, j], n[i, j], p[i, j])
+
+    # Numeric against two-level categorical: point-biserial, i.e. Pearson against a 0/1 indicator
+    if numeric and binary:
+        indicators = np.column_stack([np.where(codes[name] >= 0, codes[name], np.nan) for name in binary])
+        values = np.column_stack([df[numeric].to_numpy(dtype=float, na_value=np.nan), indicators])
+        r, n = _pairwise_pearson(values)
+        p = _correlation_p_values(r, n)
+        for j, name in enumerate(binary, start=len(numeric)):
+            for i, numeric_name in enumerate(numeric):
+                add(numeric_name, name, 'point_biserial', r[i, j], n[i, j], p[i, j])
+
+    # Numeric against categorical with more levels: correlation ratio
+    for name in categorical:
+        if name in binary:
+            continue
+        for numeric_name in numeric:
+            eta, n, p = _correlation_ratio(codes[name], df[numeric_name].to_numpy(dtype=float, na_value=np.nan))
+            add(numeric_name, name, 'eta', eta, n, p)
+
+    # Categorical pairs
+    for i, name_a in enumerate(categorical):
+        for name_b in categorical[i + 1:]:
+            v, n, p = _cramers_v(codes[name_a], codes[name_b])
+            add(name_a, name_b, 'cramers_v', v, n, p)
+
+    result = pd.DataFrame(pairs, columns=['column_a', 'column_b', 'measure', 'value', 'n', 'p_value'])
+    result['q_value'] = benjamini_hochberg(result['p_value'].to_numpy(dtype=float))
+    result['strength'] = result['value'].abs()
+    result = result.sort_values('strength', ascending=False, na_position='last', ignore_index=True)
+    return result[['column_a', 'column_b', 'measure', 'value', 'strength', 'n', 'p_value', 'q_value']]
+
+
+def get_associations_path(cache_dir: str, key: str, method: str) -> str:
+    """Get the path of a dataset's cached association table."""
+    return os.path.join(cache_dir, f"{key}.associations.{method}{ASSOCIATIONS_EXT}")
+
+
+def dataset_associations(path: str, method: str = 'spearman', cache_dir: Optional[str] = None,
+                         key: Optional[str] = None) -> pd.DataFrame:
+    """Return the association table of a cached dataset, computing it on first use.
+
+    Args:
+        path: Path of the dataset's columnar copy
+        method: 'spearman' or 'pearson', for numeric pairs
+        cache_dir: Directory holding the cached tables (defaults to the dataset's directory)
+        key: Cache key for the dataset (defaults to the file name, which is its content hash)
+
+    Returns:
+        The table from ``compute_associations``
+    """
+    cache_dir = cache_dir or os.path.dirname(path)
+    key = key or os.path.basename(path).split('.')[0]
+    cache_path = get_associations_path(cache_dir, key, method)
+    try:
+        with open(cache_path, 'r') as f:
+            cached = json.load(f)
+        # Stored with its columns, so a dataset without testable pairs still gets the full table layout
+        return pd.DataFrame(cached['data'], columns=cached['columns'])
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        pass
+
+    result = compute_associations(load_dataset(path), method=method)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        # NaN is not valid JSON; missing values are stored as null
+        json.dump(result.astype(object).where(result.notna(), None).to_dict('split'), f)
+    os.replace(tmp_path, cache_path)
+    logger.info(f"Computed {len(result)} column associations for '{path}'")
+    return result
+
+
+def association_matrix(data: Union[str, pd.DataFrame], method: str = 'spearman') -> pd.DataFrame:
+    """Square matrix of association values between the columns of a dataset.
+
+    Args:
+        data: A DataFrame, or the path of a cached dataset (whose table is cached too)
+        method: 'spearman' or 'pearson', for numeric pairs
+
+    Returns:
+        Symmetric DataFrame indexed by column name; see ``compute_associations``
+        for the measure used for each pair
+    """
+    pairs = dataset_associations(data, method) if isinstance(data, str) else compute_associations(data, method)
+    columns = list(dict.fromkeys(pairs['column_a'].tolist() + pairs['column_b'].tolist()))
+    matrix = pd.DataFrame(np.eye(len(columns)), index=columns, columns=columns)
+    for row in pairs.itertuples(index=False):
+        matrix.loc[row.column_a, row.column_b] = row.value
+        matrix.loc[row.column_b, row.column_a] = row.value
+    return matrix
+
+
+def format_associations(pairs: pd.DataFrame, top_k: int = 10, alpha: float = 0.05) -> str:
+    """Render the strongest significant associations as compact text for the prompt.
+
+    Args:
+        pairs: Table from ``compute_associations`` or ``dataset_associations``
+        top_k: Number of pairs listed
+        alpha: Largest Benjamini-Hochberg adjusted p-value listed
+
+    Returns:
+        One line per pair, or an empty string if none is significant
+    """
+    significant = pairs[pairs['q_value'] <= alpha].dropna(subset=['value'])
+    lines = [
+        f"{row.column_a} ~ {row.column_b}: {row.measure} {row.value:.2f} (q={row.q_value:.2g}, n={row.n})"
+        for row in significant.head(top_k).itertuples(index=False)
+    ]
+    if len(significant) > top_k:
+        lines.append(f"[... {len(significant) - top_k} more significant pairs ...]")
+    return "\n".join(lines)
@@ -0,0 +1,125 @@
+import os
+import logging
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+logger = logging.getLogger(__name__)
+
+# Extension of the cached Arrow IPC files
+COLUMNAR_EXT = ".arrow"
+
+# File types that can be converted to the columnar cache
+CONVERTIBLE_EXTS = {".csv", ".tsv", ".txt", ".xlsx", ".xls"}
+
+
+def get_columnar_path(cache_dir: str, key: str) -> str:
+    """Get the path of a dataset's columnar copy in the cache."""
+    return os.path.join(cache_dir, f"{key}{COLUMNAR_EXT}")
+
+
+def _write_batches(reader, target_path: str):
+    """Stream record batches into an Arrow IPC file."""
+    with pa.OSFile(target_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+
+
+def read_table(source_path: str, ext: str) -> pa.Table:
+    """Read a CSV, Excel or delimited text file into an Arrow table with pandas.
+
+    Args:
+        source_path: Path of the file
+        ext: Lower-case extension of the file, dot included
+
+    Returns:
+        The whole file as an Arrow table
+    """
+    import pandas as pd
+    if ext in (".xlsx", ".xls"):
+        df = pd.read_excel(source_path)
+    elif ext == ".csv":
+        df = pd.read_csv(source_path)
+    else:
+        # Let pandas sniff the delimiter of .tsv and .txt files
+        df = pd.read_csv(source_path, sep=None, engine="python")
+    # Arrow needs string column names and homogeneous object columns
+    df.columns = [str(column) for column in df.columns]
+    for column in df.select_dtypes(include="object").columns:
+        df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def convert_to_columnar(source_path: str, cache_dir: str, key: Optional[str] = None) -> Optional[str]:
+    """Convert an uploaded CSV or Excel file to an Arrow IPC file, once.
+
+    CSV files are streamed through Arrow's multi-threaded reader batch by
+    batch; Excel files are parsed once with pandas. If the columnar copy
+    already exists it is reused.
+
+    Args:
+        source_path: Path of the uploaded file
+        cache_dir: Directory holding the columnar copies
+        key: Cache key for the dataset (defaults to the file's name without its
+            extension, which for stored uploads is their content hash)
+
+    Returns:
+        Path of the Arrow IPC file, or None if the file type is not supported
+    """
+    ext = os.path.splitext(source_path)[1].lower()
+    if ext not in CONVERTIBLE_EXTS:
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = key or os.path.splitext(os.path.basename(source_path))[0]
+    target_path = get_columnar_path(cache_dir, key)
+    if os.path.exists(target_path):
+        return target_path
+
+    # Write to a temporary file so a half-written cache entry is never picked up
+    tmp_path = f"{target_path}.{os.getpid()}.tmp"
+    try:
+        if ext == ".csv":
+            try:
+                reader = pa_csv.open_csv(source_path, read_options=pa_csv.ReadOptions(block_size=16 << 20))
+                _write_batches(reader, tmp_path)
+            except pa.ArrowInvalid:
+                # Types inferred from the first block did not hold for later ones
+                table = read_table(source_path, ext)
+                _write_batches(pa.RecordBatchReader.from_batches(table.schema, table.to_batches()), tmp_path)
+        else:
+            table = read_table(source_path, ext)
+            _write_batches(pa.RecordBatchReader.from_batches(table.schema, table.to_batches()), tmp_path)
+        os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    logger.info(f"Converted '{source_path}' to columnar cache at '{target_path}'")
+    return target_path
+
+
+def load_dataset(path: str, arrow_backed: bool = False):
+    """Load a cached dataset into a pandas DataFrame by memory-mapping it.
+
+    The Arrow file is memory-mapped, so reading it takes milliseconds and the
+    OS page cache is shared by every kernel that opens the same dataset.
+
+    Args:
+        path: Path of the Arrow IPC file
+        arrow_backed: Keep the columns backed by the memory-mapped Arrow buffers
+            (pd.ArrowDtype) instead of converting them to NumPy. This avoids
+            copying the data into each kernel, at the cost of some pandas and
+            scikit-learn operations converting on the fly.
+
+    Returns:
+        The dataset as a pandas DataFrame
+    """
+    import pandas as pd
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    if arrow_backed:
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    return table.to_pandas()
@@ -0,0 +1,268 @@
+import os
+import json
+import logging
+from collections import Counter
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+from .dataset_cache import COLUMNAR_EXT, read_table
+
+logger = logging.getLogger(__name__)
+
+# Extension of the cached profiles
+PROFILE_EXT = ".profile.json"
+
+# Distinct values tracked per text column before the counts become approximate
+MAX_TRACKED_VALUES = 10000
+
+# Most frequent values kept per text column
+TOP_VALUES = 5
+
+
+def get_profile_path(cache_dir: str, key: str) -> str:
+    """Get the path of a dataset's cached profile."""
+    return os.path.join(cache_dir, f"{key}{PROFILE_EXT}")
+
+
+def iter_batches(path: str) -> Iterator[pa.RecordBatch]:
+    """Yield a dataset's record batches without loading the whole file.
+
+    Arrow IPC files from the dataset cache are memory-mapped and CSV files are
+    streamed block by block. Other formats have to be parsed by pandas at once.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == COLUMNAR_EXT:
+        reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index)
+    elif ext == ".csv":
+        yield from pa_csv.open_csv(path, read_options=pa_csv.ReadOptions(block_size=16 << 20))
+    else:
+        yield from read_table(path, ext).to_batches()
+
+
+class _NumericAccumulator:
+    """Count, extremes and moments of a numeric column, merged batch by batch."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.zeros = 0
+
+    def update(self, values: np.ndarray):
+        values = values[~np.isnan(values)]
+        n = len(values)
+        if n == 0:
+            return
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+
+        # Chan et al.: combine the moments of two partitions
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += batch_m2 + delta * delta * self.count * n / total
+        self.count = total
+
+        batch_min, batch_max = float(values.min()), float(values.max())
+        self.min = batch_min if self.min is None else min(self.min, batch_min)
+        self.max = batch_max if self.max is None else max(self.max, batch_max)
+        self.zeros += int((values == 0).sum())
+
+    def result(self) -> Dict[str, Any]:
+        if self.count == 0:
+            return {}
+        return {
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'std': (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0,
+            'zeros': self.zeros,
+        }
+
+
+class _CategoricalAccumulator:
+    """Value counts of a text or boolean column, merged batch by batch."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.exact = True
+
+    def update(self, column: pa.Array):
+        for item in pc.value_counts(column.drop_null()).to_pylist():
+            self.counts[item['values']] += item['counts']
+        if len(self.counts) > MAX_TRACKED_VALUES:
+            # Keep the frequent values; from here on the distinct count is a lower bound
+            self.counts = Counter(dict(self.counts.most_common(MAX_TRACKED_VALUES // 2)))
+            self.exact = False
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            'distinct': len(self.counts),
+            'distinct_exact': self.exact,
+            'top_values': [[str(value), count] for value, count in self.counts.most_common(TOP_VALUES)],
+        }
+
+
+class _TemporalAccumulator:
+    """Range of a date or timestamp column."""
+
+    def __init__(self):
+        self.min = None
+        self.max = None
+
+    def update(self, column: pa.Array):
+        extremes = pc.min_max(column)
+        if extremes['min'].is_valid:
+            batch_min, batch_max = extremes['min'].as_py(), extremes['max'].as_py()
+            self.min = batch_min if self.min is None else min(self.min, batch_min)
+            self.max = batch_max if self.max is None else max(self.max, batch_max)
+
+    def result(self) -> Dict[str, Any]:
+        if self.min is None:
+            return {}
+        return {'min': str(self.min), 'max': str(self.max)}
+
+
+def _column_kind(data_type: pa.DataType) -> str:
+    if pa.types.is_boolean(data_type):
+        return 'boolean'
+    if pa.types.is_integer(data_type) or pa.types.is_floating(data_type) or pa.types.is_decimal(data_type):
+        return 'numeric'
+    if pa.types.is_temporal(data_type):
+        return 'datetime'
+    if pa.types.is_dictionary(data_type) or pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+        return 'text'
+    return 'other'
+
+
+def compute_profile(path: str) -> Dict[str, Any]:
+    """Profile a dataset in a single streaming pass over its record batches.
+
+    Every batch is summarised with vectorized Arrow and NumPy operations and
+    merged into running totals, so memory use depends on the batch size and
+    not on the size of the file.
+
+    Returns:
+        Dict with the row count and, per column, its type, missing-value count
+        and descriptive statistics
+    """
+    rows = 0
+    schema = None
+    missing: List[int] = []
+    accumulators: List[Any] = []
+
+    for batch in iter_batches(path):
+        if schema is None:
+            schema = batch.schema
+            for field in schema:
+                kind = _column_kind(field.type)
+                missing.append(0)
+                if kind == 'numeric':
+                    accumulators.append(_NumericAccumulator())
+                elif kind in ('text', 'boolean'):
+                    accumulators.append(_CategoricalAccumulator())
+                elif kind == 'datetime':
+                    accumulators.append(_TemporalAccumulator())
+                else:
+                    accumulators.append(None)
+
+        rows += batch.num_rows
+        for index, column in enumerate(batch.columns):
+            missing[index] += column.null_count
+            accumulator = accumulators[index]
+            if isinstance(accumulator, _NumericAccumulator):
+                values = column.cast(pa.float64()).to_numpy(zero_copy_only=False)
+                # NaN counts as missing, like in pandas
+                missing[index] += int(np.isnan(values).sum()) - column.null_count
+                accumulator.update(values)
+            elif accumulator is not None:
+                accumulator.update(column)
+
+    columns = []
+    for index, field in enumerate(schema or []):
+        column = {
+            'name': field.name,
+            'type': str(field.type),
+            'kind': _column_kind(field.type),
+            'missing': missing[index],
+        }
+        if accumulators[index] is not None:
+            column.update(accumulators[index].result())
+        columns.append(column)
+
+    return {'rows': rows, 'columns': columns}
+
+
+def profile_dataset(path: str, cache_dir: str, key: str) -> Dict[str, Any]:
+    """Return a dataset's profile, computing and caching it on first use.
+
+    Args:
+        path: Path of the dataset, preferably its columnar copy
+        cache_dir: Directory holding the cached profiles
+        key: Cache key for the dataset, normally its content hash
+
+    Returns:
+        The profile from ``compute_profile``
+    """
+    profile_path = get_profile_path(cache_dir, key)
+    try:
+        with open(profile_path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        pass
+
+    profile = compute_profile(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{profile_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f)
+    os.replace(tmp_path, profile_path)
+    logger.info(f"Profiled '{path}': {profile['rows']} rows, {len(profile['columns'])} columns")
+    return profile
+
+
+def _format_number(value: float) -> str:
+    return f"{value:.4g}"
+
+
+def format_profile(profile: Dict[str, Any], max_columns: int = 60) -> str:
+    """Render a profile as a compact text block for the prompt.
+
+    Args:
+        profile: Profile from ``profile_dataset``
+        max_columns: Columns described before the rest are only counted
+
+    Returns:
+        One header line plus one line per column
+    """
+    rows = profile['rows']
+    lines = [f"{rows} rows x {len(profile['columns'])} columns"]
+    for column in profile['columns'][:max_columns]:
+        parts = [column['type']]
+        if column['missing']:
+            parts.append(f"missing {column['missing']} ({column['missing'] / max(rows, 1):.0%})")
+        if column['kind'] == 'numeric' and 'mean' in column:
+            parts.append(
+                f"min {_format_number(column['min'])}, max {_format_number(column['max'])}, "
+                f"mean {_format_number(column['mean'])}, std {_format_number(column['std'])}"
+            )
+        elif 'distinct' in column:
+            distinct = column['distinct'] if column['distinct_exact'] else f">{column['distinct']}"
+            top = ", ".join(f"{value} ({count})" for value, count in column['top_values'][:3])
+            parts.append(f"{distinct} distinct; top: {top}")
+        elif column['kind'] == 'datetime' and 'min' in column:
+            parts.append(f"{column['min']} to {column['max']}")
+        lines.append(f"{column['name']}: {'; '.join(parts)}")
+
+    hidden = len(profile['columns']) - max_columns
+    if hidden > 0:
+        lines.append(f"[... {hidden} more columns ...]")
+    return "\n".join(lines)
@@ -0,0 +1,299 @@
+import io
+import os
+import csv
+import json
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .dataset_profile import iter_batches
+
+logger = logging.getLogger(__name__)
+
+# Rows kept in the uniform reservoir that fills whatever budget is left
+RESERVOIR_SIZE = 200
+
+# Distinct values per column for which a representative row is tracked
+MAX_TRACKED_CATEGORIES = 100
+
+# Rarest values per categorical column the sample tries to show
+RARE_VALUES_PER_COLUMN = 2
+
+# Columns that are only considered categorical up to this many distinct values
+MAX_CATEGORY_VALUES = 1000
+
+# Name of the column explaining why each row was picked
+REASON_COLUMN = "sampled_for"
+
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _row_keys(start: int, count: int, seed: int) -> np.ndarray:
+    """Deterministic pseudo-random key per row (splitmix64 of the row number).
+
+    The keys depend only on the row number and the seed, so the sample does
+    not change with the size of the batches the file is read in.
+    """
+    with np.errstate(over='ignore'):
+        z = np.arange(start, start + count, dtype=np.uint64) * GOLDEN_GAMMA + np.uint64(seed) * GOLDEN_GAMMA
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+class _SampleBuilder:
+    """Collects candidate rows batch by batch in a single pass."""
+
+    def __init__(self, seed: int):
+        self.seed = seed
+        self.offset = 0
+        self.names: List[str] = []
+        self.rows: Dict[int, Dict[str, Any]] = {}
+        # Uniform sample: the rows with the smallest keys (a vectorized reservoir)
+        self.reservoir: List[Tuple[int, int]] = []
+        self.minimum: Dict[str, Tuple[float, int]] = {}
+        self.maximum: Dict[str, Tuple[float, int]] = {}
+        self.missing: Dict[str, int] = {}
+        self.category_counts: Dict[str, Counter] = {}
+        self.category_rows: Dict[str, Dict[Any, int]] = {}
+
+    def _keep(self, batch: pa.RecordBatch, indices: np.ndarray):
+        """Remember the content of rows that are candidates for the sample."""
+        new = [int(i) for i in indices if self.offset + int(i) not in self.rows]
+        if new:
+            for i, row in zip(new, batch.take(pa.array(new)).to_pylist()):
+                self.rows[self.offset + i] = row
+
+    def add(self, batch: pa.RecordBatch):
+        if not self.names:
+            self.names = batch.schema.names
+            self.category_counts = {name: Counter() for name in self.names}
+            self.category_rows = {name: {} for name in self.names}
+
+        n = batch.num_rows
+        keys = _row_keys(self.offset, n, self.seed)
+        local = np.argpartition(keys, RESERVOIR_SIZE)[:RESERVOIR_SIZE] if n > RESERVOIR_SIZE else np.arange(n)
+        self._keep(batch, local)
+        merged = self.reservoir + [(int(keys[i]), self.offset + int(i)) for i in local]
+        self.reservoir = sorted(merged)[:RESERVOIR_SIZE]
+
+        for name, column in zip(self.names, batch.columns):
+            if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+                values = column.cast(pa.float64()).to_numpy(zero_copy_only=False)
+                missing = np.isnan(values)
+                if not missing.all():
+                    low, high = int(np.nanargmin(values)), int(np.nanargmax(values))
+                    if name not in self.minimum or values[low] < self.minimum[name][0]:
+                        self._keep(batch, np.array([low]))
+                        self.minimum[name] = (float(values[low]), self.offset + low)
+                    if name not in self.maximum or values[high] > self.maximum[name][0]:
+                        self._keep(batch, np.array([high]))
+                        self.maximum[name] = (float(values[high]), self.offset + high)
+            elif pa.types.is_temporal(column.type):
+                missing = column.is_null().to_numpy(zero_copy_only=False)
+            else:
+                missing = column.is_null().to_numpy(zero_copy_only=False)
+                counts = self.category_counts[name]
+                if counts is not None:
+                    series = column.to_pandas()
+                    counts.update(series.value_counts(dropna=True).to_dict())
+                    if len(counts) > MAX_CATEGORY_VALUES:
+                        # Free text or identifiers rather than categories
+                        self.category_counts[name] = None
+                        self.category_rows[name] = {}
+                    else:
+                        tracked = self.category_rows[name]
+                        first_rows = series.dropna().drop_duplicates()
+                        new_values = [(value, i) for i, value in first_rows.items() if value not in tracked]
+                        new_values = new_values[:max(0, MAX_TRACKED_CATEGORIES - len(tracked))]
+                        self._keep(batch, np.array([i for _, i in new_values], dtype=int))
+                        for value, i in new_values:
+                            tracked[value] = self.offset + int(i)
+
+            if name not in self.missing and missing.any():
+                first = int(np.flatnonzero(missing)[0])
+                self._keep(batch, np.array([first]))
+                self.missing[name] = self.offset + first
+
+        self.offset += n
+        self._prune()
+
+    def _prune(self):
+        """Forget rows that are no longer candidates, so memory does not grow with the file."""
+        referenced = {row_id for _, row_id in self.reservoir}
+        referenced.update(row_id for _, row_id in self.minimum.values())
+        referenced.update(row_id for _, row_id in self.maximum.values())
+        referenced.update(self.missing.values())
+        for tracked in self.category_rows.values():
+            referenced.update(tracked.values())
+        self.rows = {row_id: row for row_id, row in self.rows.items() if row_id in referenced}
+
+    def priorities(self) -> List[Tuple[int, str]]:
+        """Candidate rows in the order they should be included, with the reason for each."""
+        picks: List[Tuple[int, str]] = []
+        if self.reservoir:
+            picks.append((self.reservoir[0][1], "random"))
+
+        rare: Dict[str, List[Tuple[Any, int]]] = {}
+        for name in self.names:
+            counts = self.category_counts.get(name)
+            if counts and len(counts) > 1:
+                tracked = self.category_rows[name]
+                rarest = sorted((count, str(value), value) for value, count in counts.items() if value in tracked)
+                rare[name] = [(value, tracked[value]) for _, _, value in rarest[:RARE_VALUES_PER_COLUMN]]
+
+        for round_index in range(max(2, RARE_VALUES_PER_COLUMN)):
+            for name in self.names:
+                if round_index == 0:
+                    if name in self.missing:
+                        picks.append((self.missing[name], f"missing {name}"))
+                    if name in self.minimum:
+                        picks.append((self.minimum[name][1], f"min {name}"))
+                elif round_index == 1 and name in self.maximum:
+                    picks.append((self.maximum[name][1], f"max {name}"))
+                if name in rare and round_index < len(rare[name]):
+                    value, row_id = rare[name][round_index]
+                    picks.append((row_id, f"rare {name}={value}"))
+
+        picks.extend((row_id, "random") for _, row_id in self.reservoir[1:])
+        return picks
+
+
+def _csv_line(values: List[Any]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(["" if value is None else value for value in values])
+    return buffer.getvalue()
+
+
+def _sample_line(row_id: int, values: List[Any], reasons: List[str]) -> str:
+    """A sample row as written for the prompt: row number, values and why it was picked."""
+    return _csv_line([row_id] + values + ["; ".join(reasons)])
+
+
+def compute_sample(batches, max_bytes: int = 4000, seed: int = 0) -> Dict[str, Any]:
+    """Pick a small, deterministic and stratified sample of rows in one pass.
+
+    The sample covers, in order of priority: a random row, a row with each
+    column missing, the minimum and maximum of each numeric column, the
+    rarest values of each categorical column, and then uniformly random rows
+    until the byte budget is used up. Rows are chosen by their position in
+    the file and a seeded hash, so the same file always gives the same sample.
+
+    Args:
+        batches: Iterable of Arrow record batches
+        max_bytes: Budget for the sample as rendered by ``format_sample``, header, row numbers
+            and reasons included
+        seed: Seed for the random part of the sample
+
+    Returns:
+        Dict with the column ``names``, the picked ``row_ids``, their ``rows`` and the ``reasons`` for each
+    """
+    builder = _SampleBuilder(seed)
+    for batch in batches:
+        builder.add(batch)
+
+    used = len(_csv_line(["row"] + builder.names + [REASON_COLUMN]))
+    reasons: Dict[int, List[str]] = {}
+    sizes: Dict[int, int] = {}
+    for row_id, reason in builder.priorities():
+        values = [builder.rows[row_id][name] for name in builder.names]
+        if row_id in reasons:
+            if reason == "random":
+                continue
+            # A row picked for several reasons lists them all, if the longer line still fits
+            size = len(_sample_line(row_id, values, reasons[row_id] + [reason]))
+            if used - sizes[row_id] + size <= max_bytes:
+                used += size - sizes[row_id]
+                sizes[row_id] = size
+                reasons[row_id].append(reason)
+            continue
+        size = len(_sample_line(row_id, values, [reason]))
+        if used + size > max_bytes:
+            continue
+        used += size
+        sizes[row_id] = size
+        reasons[row_id] = [reason]
+
+    row_ids = sorted(reasons)
+    return {
+        'names': builder.names,
+        'row_ids': row_ids,
+        'rows': [[builder.rows[row_id][name] for name in builder.names] for row_id in row_ids],
+        'reasons': ["; ".join(reasons[row_id]) for row_id in row_ids],
+    }
+
+
+def get_sample_path(cache_dir: str, key: str, max_bytes: int, seed: int) -> str:
+    """Get the path of a dataset's cached sample."""
+    # v2: the budget covers the row numbers and reasons too, so samples cached before are not reused
+    return os.path.join(cache_dir, f"{key}.sample.v2.{max_bytes}.{seed}.json")
+
+
+def dataset_sample(path: str, max_bytes: int = 4000, seed: int = 0, cache_dir: Optional[str] = None,
+                   key: Optional[str] = None) -> Dict[str, Any]:
+    """Return the sample of a dataset file, computing and caching it on first use.
+
+    The file is streamed batch by batch, so datasets larger than memory work.
+
+    Args:
+        path: Path of the dataset, preferably its columnar copy
+        max_bytes: Budget for the sample written as CSV
+        seed: Seed for the random part of the sample
+        cache_dir: Directory holding the cached samples (defaults to the dataset's directory)
+        key: Cache key for the dataset (defaults to the file name, which is its content hash)
+
+    Returns:
+        The sample from ``compute_sample``
+    """
+    cache_dir = cache_dir or os.path.dirname(path)
+    key = key or os.path.basename(path).split('.')[0]
+    cache_path = get_sample_path(cache_dir, key, max_bytes, seed)
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        pass
+
+    sample = compute_sample(iter_batches(path), max_bytes=max_bytes, seed=seed)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(sample, f, default=str)
+    os.replace(tmp_path, cache_path)
+    logger.info(f"Sampled {len(sample['row_ids'])} rows of '{path}'")
+    return sample
+
+
+def format_sample(sample: Dict[str, Any]) -> str:
+    """Render a sample as CSV for the prompt, with the row number and the reason it was picked."""
+    lines = [_csv_line(["row"] + sample['names'] + [REASON_COLUMN])]
+    for row_id, row, reason in zip(sample['row_ids'], sample['rows'], sample['reasons']):
+        lines.append(_sample_line(row_id, row, [reason]))
+    return "".join(lines).rstrip("\n")
+
+
+def stratified_sample(data: Union[str, pd.DataFrame], max_bytes: int = 4000, seed: int = 0) -> pd.DataFrame:
+    """Small sample of a dataset that shows its rare categories, extremes and missing values.
+
+    Use this instead of ``df.head()`` to look at the data.
+
+    Args:
+        data: A DataFrame, or the path of a dataset file (whose sample is cached)
+        max_bytes: Budget for the sample written as CSV
+        seed: Seed for the random part of the sample
+
+    Returns:
+        DataFrame indexed by row number, with a column saying why each row was picked
+    """
+    if isinstance(data, str):
+        sample = dataset_sample(data, max_bytes=max_bytes, seed=seed)
+    else:
+        table = pa.Table.from_pandas(data.reset_index(drop=True), preserve_index=False)
+        sample = compute_sample(table.to_batches(), max_bytes=max_bytes, seed=seed)
+
+    frame = pd.DataFrame(sample['rows'], columns=sample['names'], index=pd.Index(sample['row_ids'], name="row"))
+    frame[REASON_COLUMN] = sample['reasons']
+    return frame
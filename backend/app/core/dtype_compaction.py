@@ -0,0 +1,162 @@
+"""Shrinks the memory footprint of DataFrames loaded in analysis kernels.
+
+Medical extracts load as ``object`` and ``float64`` columns even when they
+hold a handful of codes, flags or small counts. ``compact_dtypes`` picks the
+smallest dtype that keeps every value, and ``load_compact`` loads a dataset
+into the kernel's ``dataframes`` dict with it applied.
+"""
+import os
+import re
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .dataset_cache import COLUMNAR_EXT, load_dataset
+
+# Text columns with at most this share of distinct values become categoricals
+MAX_CATEGORY_RATIO = 0.05
+
+# ... and at most this many distinct values, so identifiers and free text stay plain text
+MAX_CATEGORY_VALUES = 1000
+
+# Values checked when guessing whether a text column holds dates
+DATE_SAMPLE_SIZE = 200
+
+# Share of sampled values that must look like dates before the whole column is parsed
+MIN_DATE_RATIO = 0.9
+
+# Looks like a date or timestamp: digits separated by -, / or .
+DATE_LIKE = re.compile(r'^\s*\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?\s*$')
+
+
+def _parse_dates(column: pd.Series) -> Optional[pd.Series]:
+    """Return the column parsed as datetimes, or None if it does not hold dates.
+
+    The column is only converted when every value parses, so no value is lost.
+    """
+    sample = column.dropna()
+    sample = sample.sample(min(len(sample), DATE_SAMPLE_SIZE), random_state=0).astype(str)
+    if sample.empty or sample.str.match(DATE_LIKE).mean() < MIN_DATE_RATIO:
+        return None
+    parsed = pd.to_datetime(column, errors='coerce')
+    if parsed.notna().sum() != column.notna().sum():
+        return None
+    return parsed
+
+
+def _compact_float(column: pd.Series) -> pd.Series:
+    """Downcast a float column to an integer or float32 when no value changes."""
+    values = column.to_numpy()
+    finite = values[~np.isnan(values)]
+    if len(finite) == 0:
+        return column
+
+    integral = np.all(finite == np.round(finite))
+    if integral and len(finite) == len(values):
+        return pd.to_numeric(column, downcast='unsigned' if finite.min() >= 0 else 'integer')
+    # Only when every value survives the round trip exactly (identifiers stored as floats would lose digits)
+    narrowed = values.astype(np.float32)
+    if np.array_equal(narrowed.astype(values.dtype), values, equal_nan=True):
+        return pd.Series(narrowed, index=column.index, name=column.name)
+    return column
+
+
+def compact_dtypes(df: pd.DataFrame, max_category_ratio: float = MAX_CATEGORY_RATIO,
+                   max_category_values: int = MAX_CATEGORY_VALUES,
+                   parse_dates: bool = True) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """Convert every column to the smallest dtype that keeps its values.
+
+    Text columns holding dates are parsed once, low-cardinality text columns
+    become categoricals, integers are downcast to the narrowest type and
+    floats become integers or float32 where no value changes.
+
+    Args:
+        df: The DataFrame to compact (it is not modified)
+        max_category_ratio: Text columns with at most this share of distinct values become categoricals
+        max_category_values: Text columns with more distinct values never become categoricals
+        parse_dates: Whether to parse text columns that hold dates
+
+    Returns:
+        Tuple of (compacted DataFrame, report with bytes_before, bytes_after and the changed dtypes)
+    """
+    bytes_before = int(df.memory_usage(deep=True).sum())
+    compacted = {}
+    changed = {}
+
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_bool_dtype(column) or isinstance(column.dtype, pd.CategoricalDtype):
+            new_column = column
+        elif pd.api.types.is_integer_dtype(column):
+            new_column = pd.to_numeric(column, downcast='unsigned' if column.min() >= 0 else 'integer')
+        elif pd.api.types.is_float_dtype(column):
+            new_column = _compact_float(column)
+        elif pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column):
+            new_column = _parse_dates(column) if parse_dates else None
+            if new_column is None:
+                distinct = column.nunique(dropna=True)
+                if distinct <= min(max_category_ratio * max(column.notna().sum(), 1), max_category_values):
+                    new_column = column.astype('category')
+                else:
+                    new_column = column
+        else:
+            new_column = column
+
+        compacted[name] = new_column
+        if new_column.dtype != column.dtype:
+            changed[str(name)] = f"{column.dtype} -> {new_column.dtype}"
+
+    result = pd.DataFrame(compacted, index=df.index)
+    bytes_after = int(result.memory_usage(deep=True).sum())
+    report = {
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+        'bytes_saved': bytes_before - bytes_after,
+        'changed': changed,
+    }
+    return result, report
+
+
+def _read_any(path: str) -> pd.DataFrame:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == COLUMNAR_EXT:
+        return load_dataset(path)
+    if ext in ('.xlsx', '.xls'):
+        return pd.read_excel(path)
+    if ext == '.parquet':
+        return pd.read_parquet(path)
+    if ext == '.csv':
+        return pd.read_csv(path, low_memory=False)
+    return pd.read_csv(path, sep=None, engine='python')
+
+
+def load_compact(path: str, name: Optional[str] = None, dataframes: Optional[Dict[str, pd.DataFrame]] = None,
+                 verbose: bool = True) -> pd.DataFrame:
+    """Load a dataset with compacted dtypes into the ``dataframes`` dict.
+
+    Args:
+        path: Path of the dataset (its columnar copy, or a CSV, Excel or Parquet file)
+        name: Key in ``dataframes`` (defaults to the file name without its extension)
+        dataframes: Dict to store the DataFrame in (defaults to the notebook's ``dataframes``)
+        verbose: Print how much memory the compaction saved
+
+    Returns:
+        The compacted DataFrame
+    """
+    if dataframes is None:
+        import __main__
+        if not isinstance(getattr(__main__, 'dataframes', None), dict):
+            __main__.dataframes = {}
+        dataframes = __main__.dataframes
+
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    df, report = compact_dtypes(_read_any(path))
+    dataframes[name] = df
+
+    if verbose:
+        before, after = report['bytes_before'], report['bytes_after']
+        saved = 1 - after / before if before else 0.0
+        print(f"Loaded dataframes['{name}']: {len(df)} rows x {len(df.columns)} columns, "
+              f"{before / 2 ** 20:.1f} MB -> {after / 2 ** 20:.1f} MB ({saved:.0%} saved)")
+    return df
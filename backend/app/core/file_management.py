@@ -1,17 +1,110 @@
 import os
 import uuid
+import hashlib
 from datetime import datetime
 import logging
-from flask import current_app
-
-# In-memory database for file metadata (for demonstration)
-file_metadata_db = {}
+from ..database.metadata_store import metadata_store
+from ..config import UPLOAD_FOLDER
 
 logger = logging.getLogger(__name__)
 
+# Size of the chunks read from an upload while it is hashed
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Subdirectory of the upload folder holding the content-addressed blobs
+BLOBS_DIR = "blobs"
+
+
+def get_blob_path(upload_folder, content_hash, ext):
+    """Get the path of the blob storing a file's content
+    
+    Blobs are spread over subdirectories named after the first two characters
+    of the hash so no single directory grows too large.
+    """
+    return os.path.join(upload_folder, BLOBS_DIR, content_hash[:2], f"{content_hash}{ext.lower()}")
+
+def _commit_blob(tmp_path, upload_folder, content_hash, ext):
+    """Move a fully written and hashed file into the blob store
+    
+    Returns:
+        tuple: (blob path, whether the blob already existed)
+    """
+    blob_path = get_blob_path(upload_folder, content_hash, ext)
+    if os.path.exists(blob_path):
+        os.remove(tmp_path)
+        return blob_path, True
+
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    os.replace(tmp_path, blob_path)
+    return blob_path, False
+
+def store_blob(stream, upload_folder, ext):
+    """Stream a file into the blob store, hashing it on the way
+    
+    Args:
+        stream: Readable binary stream with the file's content
+        upload_folder: Root folder of the uploads
+        ext: File extension, kept on the blob so its type can be recognised
+        
+    Returns:
+        tuple: (content hash, blob path, size in bytes, whether the blob already existed)
+    """
+    blobs_dir = os.path.join(upload_folder, BLOBS_DIR)
+    os.makedirs(blobs_dir, exist_ok=True)
+
+    # Write to a temporary file first: the name is only known once the whole content is hashed
+    hasher = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(blobs_dir, f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+
+        content_hash = hasher.hexdigest()
+        blob_path, existed = _commit_blob(tmp_path, upload_folder, content_hash, ext)
+        return content_hash, blob_path, size, existed
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def hash_file(path):
+    """Compute the SHA-256 hash of a file without reading it into memory at once"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def adopt_blob(path, upload_folder, content_hash, ext):
+    """Move a file that is already on disk into the blob store
+    
+    Args:
+        path: Path of the file; it is moved or, if the blob already exists, removed
+        upload_folder: Root folder of the uploads
+        content_hash: SHA-256 hash of the file's content
+        ext: File extension
+        
+    Returns:
+        tuple: (blob path, whether the blob already existed)
+    """
+    return _commit_blob(path, upload_folder, content_hash, ext)
+
 def save_uploaded_file(file, user_id, paper_id):
     """Save an uploaded file and store its metadata
     
+    The file is streamed to disk and stored once under its SHA-256 hash. The
+    metadata entry is the project's reference to that shared blob, so uploading
+    the same content into several sessions does not store it again.
+    
     Args:
         file: The uploaded file object
         user_id: The ID of the user uploading the file
@@ -20,31 +113,47 @@ def save_uploaded_file(file, user_id, paper_id):
     Returns:
         dict: Metadata about the saved file
     """
-    # Generate a unique filename to avoid collisions
-    unique_id = str(uuid.uuid4())[0:2]
     original_filename = file.filename
-    filename_base, filename_ext = os.path.splitext(original_filename)
-    unique_filename = f"{filename_base}_{unique_id}{filename_ext}"
-    local_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+    filename_ext = os.path.splitext(original_filename)[1]
+    content_hash, local_filepath, size, deduplicated = store_blob(
+        file.stream, UPLOAD_FOLDER, filename_ext
+    )
+    return add_file_reference(
+        user_id, paper_id, original_filename, content_hash, local_filepath, size, deduplicated
+    )
 
-    # Save file to local storage
-    file.save(local_filepath)
+def add_file_reference(user_id, paper_id, original_filename, content_hash, local_filepath, size, deduplicated=False):
+    """Record that a project uses a stored blob
+    
+    Returns:
+        dict: Metadata about the file; an existing reference is returned if the
+        project already has this content under the same name
+    """
+    for metadata in get_files_by_user_and_paper(user_id, paper_id):
+        if metadata['content_hash'] == content_hash and metadata['original_filename'] == original_filename:
+            logger.info(f"File '{original_filename}' is already part of paper {paper_id}")
+            return metadata
 
     # Generate a unique ID for the file metadata
-    file_id = str(uuid.uuid4())[0:2]
+    file_id = uuid.uuid4().hex
     
     # Store file metadata in the database
     file_metadata = {
         'file_id': file_id,
         'original_filename': original_filename,
         'local_filepath': local_filepath,
+        'content_hash': content_hash,
+        'size': size,
         'user_id': user_id,
         'paper_id': paper_id,
         'uploaded_at': datetime.now().isoformat()
     }
-    file_metadata_db[file_id] = file_metadata
+    metadata_store.put_file(file_metadata)
 
-    logger.info(f"File '{original_filename}' saved to local storage at '{local_filepath}'")
+    if deduplicated:
+        logger.info(f"File '{original_filename}' matches stored blob {content_hash[:12]}; no new copy written")
+    else:
+        logger.info(f"File '{original_filename}' saved to local storage at '{local_filepath}'")
     return file_metadata
 
 def get_file_metadata(file_id):
@@ -56,7 +165,7 @@ def get_file_metadata(file_id):
     Returns:
         dict: The file metadata or None if not found
     """
-    return file_metadata_db.get(file_id)
+    return metadata_store.get_file(file_id)
 
 def get_files_by_user_and_paper(user_id, paper_id):
     """Retrieve all files associated with a specific user and paper
@@ -68,8 +177,4 @@ def get_files_by_user_and_paper(user_id, paper_id):
     Returns:
         list: A list of file metadata for the matching files
     """
-    matching_files = []
-    for file_id, metadata in file_metadata_db.items():
-        if metadata['user_id'] == user_id and metadata['paper_id'] == paper_id:
-            matching_files.append(metadata)
-    return matching_files 
\ No newline at end of file
+    return metadata_store.get_project_files(user_id, paper_id)
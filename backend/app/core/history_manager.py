@@ -0,0 +1,157 @@
+import re
+import logging
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the follow-up prompts that feed code execution results back to the model
+BLOCK_RESPONSE_PREFIX = "BLOCK_RESPONSE"
+
+# First line of a condensed BLOCK_RESPONSE prompt
+DIGEST_HEADER = f"{BLOCK_RESPONSE_PREFIX} (digest of earlier execution results)"
+
+# Separator between code block results inside a BLOCK_RESPONSE prompt
+BLOCK_SEPARATOR = "\n\n---\n\n"
+
+# Matches the ANSI colour codes IPython puts in tracebacks
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a text (roughly four characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def truncate_middle(text: str, max_chars: int) -> str:
+    """Shorten text to about ``max_chars`` by keeping its head and tail."""
+    if len(text) <= max_chars:
+        return text
+    head = text[:max_chars * 2 // 3]
+    tail = text[-(max_chars // 3):]
+    omitted = len(text) - len(head) - len(tail)
+    return f"{head}\n[... {omitted} characters omitted ...]\n{tail}"
+
+
+def digest_block_response(content: str, max_chars_per_block: int = 300) -> str:
+    """Replace a BLOCK_RESPONSE prompt with a compact digest of its results.
+
+    Each code block keeps its header, and either the exception line of its
+    error or the first lines of its output.
+    """
+    if content.startswith(DIGEST_HEADER):
+        # Already condensed
+        return content
+
+    start = content.find("Code Block ")
+    if start == -1:
+        return truncate_middle(content, max_chars_per_block)
+
+    digests = []
+    for section in content[start:].split(BLOCK_SEPARATOR):
+        section = ANSI_ESCAPE.sub('', section.strip())
+        header, _, body = section.partition("\n")
+        if body.startswith("Execution Error:"):
+            error_lines = [line for line in body.splitlines()[1:] if line.strip()]
+            summary = "Execution Error: " + (error_lines[-1] if error_lines else "unknown error")
+        else:
+            summary = body
+        digests.append(f"{header}\n{truncate_middle(summary, max_chars_per_block)}")
+
+    return f"{DIGEST_HEADER}\n\n" + BLOCK_SEPARATOR.join(digests)
+
+
+class HistoryManager:
+    """Keeps the conversation sent to the model under a token budget.
+
+    The stored history is never modified; ``compact`` returns a condensed copy.
+    The most recent turns are kept verbatim where possible. Older execution
+    dumps are replaced by digests first, then older assistant replies are
+    shortened, then execution dumps in recent turns other than the latest are
+    digested, and as a last resort the oldest messages are dropped.
+    """
+
+    def __init__(self, token_budget: int = 12000, keep_recent_turns: int = 2, digest_chars: int = 300):
+        """Initialize the history manager.
+
+        Args:
+            token_budget: Maximum estimated tokens for the history sent with each call
+                (the system prompt and the current message are not counted)
+            keep_recent_turns: Number of most recent user turns kept verbatim
+            digest_chars: Characters kept per code block or message when condensing
+        """
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.digest_chars = digest_chars
+
+    def _recent_start(self, history: List[Dict[str, Any]]) -> int:
+        """Index of the first message belonging to the recent turns."""
+        turns_seen = 0
+        for index in range(len(history) - 1, -1, -1):
+            message = history[index]
+            if message['role'] == 'user' and not message['content'].startswith(BLOCK_RESPONSE_PREFIX):
+                turns_seen += 1
+                if turns_seen == self.keep_recent_turns:
+                    return index
+        return 0
+
+    def compact(self, messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """Return a copy of the messages that fits the token budget.
+
+        Args:
+            messages: Full message list with 'role' and 'content' keys
+
+        Returns:
+            Tuple of (compacted messages, report with tokens_before, tokens_after and tokens_saved)
+        """
+        system = [message for message in messages[:1] if message['role'] == 'system']
+        current = messages[-1:] if len(messages) > len(system) else []
+        history = [dict(message) for message in messages[len(system):len(messages) - len(current)]]
+
+        def total():
+            return sum(estimate_tokens(message['content']) for message in history)
+
+        tokens_before = total()
+        recent_start = self._recent_start(history)
+
+        # 1. Older execution dumps become digests
+        if tokens_before > self.token_budget:
+            for message in history[:recent_start]:
+                if message['role'] == 'user' and message['content'].startswith(BLOCK_RESPONSE_PREFIX):
+                    message['content'] = digest_block_response(message['content'], self.digest_chars)
+
+        # 2. Older assistant replies keep only their head and tail
+        if total() > self.token_budget:
+            for message in history[:recent_start]:
+                if message['role'] == 'assistant':
+                    message['content'] = truncate_middle(message['content'], self.digest_chars * 4)
+
+        # 3. Still too large: digest execution dumps in the recent turns too, except the latest
+        if total() > self.token_budget:
+            for message in history[:-1]:
+                if message['role'] == 'user' and message['content'].startswith(BLOCK_RESPONSE_PREFIX):
+                    message['content'] = digest_block_response(message['content'], self.digest_chars)
+
+        # 4. Drop the oldest messages that are not part of the recent turns
+        dropped = 0
+        while total() > self.token_budget and recent_start > 0:
+            history.pop(0)
+            recent_start -= 1
+            dropped += 1
+
+        if dropped:
+            history.insert(0, {
+                'role': 'user',
+                'content': f"[{dropped} earlier messages of this conversation were omitted to save space]"
+            })
+
+        tokens_after = total()
+        report = {
+            'tokens_before': tokens_before,
+            'tokens_after': tokens_after,
+            'tokens_saved': tokens_before - tokens_after,
+            'messages_dropped': dropped,
+        }
+        if report['tokens_saved'] > 0:
+            logger.info(f"Compacted conversation history: {report}")
+
+        return system + history + current, report
@@ -0,0 +1,11 @@
+"""Helpers preloaded into every analysis kernel by the notebook setup code.
+
+Everything exported here is available to the model's code without an import.
+"""
+from .dataset_cache import load_dataset
+from .dataset_associations import association_matrix, dataset_associations
+from .dtype_compaction import compact_dtypes, load_compact
+from .dataset_sample import stratified_sample
+
+__all__ = ['load_dataset', 'association_matrix', 'dataset_associations', 'compact_dtypes', 'load_compact',
+           'stratified_sample']
@@ -0,0 +1,134 @@
+import logging
+import queue
+import threading
+from typing import Any, Optional, Tuple
+
+from jupyter_client.manager import start_new_kernel
+
+logger = logging.getLogger(__name__)
+
+# Kernels started in a row before giving up when the setup code keeps failing
+SETUP_ATTEMPTS = 3
+
+
+class KernelPool:
+    """Keeps a number of idle, pre-initialized kernels ready for new sessions.
+
+    Starting a kernel and importing the scientific stack takes several seconds,
+    so the pool does that ahead of time on a background thread. Sessions take a
+    kernel with ``acquire`` and the refiller tops the pool back up.
+    """
+
+    def __init__(self, size: int, setup_code: str = "", startup_timeout: int = 60):
+        """Initialize the pool.
+
+        Args:
+            size: Number of idle kernels to keep ready
+            setup_code: Code executed in every kernel before it is handed out
+            startup_timeout: Seconds to wait for the setup code to finish
+        """
+        self.size = max(0, size)
+        self.setup_code = setup_code
+        self.startup_timeout = startup_timeout
+
+        self._idle: "queue.Queue[Tuple[Any, Any]]" = queue.Queue()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._refiller: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the background refiller thread."""
+        if self.size == 0 or self._refiller is not None:
+            return
+        self._refiller = threading.Thread(target=self._refill_loop, name="kernel-pool-refiller", daemon=True)
+        self._refiller.start()
+
+    def start_kernel(self) -> Tuple[Any, Any]:
+        """Start a kernel and run the setup code in it.
+
+        A kernel whose setup code fails or times out is shut down and replaced,
+        so a half-initialized kernel is never handed out.
+
+        Returns:
+            Tuple of (kernel_manager, kernel_client)
+
+        Raises:
+            RuntimeError: If the setup code failed in every attempt
+        """
+        for attempt in range(1, SETUP_ATTEMPTS + 1):
+            kernel_manager, kernel_client = start_new_kernel()
+            error = self._run_setup(kernel_client)
+            if error is None:
+                return kernel_manager, kernel_client
+            logger.warning(f"Kernel setup failed (attempt {attempt}/{SETUP_ATTEMPTS}): {error}")
+            self._shutdown(kernel_manager, kernel_client)
+        raise RuntimeError(f"Kernel setup code failed in {SETUP_ATTEMPTS} attempts")
+
+    def _run_setup(self, kernel_client) -> Optional[str]:
+        """Run the setup code in a new kernel and return the error, or None if it succeeded."""
+        if not self.setup_code:
+            return None
+        try:
+            reply = kernel_client.execute_interactive(
+                self.setup_code,
+                timeout=self.startup_timeout,
+                output_hook=lambda msg: None,
+            )
+        except Exception as e:
+            return f"did not complete: {e}"
+        if reply['content'].get('status') != 'ok':
+            return f"{reply['content'].get('ename')}: {reply['content'].get('evalue')}"
+        return None
+
+    def acquire(self) -> Tuple[Any, Any]:
+        """Take an idle kernel from the pool, starting one if the pool is empty.
+
+        Returns:
+            Tuple of (kernel_manager, kernel_client)
+        """
+        try:
+            kernel = self._idle.get_nowait()
+            logger.info(f"Took kernel from pool ({self._idle.qsize()} idle left)")
+        except queue.Empty:
+            logger.info("Kernel pool empty, starting a kernel on demand")
+            kernel = self.start_kernel()
+        self._wakeup.set()
+        return kernel
+
+    def idle_count(self) -> int:
+        """Number of idle kernels currently waiting in the pool."""
+        return self._idle.qsize()
+
+    def _refill_loop(self):
+        while not self._closed:
+            while not self._closed and self._idle.qsize() < self.size:
+                try:
+                    kernel = self.start_kernel()
+                except Exception as e:
+                    logger.error(f"Failed to start pooled kernel: {e}")
+                    break
+                if self._closed:
+                    self._shutdown(*kernel)
+                    return
+                self._idle.put(kernel)
+                logger.info(f"Kernel pool refilled to {self._idle.qsize()}/{self.size}")
+            self._wakeup.wait(timeout=30)
+            self._wakeup.clear()
+
+    def _shutdown(self, kernel_manager, kernel_client):
+        try:
+            kernel_client.stop_channels()
+            kernel_manager.shutdown_kernel(now=True)
+        except Exception as e:
+            logger.warning(f"Error shutting down pooled kernel: {e}")
+
+    def close(self):
+        """Stop the refiller and shut down all idle kernels."""
+        self._closed = True
+        self._wakeup.set()
+        while True:
+            try:
+                kernel = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._shutdown(*kernel)
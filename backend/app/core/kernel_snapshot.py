@@ -0,0 +1,192 @@
+"""Save and restore a kernel's user namespace.
+
+These functions run *inside* the IPython kernel (they are imported there by
+``NotebookManager``), so they only depend on the analysis stack and the
+standard library.
+"""
+import os
+import ast
+import json
+import types
+import pickle
+import shutil
+import importlib
+import linecache
+from datetime import datetime
+
+MANIFEST_NAME = "manifest.json"
+
+# Names IPython puts in the user namespace that should never be captured
+_IPYTHON_NAMES = {'In', 'Out', 'exit', 'quit', 'get_ipython', 'open'}
+
+
+def _is_dataframe(value):
+    try:
+        import pandas as pd
+    except ImportError:
+        return False
+    return isinstance(value, pd.DataFrame)
+
+
+def _write_dataframe(df, path_base):
+    """Write a DataFrame as Parquet, falling back to pickle for unsupported frames."""
+    try:
+        df.to_parquet(path_base + ".parquet")
+        return {'format': 'parquet', 'file': os.path.basename(path_base) + ".parquet"}
+    except Exception:
+        df.to_pickle(path_base + ".pkl")
+        return {'format': 'pickle', 'file': os.path.basename(path_base) + ".pkl"}
+
+
+def _read_dataframe(snapshot_dir, entry):
+    import pandas as pd
+    path = os.path.join(snapshot_dir, entry['file'])
+    if entry['format'] == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def _definition_source(value):
+    """Source of a function or class defined at the top level of a notebook cell, or None.
+
+    IPython keeps every cell's code in ``linecache`` under the file name its
+    functions are compiled with; a class's cell is found through its methods.
+    """
+    target = value
+    if isinstance(value, type):
+        methods = (getattr(v, '__func__', v) for v in vars(value).values())
+        target = next((m for m in methods if isinstance(m, types.FunctionType)), None)
+    code = getattr(target, '__code__', None)
+    if code is None or value.__qualname__ != value.__name__:
+        return None
+    lines = linecache.getlines(code.co_filename)
+    try:
+        tree = ast.parse(''.join(lines))
+    except SyntaxError:
+        return None
+    for node in reversed(tree.body):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.name == value.__name__:
+            start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            return ''.join(lines[start - 1:node.end_lineno])
+    return None
+
+
+def save_namespace(namespace, snapshot_dir, extra=None):
+    """Serialize a user namespace into ``snapshot_dir``.
+
+    DataFrames (including those held in a dict such as ``dataframes``) are
+    written as Parquet, modules are recorded by name, functions and classes
+    defined in cells are recorded as source, and other values are pickled.
+    Values that cannot be saved are listed in the manifest as skipped.
+
+    Args:
+        namespace: The kernel's user namespace, i.e. ``get_ipython().user_ns``
+        snapshot_dir: Directory that will hold the snapshot (replaced atomically)
+        extra: Optional dict stored as-is in the manifest
+
+    Returns:
+        The manifest dict that was written
+    """
+    tmp_dir = snapshot_dir.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    variables = {}
+    skipped = []
+    for index, (name, value) in enumerate(list(namespace.items())):
+        if name.startswith('_') or name in _IPYTHON_NAMES:
+            continue
+        path_base = os.path.join(tmp_dir, f"var{index}")
+
+        if isinstance(value, types.ModuleType):
+            variables[name] = {'kind': 'module', 'module': value.__name__}
+        elif _is_dataframe(value):
+            variables[name] = dict(kind='dataframe', **_write_dataframe(value, path_base))
+        elif isinstance(value, dict) and value and all(_is_dataframe(v) for v in value.values()):
+            items = {}
+            for item_index, (key, df) in enumerate(value.items()):
+                items[str(key)] = _write_dataframe(df, f"{path_base}_{item_index}")
+            variables[name] = {'kind': 'dataframe_dict', 'items': items}
+        elif isinstance(value, (types.FunctionType, type)):
+            if getattr(value, '__module__', None) == '__main__':
+                # Defined in a cell; pickle would only store a dangling reference, so keep the definition
+                source = _definition_source(value)
+                if source is None:
+                    skipped.append(name)
+                else:
+                    variables[name] = {'kind': 'source', 'source': source}
+            else:
+                # Imported functions and classes are restored by reference
+                variables[name] = {'kind': 'import', 'module': value.__module__, 'attr': value.__qualname__}
+        else:
+            try:
+                with open(path_base + ".pkl", 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                variables[name] = {'kind': 'pickle', 'file': os.path.basename(path_base) + ".pkl"}
+            except Exception:
+                if os.path.exists(path_base + ".pkl"):
+                    os.remove(path_base + ".pkl")
+                skipped.append(name)
+
+    manifest = {
+        'created_at': datetime.now().isoformat(),
+        'variables': variables,
+        'skipped': skipped,
+        'extra': extra or {},
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(tmp_dir, snapshot_dir)
+    return manifest
+
+
+def restore_namespace(namespace, snapshot_dir):
+    """Load a snapshot written by ``save_namespace`` back into a namespace.
+
+    Returns:
+        List of restored variable names
+    """
+    with open(os.path.join(snapshot_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+
+    restored = []
+    # Cell definitions run first, so pickled instances of cell classes can be loaded
+    entries = sorted(manifest['variables'].items(), key=lambda item: item[1]['kind'] != 'source')
+    for name, entry in entries:
+        try:
+            if entry['kind'] == 'source':
+                filename = f"<restored {name}>"
+                # Registered like a cell, so the next snapshot finds the source again
+                linecache.cache[filename] = (len(entry['source']), None, entry['source'].splitlines(True), filename)
+                exec(compile(entry['source'], filename, 'exec'), namespace)
+                value = namespace[name]
+            elif entry['kind'] == 'module':
+                value = importlib.import_module(entry['module'])
+            elif entry['kind'] == 'import':
+                value = importlib.import_module(entry['module'])
+                for attr in entry['attr'].split('.'):
+                    value = getattr(value, attr)
+            elif entry['kind'] == 'dataframe':
+                value = _read_dataframe(snapshot_dir, entry)
+            elif entry['kind'] == 'dataframe_dict':
+                value = {key: _read_dataframe(snapshot_dir, item) for key, item in entry['items'].items()}
+            else:
+                with open(os.path.join(snapshot_dir, entry['file']), 'rb') as f:
+                    value = pickle.load(f)
+        except Exception as e:
+            print(f"Could not restore variable '{name}': {e}")
+            continue
+        namespace[name] = value
+        restored.append(name)
+    return restored
+
+
+def read_manifest(snapshot_dir):
+    """Return the manifest of a snapshot, or None if there is no complete snapshot."""
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,188 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Any
+
+try:
+    import psutil
+except ImportError:  # fall back to /proc on Linux
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_kernel_pid(kernel_manager) -> Optional[int]:
+    """Return the OS process id of a kernel started by jupyter_client, if known."""
+    provisioner = getattr(kernel_manager, 'provisioner', None)
+    process = getattr(provisioner, 'process', None) or getattr(kernel_manager, 'kernel', None)
+    return getattr(process, 'pid', None)
+
+
+def get_process_rss(pid: Optional[int]) -> int:
+    """Return the resident set size of a process in bytes, or 0 if unavailable."""
+    if pid is None:
+        return 0
+    try:
+        if psutil is not None:
+            return psutil.Process(pid).memory_info().rss
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return 0
+
+
+class KernelSupervisor:
+    """Tracks live kernels and evicts the least recently used ones.
+
+    Kernels are evicted once either the number of live kernels exceeds
+    ``max_kernels`` or their combined RSS exceeds ``max_memory_bytes``.
+    """
+
+    def __init__(self, evict: Callable[[str], None], max_kernels: int = 0, max_memory_mb: int = 0):
+        """Initialize the supervisor.
+
+        Args:
+            evict: Callback that shuts down (or otherwise releases) a project's kernel;
+                it may return False to skip a kernel that turned out to be in use
+            max_kernels: Maximum number of live kernels (0 means unlimited)
+            max_memory_mb: Maximum combined kernel RSS in MB (0 means unlimited)
+        """
+        self.evict = evict
+        self.max_kernels = max_kernels
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+
+        self._kernels: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def register(self, project_id: str, kernel_manager):
+        """Start tracking a newly started kernel."""
+        with self._lock:
+            self._kernels[project_id] = {
+                'pid': get_kernel_pid(kernel_manager),
+                'started_at': time.time(),
+                'last_used': time.time(),
+                'busy': 0,
+            }
+
+    def unregister(self, project_id: str):
+        """Stop tracking a kernel that was shut down."""
+        with self._lock:
+            self._kernels.pop(project_id, None)
+
+    def touch(self, project_id: str):
+        """Mark a project's kernel as just used."""
+        with self._lock:
+            if project_id in self._kernels:
+                self._kernels[project_id]['last_used'] = time.time()
+
+    def mark_busy(self, project_id: str):
+        """Mark a project's kernel as executing so it is never evicted mid-run."""
+        with self._lock:
+            if project_id in self._kernels:
+                self._kernels[project_id]['busy'] += 1
+                self._kernels[project_id]['last_used'] = time.time()
+
+    def mark_idle(self, project_id: str):
+        """Mark the end of an execution started with ``mark_busy``."""
+        with self._lock:
+            if project_id in self._kernels:
+                info = self._kernels[project_id]
+                info['busy'] = max(0, info['busy'] - 1)
+                info['last_used'] = time.time()
+
+    def idle_projects(self, idle_seconds: float) -> List[str]:
+        """Return projects whose kernels have not been used for ``idle_seconds``."""
+        cutoff = time.time() - idle_seconds
+        with self._lock:
+            return [
+                project_id for project_id, info in self._kernels.items()
+                if not info['busy'] and info['last_used'] < cutoff
+            ]
+
+    def start_idle_sweeper(self, idle_seconds: float, on_idle: Callable[[str], Any], interval: float = 60):
+        """Periodically call ``on_idle`` for kernels idle longer than ``idle_seconds``."""
+        def sweep():
+            while True:
+                time.sleep(interval)
+                for project_id in self.idle_projects(idle_seconds):
+                    try:
+                        on_idle(project_id)
+                    except Exception as e:
+                        logger.error(f"Error releasing idle kernel for project {project_id}: {e}")
+
+        threading.Thread(target=sweep, name="kernel-idle-sweeper", daemon=True).start()
+
+    def _snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = [dict(info, project_id=project_id) for project_id, info in self._kernels.items()]
+        for entry in entries:
+            entry['rss_bytes'] = get_process_rss(entry['pid'])
+        return entries
+
+    def enforce(self, protect: Optional[str] = None) -> List[str]:
+        """Evict least recently used kernels until the limits are met.
+
+        Args:
+            protect: Project whose kernel must not be evicted (the one about to be used)
+
+        Returns:
+            List of evicted project ids
+        """
+        if not self.max_kernels and not self.max_memory_bytes:
+            return []
+
+        entries = sorted(self._snapshot(), key=lambda entry: entry['last_used'])
+        count = len(entries)
+        total_rss = sum(entry['rss_bytes'] for entry in entries)
+
+        evicted = []
+        for entry in entries:
+            over_count = self.max_kernels and count > self.max_kernels
+            over_memory = self.max_memory_bytes and total_rss > self.max_memory_bytes
+            if not (over_count or over_memory):
+                break
+            if entry['project_id'] == protect or entry['busy']:
+                continue
+
+            logger.info(
+                f"Evicting kernel for project {entry['project_id']} "
+                f"(idle {time.time() - entry['last_used']:.0f}s, rss {entry['rss_bytes'] / 1e6:.0f}MB)"
+            )
+            try:
+                if self.evict(entry['project_id']) is False:
+                    # In use by a request that started after the snapshot was taken
+                    continue
+            except Exception as e:
+                logger.error(f"Error evicting kernel for project {entry['project_id']}: {e}")
+            self.unregister(entry['project_id'])
+            self.evictions += 1
+            count -= 1
+            total_rss -= entry['rss_bytes']
+            evicted.append(entry['project_id'])
+
+        return evicted
+
+    def stats(self) -> Dict[str, Any]:
+        """Report current kernel count and memory usage for operators."""
+        now = time.time()
+        entries = self._snapshot()
+        return {
+            'kernel_count': len(entries),
+            'total_rss_bytes': sum(entry['rss_bytes'] for entry in entries),
+            'max_kernels': self.max_kernels,
+            'max_memory_bytes': self.max_memory_bytes,
+            'evictions': self.evictions,
+            'kernels': [
+                {
+                    'project_id': entry['project_id'],
+                    'pid': entry['pid'],
+                    'rss_bytes': entry['rss_bytes'],
+                    'busy': bool(entry['busy']),
+                    'idle_seconds': round(now - entry['last_used'], 1),
+                    'uptime_seconds': round(now - entry['started_at'], 1),
+                }
+                for entry in sorted(entries, key=lambda entry: entry['last_used'], reverse=True)
+            ],
+        }
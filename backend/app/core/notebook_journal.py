@@ -0,0 +1,197 @@
+import os
+import json
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+import nbformat
+from nbformat.v4 import new_notebook, new_code_cell, new_markdown_cell
+
+
+def build_cells(code: str, output: str, error: Optional[str] = None) -> List[Any]:
+    """Build the notebook cells recorded for one execution.
+
+    Args:
+        code: The executed code
+        output: Text output of the execution
+        error: Error traceback, if the execution failed
+
+    Returns:
+        List with the code cell and, if there was any output, a markdown output cell
+    """
+    cells = [new_code_cell(code, metadata={'execution_failed': error is not None})]
+
+    # Add output as a markdown cell with formatting
+    if output or error:
+        content = "**Output:**\n```\n"
+        if output:
+            content += output
+        if error:
+            content += f"\n\n**Error:**\n{error}"
+        content += "\n```"
+        cells.append(new_markdown_cell(content))
+
+    return cells
+
+
+class NotebookJournal:
+    """Append-only per-project journal of executed cells.
+
+    Every execution appends a single JSON line, so recording a cell costs the
+    same regardless of how long the session is. The journal is folded into the
+    project's ``.ipynb`` file only when the notebook is actually needed.
+    """
+
+    def __init__(self, notebooks_dir: str):
+        """Initialize the journal.
+
+        Args:
+            notebooks_dir: Directory holding the notebooks and their journals
+        """
+        self.notebooks_dir = notebooks_dir
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, project_id: str) -> threading.Lock:
+        with self._locks_guard:
+            if project_id not in self._locks:
+                self._locks[project_id] = threading.Lock()
+            return self._locks[project_id]
+
+    def get_journal_path(self, project_id: str) -> str:
+        """Get path to a project's journal file."""
+        return os.path.join(self.notebooks_dir, f"{project_id}.cells.jsonl")
+
+    def append(self, project_id: str, code: str, output: str, error: Optional[str] = None):
+        """Record one execution at the end of the project's journal."""
+        entry = {
+            'code': code,
+            'output': output,
+            'error': error,
+            'executed_at': datetime.now().isoformat()
+        }
+        line = json.dumps(entry) + "\n"
+        with self._lock(project_id):
+            with open(self.get_journal_path(project_id), 'a') as f:
+                f.write(line)
+
+    def read_entries(self, project_id: str) -> List[Dict[str, Any]]:
+        """Read the executions recorded in the journal that are not yet compacted."""
+        journal_path = self.get_journal_path(project_id)
+        if not os.path.exists(journal_path):
+            return []
+
+        entries = []
+        with open(journal_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-write; everything before it is intact
+                    break
+        return entries
+
+    def read_history(self, project_id: str, notebook_path: str) -> List[Dict[str, Any]]:
+        """Return every executed code cell in order, from the notebook and the journal.
+
+        Returns:
+            List of dicts with the cell's ``code`` and whether it ``failed``
+        """
+        with self._lock(project_id):
+            history = []
+            try:
+                with open(notebook_path, 'r') as f:
+                    nb = nbformat.read(f, as_version=4)
+                for cell in nb.cells:
+                    if cell.cell_type == 'code':
+                        history.append({
+                            'code': cell.source,
+                            'failed': bool(cell.metadata.get('execution_failed', False))
+                        })
+            except FileNotFoundError:
+                pass
+
+            for entry in self.read_entries(project_id):
+                history.append({'code': entry['code'], 'failed': entry.get('error') is not None})
+            return history
+
+    def compact(self, project_id: str, notebook_path: str) -> int:
+        """Fold the journal into the notebook file and clear the journal.
+
+        Args:
+            project_id: The project identifier
+            notebook_path: Path of the project's .ipynb file
+
+        Returns:
+            Number of executions that were compacted
+        """
+        with self._lock(project_id):
+            entries = self.read_entries(project_id)
+            if not entries:
+                return 0
+
+            try:
+                with open(notebook_path, 'r') as f:
+                    nb = nbformat.read(f, as_version=4)
+            except Exception:
+                nb = new_notebook()
+
+            for entry in entries:
+                nb.cells.extend(build_cells(entry['code'], entry.get('output', ''), entry.get('error')))
+
+            # Write to a temporary file first so a crash never leaves a half-written notebook
+            tmp_path = notebook_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                nbformat.write(nb, f)
+            os.replace(tmp_path, notebook_path)
+
+            os.remove(self.get_journal_path(project_id))
+            return len(entries)
+
+
+# Benchmark journal appends against the old read-modify-write of the .ipynb
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+    import time
+
+    sample_code = "df = dataframes['cohort']\nprint(df.groupby('sex')['age'].describe())"
+    sample_output = "\n".join(f"row {i}: 0.123 0.456 0.789" for i in range(20))
+
+    def rewrite_notebook(path):
+        with open(path, 'r') as f:
+            nb = nbformat.read(f, as_version=4)
+        nb.cells.extend(build_cells(sample_code, sample_output))
+        with open(path, 'w') as f:
+            nbformat.write(nb, f)
+
+    print(f"{'cells':>6} {'rewrite ms/cell':>16} {'journal ms/cell':>16} {'compact ms':>11}")
+    for n_cells in (10, 100, 1000):
+        bench_dir = tempfile.mkdtemp()
+        try:
+            notebook_path = os.path.join(bench_dir, "bench.ipynb")
+            with open(notebook_path, 'w') as f:
+                nbformat.write(new_notebook(), f)
+
+            start = time.perf_counter()
+            for _ in range(n_cells):
+                rewrite_notebook(notebook_path)
+            rewrite_ms = (time.perf_counter() - start) * 1000 / n_cells
+
+            journal = NotebookJournal(bench_dir)
+            start = time.perf_counter()
+            for _ in range(n_cells):
+                journal.append("bench", sample_code, sample_output)
+            journal_ms = (time.perf_counter() - start) * 1000 / n_cells
+
+            compacted_path = os.path.join(bench_dir, "bench_compacted.ipynb")
+            start = time.perf_counter()
+            journal.compact("bench", compacted_path)
+            compact_ms = (time.perf_counter() - start) * 1000
+
+            print(f"{n_cells:>6} {rewrite_ms:>16.3f} {journal_ms:>16.3f} {compact_ms:>11.1f}")
+        finally:
+            shutil.rmtree(bench_dir)
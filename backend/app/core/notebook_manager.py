@@ -1,25 +1,105 @@
 import os
+import time
+import queue
+import logging
+import threading
 import nbformat
 from nbformat.v4 import new_notebook, new_code_cell
 import jupyter_client
 from jupyter_client.manager import start_new_kernel
 import uuid
-from typing import Dict, Tuple, Optional, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Tuple, Optional, Any
+from .kernel_pool import KernelPool
+from .notebook_journal import NotebookJournal
+from .kernel_supervisor import KernelSupervisor
+from .kernel_snapshot import read_manifest
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a kernel to acknowledge an interrupt before giving up on the cell
+INTERRUPT_GRACE_SECONDS = 10
+
+# Standard imports for medical data analysis, run in every kernel before use
+SETUP_CODE = """
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+import seaborn as sns
+from scipy import stats
+from sklearn import preprocessing, decomposition, cluster, metrics
+import statsmodels.api as sm
+from backend.app.core.kernel_helpers import *
+
+# Configure plotting
+%matplotlib inline
+plt.style.use('seaborn-whitegrid')
+sns.set(style="whitegrid")
+
+print("Notebook environment initialized successfully!")
+"""
+
 
 class NotebookManager:
     """Manages Jupyter notebooks for each project to maintain state across sessions."""
     
-    def __init__(self, notebooks_dir: str = "notebooks"):
+    def __init__(self, notebooks_dir: str = "notebooks", kernel_pool_size: int = 0,
+                 max_kernels: int = 0, max_kernel_memory_mb: int = 0, hibernate_idle_seconds: int = 0,
+                 checkpoint_every_cells: int = 0, replay_time_budget: float = 60,
+                 execution_timeout: float = 30):
         """Initialize the notebook manager.
         
         Args:
             notebooks_dir: Directory to store notebooks
+            kernel_pool_size: Number of pre-warmed kernels to keep ready (0 disables the pool)
+            max_kernels: Live kernels kept before the least recently used is evicted (0 means unlimited)
+            max_kernel_memory_mb: Combined kernel RSS before eviction starts (0 means unlimited)
+            hibernate_idle_seconds: Idle time after which a kernel's namespace is saved to disk
+                and the kernel shut down (0 disables hibernation)
+            checkpoint_every_cells: Snapshot the namespace after this many executed cells (0 disables)
+            replay_time_budget: Seconds a restarted session may spend replaying cells
+            execution_timeout: Overall deadline in seconds for a single execution before it is interrupted
         """
         self.notebooks_dir = notebooks_dir
         os.makedirs(notebooks_dir, exist_ok=True)
         
         # Dictionary to track kernel connections by project_id
         self.kernels: Dict[str, Dict[str, Any]] = {}
+        
+        # Tracks kernel usage and evicts idle kernels once limits are exceeded.
+        # In hibernation mode evicted kernels are snapshotted instead of lost.
+        self.hibernate_idle_seconds = hibernate_idle_seconds
+        self.supervisor = KernelSupervisor(
+            lambda project_id: self._release_idle_kernel(project_id, force_shutdown=True),
+            max_kernels, max_kernel_memory_mb
+        )
+        if hibernate_idle_seconds > 0:
+            self.supervisor.start_idle_sweeper(
+                hibernate_idle_seconds,
+                lambda project_id: self._release_idle_kernel(project_id, force_shutdown=False),
+                interval=min(60, hibernate_idle_seconds)
+            )
+        
+        # Per-project locks so housekeeping never touches a kernel mid-execution
+        self._project_locks: Dict[str, threading.RLock] = {}
+        self._project_locks_guard = threading.Lock()
+        
+        self.execution_timeout = execution_timeout
+        
+        # Sessions without a live kernel are rebuilt from the latest checkpoint plus replay
+        self.checkpoint_every_cells = checkpoint_every_cells
+        self.replay_time_budget = replay_time_budget
+        # Checkpoints are written after the triggering cell has returned its result
+        self._checkpoints = ThreadPoolExecutor(max_workers=2, thread_name_prefix="kernel-checkpoint")
+        
+        # Executed cells are journaled and only compacted into the .ipynb on demand
+        self.journal = NotebookJournal(notebooks_dir)
+        
+        # Pool of idle kernels with SETUP_CODE already executed
+        self.kernel_pool: Optional[KernelPool] = None
+        if kernel_pool_size > 0:
+            self.kernel_pool = KernelPool(kernel_pool_size, setup_code=SETUP_CODE)
+            self.kernel_pool.start()
     
     def get_notebook_path(self, project_id: str) -> str:
         """Get path to a project's notebook file."""
@@ -30,28 +110,9 @@ class NotebookManager:
         notebook_path = self.get_notebook_path(project_id)
         
         if not os.path.exists(notebook_path):
-            # Create a new, empty notebook
+            # Create a new notebook starting with the standard setup cell
             nb = new_notebook()
-            
-            # Add standard imports for medical data analysis
-            setup_code = """
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy import stats
-from sklearn import preprocessing, decomposition, cluster, metrics
-import statsmodels.api as sm
-
-# Configure plotting
-%matplotlib inline
-plt.style.use('seaborn-whitegrid')
-sns.set(style="whitegrid")
-
-print("Notebook environment initialized successfully!")
-            """
-            
-            nb.cells.append(new_code_cell(setup_code))
+            nb.cells.append(new_code_cell(SETUP_CODE))
             
             with open(notebook_path, 'w') as f:
                 nbformat.write(nb, f)
@@ -61,129 +122,404 @@ print("Notebook environment initialized successfully!")
     def get_or_create_kernel(self, project_id: str) -> Tuple[Any, Any]:
         """Get or create a kernel for a project."""
         if project_id not in self.kernels:
-            # Start a new kernel
-            kernel_manager, kernel_client = start_new_kernel()
+            # Take a pre-warmed kernel from the pool, or start a new one
+            if self.kernel_pool is not None:
+                kernel_manager, kernel_client = self.kernel_pool.acquire()
+            else:
+                kernel_manager, kernel_client = start_new_kernel()
             
             self.kernels[project_id] = {
                 'manager': kernel_manager,
                 'client': kernel_client,
-                'execution_count': 0
+                # Unique across restarts and hosts, so callers can tell whether state they loaded is still there
+                'kernel_id': uuid.uuid4().hex,
+                'execution_count': 0,
+                'cell_count': 0
             }
+            self.supervisor.register(project_id, kernel_manager)
             
             # Ensure notebook exists
             self.ensure_notebook_exists(project_id)
+            
+            # Bring back the state of a hibernated or restarted session
+            self.kernels[project_id]['restore_report'] = self._restore_session(
+                project_id, kernel_manager, kernel_client
+            )
+            
+            # Make room for the new kernel by evicting the least recently used ones
+            self.supervisor.enforce(protect=project_id)
+        else:
+            self.supervisor.touch(project_id)
         
         return (
             self.kernels[project_id]['manager'],
             self.kernels[project_id]['client']
         )
     
-    def execute_code(self, project_id: str, code: str) -> Dict[str, Any]:
+    def kernel_id(self, project_id: str) -> Optional[str]:
+        """Id of the project's live kernel, or None if it has none."""
+        return self.kernels.get(project_id, {}).get('kernel_id')
+    
+    def execute_code(self, project_id: str, code: str, submitted_at: Optional[float] = None,
+                     on_output: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """Execute code in the project's kernel and return the results.
         
         Args:
             project_id: The project identifier
             code: Python code to execute
+            submitted_at: time.perf_counter() value when the request was submitted,
+                used to report queue time (defaults to now)
+            on_output: Optional callback receiving each piece of output as the kernel produces it
             
         Returns:
-            Dictionary with execution results including stdout, stderr, and error info
+            Dictionary with execution results including stdout, stderr, error info,
+            timing metadata and the id of the kernel that ran the code
         """
-        # Get or create kernel
-        _, kernel_client = self.get_or_create_kernel(project_id)
+        if submitted_at is None:
+            submitted_at = time.perf_counter()
+        
+        with self._project_lock(project_id):
+            # Get or create kernel
+            new_kernel = project_id not in self.kernels
+            kernel_manager, kernel_client = self.get_or_create_kernel(project_id)
+            self.supervisor.mark_busy(project_id)
+            try:
+                result = self._execute(project_id, kernel_manager, kernel_client, code, submitted_at, on_output)
+            finally:
+                self.supervisor.mark_idle(project_id)
+            checkpoint_due = (self.checkpoint_every_cells > 0
+                              and self.kernels[project_id]['cell_count'] % self.checkpoint_every_cells == 0)
+        
+        # Periodic checkpoint so a restart only replays the cells since then
+        if checkpoint_due:
+            self._checkpoints.submit(self._checkpoint, project_id)
         
+        result['kernel_id'] = self.kernels.get(project_id, {}).get('kernel_id')
+        # Let the caller know if earlier state had to be rebuilt first
+        if new_kernel:
+            result['restore'] = self.kernels.get(project_id, {}).get('restore_report')
+        return result
+    
+    def _execute(self, project_id: str, kernel_manager, kernel_client, code: str,
+                 submitted_at: float, on_output: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """Send code to the kernel and collect its output until it finishes or the deadline passes.
+        
+        Only iopub messages whose parent is this request are considered, so
+        late output from an earlier cell can never leak into this result.
+        """
         # Execute the code
-        kernel_client.execute(code)
+        msg_id = kernel_client.execute(code)
+        sent_at = time.perf_counter()
+        deadline = sent_at + self.execution_timeout
+        started_at = None
         
         # Process the output messages
         outputs = []
         error_output = None
+        timed_out = False
         
         while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 and not timed_out:
+                # Stop the runaway cell but keep the kernel and its state
+                logger.warning(f"Execution for project {project_id} exceeded {self.execution_timeout}s, interrupting")
+                timed_out = True
+                kernel_manager.interrupt_kernel()
+                deadline = time.perf_counter() + INTERRUPT_GRACE_SECONDS
+                continue
+            if remaining <= 0:
+                logger.error(f"Kernel for project {project_id} did not respond to interrupt")
+                break
+            
             try:
-                # Get message with a reasonable timeout
-                msg = kernel_client.get_iopub_msg(timeout=20)
-                msg_type = msg['header']['msg_type']
-                
-                # Handle different message types
-                if msg_type == 'execute_result':
-                    outputs.append(str(msg['content']['data'].get('text/plain', '')))
-                
-                elif msg_type == 'display_data':
-                    if 'text/plain' in msg['content']['data']:
-                        outputs.append(str(msg['content']['data']['text/plain']))
-                    # Handle images (could be saved to disk or base64 encoded)
-                
-                elif msg_type == 'stream':
-                    outputs.append(msg['content']['text'])
-                
-                elif msg_type == 'error':
-                    error_output = '\n'.join(msg['content']['traceback'])
-                    break
-                
-                elif msg_type == 'status' and msg['content']['execution_state'] == 'idle':
-                    # Execution completed
-                    break
-                    
+                msg = kernel_client.get_iopub_msg(timeout=remaining)
+            except queue.Empty:
+                continue
             except Exception as e:
                 return {
                     'success': False,
                     'output': f"Error receiving kernel output: {str(e)}",
-                    'error': str(e)
+                    'error': str(e),
+                    'timed_out': timed_out,
+                    'timing': self._timing(submitted_at, started_at, 0)
                 }
+            
+            if msg['parent_header'].get('msg_id') != msg_id:
+                continue
+            msg_type = msg['header']['msg_type']
+            
+            # Handle different message types
+            text = None
+            if msg_type == 'execute_result':
+                text = str(msg['content']['data'].get('text/plain', ''))
+            
+            elif msg_type == 'display_data':
+                if 'text/plain' in msg['content']['data']:
+                    text = str(msg['content']['data']['text/plain'])
+                # Handle images (could be saved to disk or base64 encoded)
+            
+            elif msg_type == 'stream':
+                text = msg['content']['text']
+            
+            elif msg_type == 'error':
+                # Keep reading until the kernel reports idle for this request
+                error_output = '\n'.join(msg['content']['traceback'])
+            
+            elif msg_type == 'status' and msg['content']['execution_state'] == 'busy':
+                started_at = time.perf_counter()
+            
+            elif msg_type == 'status' and msg['content']['execution_state'] == 'idle':
+                # Execution completed
+                break
+            
+            if text is not None:
+                outputs.append(text)
+                if on_output is not None:
+                    on_output(text)
+        
+        if timed_out:
+            error_output = (
+                f"Execution exceeded the {self.execution_timeout}s time limit and was interrupted."
+                + (f"\n\n{error_output}" if error_output else "")
+            )
+        
+        output = '\n'.join(outputs) if outputs else ""
         
         # Save the executed code to the notebook
-        self._append_to_notebook(project_id, code, '\n'.join(outputs), error_output)
+        self._append_to_notebook(project_id, code, output, error_output)
         
         # Increment execution count
         self.kernels[project_id]['execution_count'] += 1
+        self.kernels[project_id]['cell_count'] += 1
+        self.supervisor.touch(project_id)
         
         return {
             'success': error_output is None,
-            'output': '\n'.join(outputs) if outputs else "",
-            'error': error_output
+            'output': output,
+            'error': error_output,
+            'timed_out': timed_out,
+            'timing': self._timing(submitted_at, started_at, len(output.encode('utf-8')))
         }
     
-    def _append_to_notebook(self, project_id: str, code: str, output: str, error: Optional[str] = None):
-        """Append executed code and its output to the notebook file."""
-        notebook_path = self.get_notebook_path(project_id)
+    def _timing(self, submitted_at: float, started_at: Optional[float], output_bytes: int) -> Dict[str, Any]:
+        """Build the timing metadata returned with every execution result."""
+        now = time.perf_counter()
+        started_at = started_at or now
+        return {
+            'queue_time': round(started_at - submitted_at, 4),
+            'run_time': round(now - started_at, 4),
+            'total_time': round(now - submitted_at, 4),
+            'output_bytes': output_bytes
+        }
+    
+    def _run_silently(self, kernel_client, code: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Run housekeeping code in a kernel without recording it in the notebook.
+        
+        Returns:
+            The content of the kernel's execute_reply
+        """
+        reply = kernel_client.execute_interactive(
+            code, store_history=False, timeout=timeout, output_hook=lambda msg: None
+        )
+        return reply['content']
+    
+    def get_snapshot_dir(self, project_id: str) -> str:
+        """Get the directory holding a project's latest namespace snapshot."""
+        return os.path.abspath(os.path.join(self.notebooks_dir, "snapshots", project_id))
+    
+    def _save_snapshot(self, project_id: str) -> bool:
+        """Snapshot a live kernel's user namespace, tagged with the number of cells it reflects.
         
+        Returns:
+            True if the snapshot was written
+        """
+        snapshot_dir = self.get_snapshot_dir(project_id)
+        os.makedirs(os.path.dirname(snapshot_dir), exist_ok=True)
+        cell_count = self.kernels[project_id]['cell_count']
+        save_code = (
+            "from backend.app.core.kernel_snapshot import save_namespace as _save_namespace\n"
+            f"_save_namespace(get_ipython().user_ns, {snapshot_dir!r}, extra={{'cell_count': {cell_count}}})"
+        )
         try:
-            with open(notebook_path, 'r') as f:
-                nb = nbformat.read(f, as_version=4)
-        except Exception:
-            nb = new_notebook()
+            reply = self._run_silently(self.kernels[project_id]['client'], save_code, timeout=300)
+            if reply.get('status') == 'ok':
+                return True
+            logger.error(f"Failed to snapshot kernel for project {project_id}: {reply.get('evalue')}")
+        except Exception as e:
+            logger.error(f"Failed to snapshot kernel for project {project_id}: {e}")
+        return False
+    
+    def _checkpoint(self, project_id: str):
+        """Write a periodic checkpoint, waiting for any cell running in the project to finish."""
+        with self._project_lock(project_id):
+            if project_id in self.kernels:
+                self._save_snapshot(project_id)
+    
+    def hibernate_kernel(self, project_id: str, force_shutdown: bool = False) -> bool:
+        """Save a kernel's user namespace to disk and shut the kernel down.
+        
+        DataFrames are written as Parquet and other picklable objects are
+        pickled. The snapshot is restored into a fresh kernel the next time
+        code is executed for the project.
+        
+        Args:
+            project_id: The project identifier
+            force_shutdown: Shut the kernel down even if the snapshot could not be written
+            
+        Returns:
+            True if the namespace was saved
+        """
+        if project_id not in self.kernels:
+            return False
+        
+        saved = self._save_snapshot(project_id)
+        if saved or force_shutdown:
+            logger.info(f"Hibernating kernel for project {project_id} (snapshot saved: {saved})")
+            self.shutdown_kernel(project_id)
+        return saved
+    
+    def _project_lock(self, project_id: str) -> threading.RLock:
+        with self._project_locks_guard:
+            if project_id not in self._project_locks:
+                self._project_locks[project_id] = threading.RLock()
+            return self._project_locks[project_id]
+    
+    def _release_idle_kernel(self, project_id: str, force_shutdown: bool) -> bool:
+        """Hibernate or shut down a kernel picked by the supervisor, unless it is in use.
+        
+        Returns:
+            False if the kernel was left running
+        """
+        lock = self._project_lock(project_id)
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            if self.hibernate_idle_seconds > 0:
+                return self.hibernate_kernel(project_id, force_shutdown=force_shutdown) or force_shutdown
+            self.shutdown_kernel(project_id)
+            return True
+        finally:
+            lock.release()
+    
+    def is_hibernated(self, project_id: str) -> bool:
+        """Whether a project has a saved namespace waiting to be restored."""
+        return project_id not in self.kernels and read_manifest(self.get_snapshot_dir(project_id)) is not None
+    
+    def _restore_session(self, project_id: str, kernel_manager, kernel_client) -> Dict[str, Any]:
+        """Rebuild a session's state in a freshly started kernel.
+        
+        The latest snapshot (periodic checkpoint or hibernation) is loaded
+        first, then only the successfully executed cells recorded after it are
+        replayed. Replay stops once ``replay_time_budget`` seconds are used up.
+        
+        Returns:
+            Report of what was restored, also kept on the kernel entry
+        """
+        start = time.perf_counter()
+        history = self.journal.read_history(project_id, self.get_notebook_path(project_id))
+        report = {
+            'checkpoint_cell': 0,
+            'restored_variables': 0,
+            'replayed_cells': 0,
+            'skipped_cells': 0,
+            'failed_cells': 0,
+            'remaining_cells': 0,
+            'complete': True,
+            'seconds': 0.0,
+        }
         
-        # Add the code cell
-        nb.cells.append(new_code_cell(code))
+        snapshot_dir = self.get_snapshot_dir(project_id)
+        manifest = read_manifest(snapshot_dir)
+        if manifest is not None and manifest['extra'].get('cell_count', 0) <= len(history):
+            restore_code = (
+                "from backend.app.core.kernel_snapshot import restore_namespace as _restore_namespace\n"
+                f"_restore_namespace(get_ipython().user_ns, {snapshot_dir!r})"
+            )
+            try:
+                reply = self._run_silently(kernel_client, restore_code, timeout=self.replay_time_budget)
+                if reply.get('status') == 'ok':
+                    report['checkpoint_cell'] = manifest['extra'].get('cell_count', 0)
+                    report['restored_variables'] = len(manifest['variables'])
+                else:
+                    logger.error(f"Failed to restore snapshot for project {project_id}: {reply.get('evalue')}")
+            except Exception as e:
+                logger.error(f"Failed to restore snapshot for project {project_id}: {e}")
         
-        # Add output as a markdown cell with formatting
-        if output or error:
-            content = "**Output:**\n```\n"
-            if output:
-                content += output
-            if error:
-                content += f"\n\n**Error:**\n{error}"
-            content += "\n```"
+        pending = history[report['checkpoint_cell']:]
+        for index, cell in enumerate(pending):
+            # Cells that failed originally left no state behind, and pooled kernels already ran the setup
+            if cell['failed'] or (self.kernel_pool is not None and cell['code'] == SETUP_CODE):
+                report['skipped_cells'] += 1
+                continue
             
-            # Create markdown cell for output
-            output_cell = nbformat.v4.new_markdown_cell(content)
-            nb.cells.append(output_cell)
+            remaining = self.replay_time_budget - (time.perf_counter() - start)
+            if remaining <= 0:
+                report['remaining_cells'] = len(pending) - index
+                report['complete'] = False
+                break
+            try:
+                reply = self._run_silently(kernel_client, cell['code'], timeout=remaining)
+                if reply.get('status') == 'ok':
+                    report['replayed_cells'] += 1
+                else:
+                    report['failed_cells'] += 1
+            except TimeoutError:
+                kernel_manager.interrupt_kernel()
+                report['remaining_cells'] = len(pending) - index
+                report['complete'] = False
+                break
+        
+        report['seconds'] = round(time.perf_counter() - start, 3)
+        self.kernels[project_id]['cell_count'] = len(history)
+        if report['checkpoint_cell'] or report['replayed_cells'] or report['failed_cells']:
+            logger.info(f"Restored session for project {project_id}: {report}")
+        return report
+    
+    def _append_to_notebook(self, project_id: str, code: str, output: str, error: Optional[str] = None):
+        """Record executed code and its output in the project's append-only journal."""
+        self.journal.append(project_id, code, output, error)
+    
+    def compact_notebook(self, project_id: str) -> str:
+        """Fold journaled executions into the project's .ipynb file.
         
-        # Write the updated notebook
-        with open(notebook_path, 'w') as f:
-            nbformat.write(nb, f)
+        Returns:
+            Path to the up-to-date notebook file
+        """
+        notebook_path = self.ensure_notebook_exists(project_id)
+        self.journal.compact(project_id, notebook_path)
+        return notebook_path
     
     def shutdown_kernel(self, project_id: str):
         """Shutdown a project's kernel."""
         if project_id in self.kernels:
+            # The session is over, so materialize its notebook
+            try:
+                self.compact_notebook(project_id)
+            except Exception as e:
+                print(f"Error compacting notebook for project {project_id}: {e}")
             try:
                 self.kernels[project_id]['manager'].shutdown_kernel()
                 self.kernels[project_id]['client'].shutdown()
                 del self.kernels[project_id]
+                self.supervisor.unregister(project_id)
             except Exception as e:
                 print(f"Error shutting down kernel for project {project_id}: {e}")
     
+    def kernel_stats(self) -> Dict[str, Any]:
+        """Report live kernel count and memory usage."""
+        stats = self.supervisor.stats()
+        stats['idle_pool_kernels'] = self.kernel_pool.idle_count() if self.kernel_pool else 0
+        snapshots_dir = os.path.join(self.notebooks_dir, "snapshots")
+        snapshots = os.listdir(snapshots_dir) if os.path.isdir(snapshots_dir) else []
+        stats['hibernated_sessions'] = len([p for p in snapshots if p not in self.kernels and not p.endswith('.tmp')])
+        for kernel_info in stats['kernels']:
+            kernel_info['restore_report'] = self.kernels.get(kernel_info['project_id'], {}).get('restore_report')
+        return stats
+    
     def cleanup(self):
-        """Shutdown all kernels."""
+        """Shutdown all kernels, including idle pooled ones."""
+        self._checkpoints.shutdown(wait=True, cancel_futures=True)
         for project_id in list(self.kernels.keys()):
-            self.shutdown_kernel(project_id) 
\ No newline at end of file
+            self.shutdown_kernel(project_id)
+        if self.kernel_pool is not None:
+            self.kernel_pool.close() 
\ No newline at end of file
@@ -1,7 +1,8 @@
 from datetime import datetime
+from ..database.session_store import StoreBackedDict, session_store
 
-# In-memory session storage. In production, consider using a database for persistence.
-session_data = {}
+# Session storage shared by all workers through the session store
+session_data = StoreBackedDict(session_store, "session_data")
 
 def ensure_session(session_id):
     """Ensure a session exists and return session data
@@ -13,11 +14,11 @@ def ensure_session(session_id):
         dict: The session data
     """
     if session_id not in session_data:
-        session_data[session_id] = {
+        return session_data.setdefault(session_id, {
             "dataframes": {},
             "history": [],
             "created_at": datetime.now().isoformat(),
-        }
+        })
     return session_data[session_id]
 
 def get_session(session_id):
@@ -42,10 +43,16 @@ def update_session_history(session_id, message, response):
     Returns:
         dict: The updated session data
     """
-    session = ensure_session(session_id)
-    session["history"].append({
+    ensure_session(session_id)
+    entry = {
         "message": message,
         "response": response,
         "timestamp": datetime.now().isoformat()
-    })
-    return session 
\ No newline at end of file
+    }
+
+    def append(session):
+        session["history"].append(entry)
+        return session
+
+    # Only adds the entry, so concurrent updates from other workers are kept
+    return session_data.modify(session_id, append) 
\ No newline at end of file
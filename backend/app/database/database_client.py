@@ -1,17 +1,23 @@
 # This is a placeholder for a database client implementation
 # In a real application, this would connect to your NoSQL database
 
+from .metadata_store import metadata_store as shared_metadata_store
+
 class DatabaseClient:
     """Client for interacting with the database
     
-    This is a minimal implementation that uses in-memory storage. In a production
-    application, this would be replaced with actual database connection logic.
+    Projects and file metadata live in the indexed MetadataStore that
+    file_management also writes to, so both see the same records. It is
+    backed by the session store configured with SESSION_STORE_URL.
     """
     
-    def __init__(self):
-        """Initialize the database client"""
-        self.projects = {}  # In-memory storage for projects
-        self.files = {}  # In-memory storage for file metadata
+    def __init__(self, store=None):
+        """Initialize the database client
+        
+        Args:
+            store: Metadata store to use (defaults to the shared one)
+        """
+        self.store = store or shared_metadata_store
     
     def store_project(self, project):
         """Store a project in the database
@@ -22,9 +28,7 @@ class DatabaseClient:
         Returns:
             str: The project ID
         """
-        project_data = project.to_dict()
-        self.projects[project.paper_id] = project_data
-        return project.paper_id
+        return self.store.put_project(project.to_dict())
     
     def get_project(self, user_id, paper_id):
         """Retrieve a project from the database
@@ -36,10 +40,18 @@ class DatabaseClient:
         Returns:
             dict: The project data or None if not found
         """
-        project_data = self.projects.get(paper_id)
-        if project_data and project_data["user_id"] == user_id:
-            return project_data
-        return None
+        return self.store.get_project(user_id, paper_id)
+    
+    def get_user_projects(self, user_id):
+        """Retrieve all projects owned by a user
+        
+        Args:
+            user_id: The ID of the user
+            
+        Returns:
+            list: The user's projects, oldest first
+        """
+        return self.store.get_user_projects(user_id)
     
     def store_file_metadata(self, file_metadata):
         """Store file metadata in the database
@@ -50,9 +62,7 @@ class DatabaseClient:
         Returns:
             str: The file ID
         """
-        file_id = file_metadata["file_id"]
-        self.files[file_id] = file_metadata
-        return file_id
+        return self.store.put_file(file_metadata)
     
     def get_file_metadata(self, file_id):
         """Retrieve file metadata from the database
@@ -63,7 +73,7 @@ class DatabaseClient:
         Returns:
             dict: The file metadata or None if not found
         """
-        return self.files.get(file_id)
+        return self.store.get_file(file_id)
     
     def get_project_files(self, user_id, paper_id):
         """Retrieve all files associated with a project
@@ -75,11 +85,7 @@ class DatabaseClient:
         Returns:
             list: A list of file metadata for the project
         """
-        matching_files = []
-        for file_id, metadata in self.files.items():
-            if metadata["user_id"] == user_id and metadata["paper_id"] == paper_id:
-                matching_files.append(metadata)
-        return matching_files
+        return self.store.get_project_files(user_id, paper_id)
 
 # Create a singleton instance of the database client
 db_client = DatabaseClient() 
\ No newline at end of file
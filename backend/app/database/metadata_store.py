@@ -0,0 +1,104 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from .session_store import SessionStore, session_store
+
+
+class MetadataStore:
+    """Single store for project and file metadata with secondary indexes
+
+    Records are kept by their primary key (``paper_id`` for projects,
+    ``file_id`` for files) in the session store. Index fields on ``user_id``
+    and on ``(user_id, paper_id)`` are written with every record, so listing
+    a user's projects or a project's files costs time proportional to the
+    result rather than to every record ever stored. Because the records live
+    in the session store, every worker sees the same metadata.
+    """
+
+    PROJECTS = "projects"
+    FILES = "files"
+
+    def __init__(self, store: SessionStore):
+        """Initialize the metadata store
+
+        Args:
+            store: Session store holding the records
+        """
+        self.store = store
+
+    @staticmethod
+    def _project_key(user_id, paper_id):
+        return json.dumps([user_id, paper_id])
+
+    def put_project(self, project_data):
+        """Store or replace a project
+
+        Args:
+            project_data: Project dict with at least ``paper_id`` and ``user_id``
+
+        Returns:
+            str: The paper ID
+        """
+        paper_id = project_data["paper_id"]
+        self.store.put(self.PROJECTS, paper_id, project_data, index={'user_id': project_data["user_id"]})
+        return paper_id
+
+    def get_project(self, user_id, paper_id) -> Optional[Dict[str, Any]]:
+        """Retrieve a project if it belongs to the user
+
+        Returns:
+            dict: The project data or None if not found
+        """
+        project_data = self.store.get(self.PROJECTS, paper_id)
+        if project_data and project_data["user_id"] == user_id:
+            return project_data
+        return None
+
+    def get_user_projects(self, user_id) -> List[Dict[str, Any]]:
+        """Retrieve all projects of a user, oldest first"""
+        return self.store.find(self.PROJECTS, 'user_id', user_id)
+
+    def put_file(self, file_metadata):
+        """Store or replace file metadata
+
+        Args:
+            file_metadata: File dict with at least ``file_id``, ``user_id`` and ``paper_id``
+
+        Returns:
+            str: The file ID
+        """
+        file_id = file_metadata["file_id"]
+        index = {
+            'user_id': file_metadata["user_id"],
+            'project': self._project_key(file_metadata["user_id"], file_metadata["paper_id"]),
+        }
+        self.store.put(self.FILES, file_id, file_metadata, index=index)
+        return file_id
+
+    def get_file(self, file_id) -> Optional[Dict[str, Any]]:
+        """Retrieve file metadata by ID
+
+        Returns:
+            dict: The file metadata or None if not found
+        """
+        return self.store.get(self.FILES, file_id)
+
+    def delete_file(self, file_id) -> bool:
+        """Remove file metadata
+
+        Returns:
+            bool: Whether the file existed
+        """
+        return self.store.delete(self.FILES, file_id)
+
+    def get_project_files(self, user_id, paper_id) -> List[Dict[str, Any]]:
+        """Retrieve all files of a project, in upload order"""
+        return self.store.find(self.FILES, 'project', self._project_key(user_id, paper_id))
+
+    def get_user_files(self, user_id) -> List[Dict[str, Any]]:
+        """Retrieve all files of a user across projects, in upload order"""
+        return self.store.find(self.FILES, 'user_id', user_id)
+
+
+# Shared store behind file_management and DatabaseClient
+metadata_store = MetadataStore(session_store)
@@ -0,0 +1,496 @@
+import os
+import copy
+import json
+import time
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Attempts of a read-modify-write before giving up on a value other writers keep changing
+MAX_MODIFY_ATTEMPTS = 50
+
+
+class SessionStore(ABC):
+    """Key-value store for session state shared by all worker processes.
+
+    Values are JSON-serializable objects grouped into namespaces. Every write
+    gives the value a new revision number, which lets caches check cheaply
+    whether what they hold is still current. A value can be written with
+    index fields, and ``find`` then returns every value of the namespace with
+    a given field value, without scanning the namespace.
+
+    Values that several workers change must be written with ``modify`` (or
+    ``put_if_revision``), which only stores a change if nobody else wrote the
+    value since it was read; a plain ``put`` silently replaces concurrent
+    changes.
+
+    Backends only have to provide the abstract operations, so a networked
+    store (Redis, a SQL server) can replace the SQLite one without touching
+    callers.
+    """
+
+    @abstractmethod
+    def get_entry(self, namespace: str, key: str) -> Optional[Tuple[Any, int]]:
+        """Return the value stored under a key with its revision, or None."""
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Return the value stored under a key, or None."""
+        entry = self.get_entry(namespace, key)
+        return entry[0] if entry else None
+
+    @abstractmethod
+    def revision(self, namespace: str, key: str) -> Optional[int]:
+        """Return the revision of the value under a key, or None if there is none."""
+
+    @abstractmethod
+    def put(self, namespace: str, key: str, value: Any, index: Optional[Dict[str, str]] = None) -> int:
+        """Store a value, replacing any previous one and its index fields.
+
+        Returns:
+            The value's new revision
+        """
+
+    @abstractmethod
+    def put_if_revision(self, namespace: str, key: str, value: Any, expected: Optional[int],
+                        index: Optional[Dict[str, str]] = None) -> Optional[int]:
+        """Store a value only if the stored revision is still ``expected``.
+
+        Args:
+            expected: Revision the caller read, or None to only store the value if the key is absent
+
+        Returns:
+            The value's new revision, or None if another writer got there first
+        """
+
+    def setdefault(self, namespace: str, key: str, value: Any, index: Optional[Dict[str, str]] = None) -> Any:
+        """Store a value if the key is absent, atomically. Returns the value stored under the key."""
+        while True:
+            if self.put_if_revision(namespace, key, value, None, index) is not None:
+                return value
+            existing = self.get(namespace, key)
+            if existing is not None:
+                return existing
+
+    def modify(self, namespace: str, key: str, change: Callable[[Any], Any],
+               default: Optional[Callable[[], Any]] = None, index: Optional[Dict[str, str]] = None) -> Any:
+        """Apply a change to a value without losing concurrent changes.
+
+        ``change`` receives the current value (or ``default()`` if the key is
+        absent) and returns the new one. If another writer stored the value in
+        the meantime, the change is applied again to the newer value, so
+        ``change`` must not have side effects.
+
+        Returns:
+            The stored value
+
+        Raises:
+            KeyError: If the key is absent and there is no default
+        """
+        for _ in range(MAX_MODIFY_ATTEMPTS):
+            entry = self.get_entry(namespace, key)
+            if entry is None:
+                if default is None:
+                    raise KeyError(key)
+                value, expected = default(), None
+            else:
+                value, expected = entry
+            value = change(value)
+            if self.put_if_revision(namespace, key, value, expected, index) is not None:
+                return value
+        raise RuntimeError(f"Could not update {namespace}/{key}: it kept changing concurrently")
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str) -> bool:
+        """Remove a value. Returns whether it existed."""
+
+    @abstractmethod
+    def keys(self, namespace: str) -> List[str]:
+        """Return all keys of a namespace, oldest first."""
+
+    @abstractmethod
+    def find(self, namespace: str, field: str, value: str) -> List[Any]:
+        """Return the values whose index ``field`` equals ``value``, oldest first."""
+
+    def close(self):
+        """Release the store's resources."""
+
+
+class MemorySessionStore(SessionStore):
+    """Store kept in this process's memory; only suitable for a single worker."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._values: Dict[str, Dict[str, Tuple[Any, int]]] = {}
+        self._revision = 0
+        self._index_fields: Dict[Tuple[str, str], Dict[str, str]] = {}
+        # Indexes map (namespace, field, value) to keys; dicts keep insertion order
+        self._indexes: Dict[Tuple[str, str, str], Dict[str, None]] = {}
+
+    def revision(self, namespace, key):
+        entry = self.get_entry(namespace, key)
+        return entry[1] if entry else None
+
+    def _unindex(self, namespace, key):
+        for field, value in self._index_fields.pop((namespace, key), {}).items():
+            keys = self._indexes.get((namespace, field, value))
+            if keys is not None:
+                keys.pop(key, None)
+                if not keys:
+                    del self._indexes[(namespace, field, value)]
+
+    def get_entry(self, namespace, key):
+        with self._lock:
+            entry = self._values.get(namespace, {}).get(key)
+            # Copies, like a store that serializes values, so callers never share state
+            return (copy.deepcopy(entry[0]), entry[1]) if entry else None
+
+    def put(self, namespace, key, value, index=None):
+        with self._lock:
+            self._unindex(namespace, key)
+            self._revision += 1
+            self._values.setdefault(namespace, {})[key] = (copy.deepcopy(value), self._revision)
+            if index:
+                self._index_fields[(namespace, key)] = dict(index)
+                for field, field_value in index.items():
+                    self._indexes.setdefault((namespace, field, field_value), {})[key] = None
+            return self._revision
+
+    def put_if_revision(self, namespace, key, value, expected, index=None):
+        with self._lock:
+            entry = self._values.get(namespace, {}).get(key)
+            if (entry[1] if entry else None) != expected:
+                return None
+            return self.put(namespace, key, value, index)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            if key not in self._values.get(namespace, {}):
+                return False
+            self._unindex(namespace, key)
+            del self._values[namespace][key]
+            return True
+
+    def keys(self, namespace):
+        with self._lock:
+            return list(self._values.get(namespace, {}))
+
+    def find(self, namespace, field, value):
+        with self._lock:
+            values = self._values.get(namespace, {})
+            return [copy.deepcopy(values[key][0]) for key in self._indexes.get((namespace, field, value), ())]
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store in a SQLite database in WAL mode, shared by the workers on one machine.
+
+    WAL lets readers proceed while a writer commits, so workers rarely wait
+    on each other. Every thread gets its own connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            UNIQUE (namespace, key)
+        );
+        CREATE TABLE IF NOT EXISTS entry_index (
+            namespace TEXT NOT NULL,
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            entry_id INTEGER NOT NULL,
+            PRIMARY KEY (namespace, field, value, entry_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS entry_index_by_entry ON entry_index (entry_id);
+        -- Store-wide counter, so a key that is deleted and written again never reuses a revision
+        CREATE TABLE IF NOT EXISTS revision_counter (id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL);
+        INSERT OR IGNORE INTO revision_counter (id, value) VALUES (0, 0);
+    """
+
+    def __init__(self, path: str):
+        """Open (and if needed create) the database.
+
+        Args:
+            path: Path of the SQLite database file
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._connection().executescript(self.SCHEMA)
+
+    def _open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._open()
+        return connection
+
+    def get_entry(self, namespace, key):
+        row = self._connection().execute(
+            "SELECT value, revision FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def revision(self, namespace, key):
+        row = self._connection().execute(
+            "SELECT revision FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, connection, namespace, key, encoded, index):
+        """Store a value inside the caller's transaction and return its revision."""
+        connection.execute("UPDATE revision_counter SET value = value + 1 WHERE id = 0")
+        revision = connection.execute("SELECT value FROM revision_counter WHERE id = 0").fetchone()[0]
+        connection.execute(
+            "INSERT INTO entries (namespace, key, value, revision, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, "
+            "revision = excluded.revision, updated_at = excluded.updated_at",
+            (namespace, key, encoded, revision, time.time())
+        )
+        entry_id = connection.execute(
+            "SELECT id FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()[0]
+        connection.execute("DELETE FROM entry_index WHERE entry_id = ?", (entry_id,))
+        if index:
+            connection.executemany(
+                "INSERT INTO entry_index (namespace, field, value, entry_id) VALUES (?, ?, ?, ?)",
+                [(namespace, field, field_value, entry_id) for field, field_value in index.items()]
+            )
+        return revision
+
+    def put(self, namespace, key, value, index=None):
+        connection = self._connection()
+        encoded = json.dumps(value)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            revision = self._write(connection, namespace, key, encoded, index)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return revision
+
+    def put_if_revision(self, namespace, key, value, expected, index=None):
+        connection = self._connection()
+        encoded = json.dumps(value)
+        # BEGIN IMMEDIATE takes the write lock, so no other writer can slip in between the check and the write
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT revision FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            revision = None
+            if (row[0] if row else None) == expected:
+                revision = self._write(connection, namespace, key, encoded, index)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return revision
+
+    def delete(self, namespace, key):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT id FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row:
+                connection.execute("DELETE FROM entry_index WHERE entry_id = ?", (row[0],))
+                connection.execute("DELETE FROM entries WHERE id = ?", (row[0],))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return row is not None
+
+    def keys(self, namespace):
+        rows = self._connection().execute(
+            "SELECT key FROM entries WHERE namespace = ? ORDER BY id", (namespace,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def find(self, namespace, field, value):
+        rows = self._connection().execute(
+            "SELECT e.value FROM entry_index i JOIN entries e ON e.id = i.entry_id "
+            "WHERE i.namespace = ? AND i.field = ? AND i.value = ? ORDER BY e.id",
+            (namespace, field, value)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+class CachedSessionStore(SessionStore):
+    """Read-through LRU cache in front of another store.
+
+    A read first asks the backend for the value's revision, which is a cheap
+    indexed lookup, and only fetches and decodes the value when the cached
+    copy is missing or older. Writes from other workers are therefore always
+    seen, while the large conversation histories are not decoded on every
+    request. Writes go to the backend first and then update the cache.
+
+    Reads return copies, so a value changed in place only reaches the store
+    (and other readers) when it is written back.
+    """
+
+    def __init__(self, backend: SessionStore, max_entries: int = 1000):
+        """Initialize the cache.
+
+        Args:
+            backend: Store holding the data
+            max_entries: Values kept in memory before the least recently used are dropped
+        """
+        self.backend = backend
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, namespace, key, value, revision):
+        # Keep a private copy: the caller may go on changing the object it stored
+        value = copy.deepcopy(value)
+        with self._lock:
+            cached = self._entries.get((namespace, key))
+            if cached is not None and cached[1] > revision:
+                # A concurrent request already cached a newer revision
+                return
+            self._entries[(namespace, key)] = (value, revision)
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_entry(self, namespace, key):
+        revision = self.backend.revision(namespace, key)
+        with self._lock:
+            if revision is None:
+                self._entries.pop((namespace, key), None)
+                return None
+            cached = self._entries.get((namespace, key))
+            if cached is not None and cached[1] == revision:
+                self._entries.move_to_end((namespace, key))
+                return copy.deepcopy(cached[0]), cached[1]
+
+        entry = self.backend.get_entry(namespace, key)
+        if entry is not None:
+            self._remember(namespace, key, *entry)
+        return entry
+
+    def revision(self, namespace, key):
+        return self.backend.revision(namespace, key)
+
+    def put(self, namespace, key, value, index=None):
+        revision = self.backend.put(namespace, key, value, index)
+        self._remember(namespace, key, value, revision)
+        return revision
+
+    def put_if_revision(self, namespace, key, value, expected, index=None):
+        revision = self.backend.put_if_revision(namespace, key, value, expected, index)
+        if revision is not None:
+            self._remember(namespace, key, value, revision)
+        return revision
+
+    def delete(self, namespace, key):
+        existed = self.backend.delete(namespace, key)
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+        return existed
+
+    def keys(self, namespace):
+        return self.backend.keys(namespace)
+
+    def find(self, namespace, field, value):
+        return self.backend.find(namespace, field, value)
+
+    def close(self):
+        self.backend.close()
+
+
+class StoreBackedDict(MutableMapping):
+    """Dict-like view of one namespace of a session store.
+
+    Assigning a key writes it to the store. Values read from it are copies;
+    to change a value other workers may also be changing, use ``modify``
+    rather than reading it and assigning it back.
+    """
+
+    def __init__(self, store: SessionStore, namespace: str):
+        self.store = store
+        self.namespace = namespace
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.put(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        if not self.store.delete(self.namespace, key):
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.keys(self.namespace))
+
+    def __len__(self) -> int:
+        return len(self.store.keys(self.namespace))
+
+    def setdefault(self, key, default=None):
+        """Store ``default`` if the key is absent (atomically) and return the stored value."""
+        return self.store.setdefault(self.namespace, key, default)
+
+    def modify(self, key, change: Callable[[Any], Any], default: Optional[Callable[[], Any]] = None) -> Any:
+        """Change a value without losing concurrent changes; see ``SessionStore.modify``."""
+        return self.store.modify(self.namespace, key, change, default)
+
+
+def create_session_store(url: str, cache_size: int = 1000) -> SessionStore:
+    """Create the session store described by a URL.
+
+    Args:
+        url: ``sqlite:///<path>`` for a SQLite database, or ``memory://`` for a
+            store that only lives in this process
+        cache_size: Entries of the local read-through cache, 0 disables it
+
+    Returns:
+        The session store
+    """
+    if url.startswith("sqlite:///"):
+        store: SessionStore = SQLiteSessionStore(url[len("sqlite:///"):])
+    elif url.startswith("memory://"):
+        store = MemorySessionStore()
+    else:
+        raise ValueError(f"Unsupported session store URL: {url}")
+
+    logger.info(f"Using session store {url}")
+    return CachedSessionStore(store, cache_size) if cache_size > 0 else store
+
+
+# Shared store behind the chat sessions, user sessions and metadata
+session_store = create_session_store(settings.SESSION_STORE_URL, settings.SESSION_CACHE_SIZE)
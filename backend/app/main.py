@@ -4,7 +4,7 @@ from flask import Flask
 import google.generativeai as genai
 # import cohere # we will import cohere in chatbot.py where it's actually used
 from .core.notebook_manager import NotebookManager
-from .config import settings
+from .config import settings, UPLOAD_FOLDER
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,8 +25,7 @@ if not COHERE_API_KEY:
     logger.error("No Cohere API key found in environment variables")
     raise ValueError("COHERE_API_KEY environment variable is not set")
 
-# Define the base directory for storing uploaded files locally
-UPLOAD_FOLDER = 'uploads'
+# Base directory for storing uploaded files locally (UPLOAD_FOLDER in the environment)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)  # Create the folder if it doesn't exist
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
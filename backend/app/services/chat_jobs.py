@@ -0,0 +1,250 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from ..database.session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+# Seconds between saves of a running job's transcript while only output is arriving
+TRANSCRIPT_FLUSH_INTERVAL = 1.0
+
+# Seconds a job's lease lasts; the owning process renews it three times per period
+JOB_LEASE_SECONDS = 60
+
+ACTIVE_STATES = ('queued', 'running')
+
+
+class JobLimitError(RuntimeError):
+    """Raised when a user already has the maximum number of active jobs, or the project already has one."""
+
+
+class ChatJobQueue:
+    """Runs chat turns in the background so clients can poll instead of holding a connection.
+
+    Jobs run on a bounded pool in the process that accepted them. Their state
+    and a growing transcript are kept in the session store, so any worker can
+    answer status requests, and a client that disconnects can come back for
+    the result. Each user may only have a limited number of jobs queued or
+    running at once, and each project only one, since the turns of a project
+    share its conversation and kernel.
+
+    The process running a job keeps renewing a lease on it. A queued or
+    running job whose lease has lapsed belonged to a worker, container or
+    machine that died, and is marked failed, which frees its slot.
+    """
+
+    NAMESPACE = "chat_jobs"
+    LEASES = "chat_job_leases"
+    # Ids of each user's and each project's queued and running jobs, changed with compare-and-set
+    # so workers cannot exceed the limits
+    SLOTS = "chat_job_slots"
+    PROJECT_SLOTS = "chat_job_project_slots"
+
+    def __init__(self, store: SessionStore, run_turn: Callable[[str, str, str], Iterator[Dict[str, Any]]],
+                 max_workers: int = 4, max_active_per_user: int = 2):
+        """Initialize the queue.
+
+        Args:
+            store: Session store holding the job records
+            run_turn: Function running a chat turn, ``run_turn(user_id, paper_id, message)``, yielding its events
+            max_workers: Jobs running at the same time in this process
+            max_active_per_user: Jobs a user may have queued or running
+        """
+        self.store = store
+        self.run_turn = run_turn
+        self.max_active_per_user = max_active_per_user
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-job")
+        self._leased: set = set()
+        self._leased_lock = threading.Lock()
+        threading.Thread(target=self._renew_leases, daemon=True, name="chat-job-leases").start()
+
+    def _save(self, job: Dict[str, Any]):
+        self.store.put(self.NAMESPACE, job['job_id'], job, index={'user_id': job['user_id']})
+
+    def _renew_lease(self, job_id: str):
+        self.store.put(self.LEASES, job_id, time.time() + JOB_LEASE_SECONDS)
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(JOB_LEASE_SECONDS / 3)
+            with self._leased_lock:
+                job_ids = list(self._leased)
+            for job_id in job_ids:
+                try:
+                    self._renew_lease(job_id)
+                except Exception as e:
+                    logger.error(f"Could not renew the lease of chat job {job_id}: {e}")
+
+    def _is_active(self, job_id: str) -> bool:
+        """Whether a job is queued or running in a process that is still alive."""
+        job = self.store.get(self.NAMESPACE, job_id)
+        if job is None or job['status'] not in ACTIVE_STATES:
+            return False
+        lease = self.store.get(self.LEASES, job_id)
+        return lease is not None and lease >= time.time()
+
+    def _expire(self, job_id: str):
+        """Mark a job whose owner stopped renewing its lease as failed."""
+        def fail(job):
+            if job['status'] in ACTIVE_STATES:
+                job.update(status='failed', error="The worker running this job stopped", finished_at=time.time())
+            return job
+
+        try:
+            self.store.modify(self.NAMESPACE, job_id, fail)
+        except KeyError:
+            pass
+
+    def _claim_slot(self, namespace: str, key: str, job_id: str, limit: int, error: str):
+        """Add a job to a slot list unless it already holds ``limit`` active jobs.
+
+        Raises:
+            JobLimitError: If the list is full
+        """
+        stale: List[str] = []
+
+        def claim(slots):
+            stale[:] = [j for j in slots if not self._is_active(j)]
+            live = [j for j in slots if j not in stale]
+            if len(live) >= limit:
+                raise JobLimitError(error)
+            return live + [job_id]
+
+        try:
+            self.store.modify(namespace, key, claim, default=list)
+        finally:
+            for stale_id in stale:
+                self._expire(stale_id)
+
+    def _release_slot(self, namespace: str, key: str, job_id: str):
+        self.store.modify(namespace, key, lambda slots: [j for j in slots if j != job_id], default=list)
+
+    def active_jobs(self, user_id: str) -> List[Dict[str, Any]]:
+        """Jobs of a user that are queued or running, marking those of dead workers as failed."""
+        active = []
+        for job in self.store.find(self.NAMESPACE, 'user_id', user_id):
+            if job['status'] not in ACTIVE_STATES:
+                continue
+            if not self._is_active(job['job_id']):
+                self._expire(job['job_id'])
+                continue
+            active.append(job)
+        return active
+
+    def submit(self, user_id: str, paper_id: str, message: str) -> Dict[str, Any]:
+        """Queue a chat turn.
+
+        Returns:
+            The job's status record
+
+        Raises:
+            JobLimitError: If the user already has ``max_active_per_user`` active jobs, or the project has one
+        """
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'paper_id': paper_id,
+            'message': message,
+            'status': 'queued',
+            'owner': self.owner,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'transcript': [],
+            'response': None,
+            'error': None,
+        }
+        job_id = job['job_id']
+        # The record and lease exist before the slot is claimed, so a concurrent claim counts this job as active
+        self._renew_lease(job_id)
+        self._save(job)
+
+        try:
+            self._claim_slot(self.PROJECT_SLOTS, paper_id, job_id, 1,
+                             f"Project {paper_id} already has an analysis running; wait for it to finish")
+            try:
+                self._claim_slot(
+                    self.SLOTS, user_id, job_id, self.max_active_per_user,
+                    f"User {user_id} already has {self.max_active_per_user} analyses running; wait for one to finish"
+                )
+            except JobLimitError:
+                self._release_slot(self.PROJECT_SLOTS, paper_id, job_id)
+                raise
+        except JobLimitError:
+            self.store.delete(self.NAMESPACE, job_id)
+            self.store.delete(self.LEASES, job_id)
+            raise
+
+        with self._leased_lock:
+            self._leased.add(job_id)
+        self._executor.submit(self._run, job)
+        logger.info(f"Queued chat job {job_id} for project {paper_id}")
+        return self.status(job_id)
+
+    def _run(self, job: Dict[str, Any]):
+        job.update(status='running', started_at=time.time())
+        self._save(job)
+        transcript = job['transcript']
+        last_flush = time.monotonic()
+
+        try:
+            for event in self.run_turn(job['user_id'], job['paper_id'], job['message']):
+                if event['type'] in ('text', 'history'):
+                    # Streaming fragments; the complete reply arrives as a message event
+                    continue
+                if event['type'] == 'done':
+                    job['response'] = event['response']
+                    break
+                previous = transcript[-1] if transcript else None
+                if (event['type'] == 'output' and previous and previous['type'] == 'output'
+                        and previous['block'] == event['block']):
+                    previous['text'] += event['text']
+                else:
+                    transcript.append(event)
+                if event['type'] != 'output' or time.monotonic() - last_flush >= TRANSCRIPT_FLUSH_INTERVAL:
+                    self._save(job)
+                    last_flush = time.monotonic()
+            job['status'] = 'done'
+        except Exception as e:
+            logger.error(f"Chat job {job['job_id']} failed: {e}")
+            job.update(status='failed', error=str(e))
+
+        job['finished_at'] = time.time()
+        self._save(job)
+        with self._leased_lock:
+            self._leased.discard(job['job_id'])
+        self._release_slot(self.SLOTS, job['user_id'], job['job_id'])
+        self._release_slot(self.PROJECT_SLOTS, job['paper_id'], job['job_id'])
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The full job record, or None if there is no such job."""
+        job = self.store.get(self.NAMESPACE, job_id)
+        if job is not None and job['status'] in ACTIVE_STATES and not self._is_active(job_id):
+            self._expire(job_id)
+            job = self.store.get(self.NAMESPACE, job_id)
+        return job
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job's state without its transcript and result, or None if there is no such job."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        summary = {key: job[key] for key in ('job_id', 'user_id', 'paper_id', 'status', 'created_at',
+                                             'started_at', 'finished_at', 'error')}
+        summary['transcript_length'] = len(job['transcript'])
+        return summary
+
+    def user_jobs(self, user_id: str) -> List[Dict[str, Any]]:
+        """Status of every job of a user, oldest first."""
+        return [self.status(job['job_id']) for job in self.store.find(self.NAMESPACE, 'user_id', user_id)]
+
+    def shutdown(self):
+        """Stop accepting jobs and wait for running ones to finish."""
+        self._executor.shutdown(wait=True)
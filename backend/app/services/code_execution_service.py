@@ -1,17 +1,179 @@
 import re
-from typing import Dict, List, Tuple, Optional, Any
+import queue
+import asyncio
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, AsyncIterable, AsyncIterator, Deque, Dict, Iterable, Iterator, List, Tuple, Optional
 import logging
 import os
 from ..core.notebook_manager import NotebookManager
+from .execution_scheduler import ExecutionScheduler
+from .output_shaper import OutputShaper
 
 logger = logging.getLogger(__name__)
 
+# Match markdown code blocks: ```python followed by code and closing ```
+CODE_BLOCK_PATTERN = re.compile(r'```python\s*(.*?)```', re.DOTALL)
+
+
+class StreamingCodeBlockExtractor:
+    """Finds Python code blocks in a response that is still being generated.
+    
+    Feed it chunks of text as they arrive; each call returns the blocks whose
+    closing fence has just been seen. Over a whole response it returns exactly
+    what ``CodeExecutionService.extract_code_blocks`` would for the full text.
+    """
+    
+    def __init__(self):
+        self.buffer = ""
+        self._scan_from = 0
+    
+    def feed(self, chunk: str) -> List[str]:
+        """Add a chunk of text and return any newly completed code blocks."""
+        self.buffer += chunk
+        blocks = []
+        while True:
+            match = CODE_BLOCK_PATTERN.search(self.buffer, self._scan_from)
+            if not match:
+                break
+            blocks.append(match.group(1))
+            self._scan_from = match.end()
+        return blocks
+
+
+class _BlockRunner:
+    """Submits code blocks to the scheduler and reports their progress in block order."""
+    
+    def __init__(self, service: "CodeExecutionService", project_id: str):
+        self.service = service
+        self.project_id = project_id
+        self.submitted = 0
+        self._pending: Deque[Tuple[int, Future, "queue.Queue[str]"]] = deque()
+        self._results: List[Dict[str, Any]] = []
+    
+    def _next_block(self, code: str) -> Tuple[int, str]:
+        """Number the next block and normalize its code."""
+        index = self.submitted
+        self.submitted += 1
+        
+        # Remove leading/trailing whitespace
+        code = code.strip()
+        logger.info(f"Executing code block {index+1} for project {self.project_id}")
+        logger.info(f"Executed code: {code}\n")
+        return index, code
+    
+    def _finish(self, index: int, future: Future) -> Dict[str, Any]:
+        """Record a finished block and return its ``result`` event."""
+        result = future.result()
+        self._results.append(result)
+        return {
+            'type': 'result',
+            'block': index + 1,
+            'success': result['success'],
+            'error': result['error'],
+            'timing': result.get('timing')
+        }
+    
+    def submit(self, code: str) -> Dict[str, Any]:
+        """Queue a block for execution and return its ``code`` event."""
+        index, code = self._next_block(code)
+        
+        # Output is relayed from the worker thread as it arrives
+        output_queue: "queue.Queue[str]" = queue.Queue()
+        future = self.service.scheduler.submit_code(self.project_id, code, on_output=output_queue.put)
+        self._pending.append((index, future, output_queue))
+        return {'type': 'code', 'block': index + 1, 'code': code}
+    
+    def poll(self, wait: bool) -> Iterator[Dict[str, Any]]:
+        """Yield output and result events, blocking until all blocks finish if ``wait``."""
+        while self._pending:
+            index, future, output_queue = self._pending[0]
+            try:
+                text = output_queue.get(timeout=0.1) if wait else output_queue.get_nowait()
+                yield {'type': 'output', 'block': index + 1, 'text': text}
+                continue
+            except queue.Empty:
+                if not (future.done() and output_queue.empty()):
+                    if wait:
+                        continue
+                    return
+            
+            self._pending.popleft()
+            yield self._finish(index, future)
+    
+    def execution_output(self) -> str:
+        """Combined output of all finished blocks for the follow-up prompt."""
+        # Cap what goes back to the model; full outputs stay retrievable on disk
+        shaped_results = self.service.output_shaper.shape_results(self.project_id, self._results)
+        combined_output = [self.service.format_block_result(i, result) for i, result in enumerate(shaped_results)]
+        
+        # Join all outputs with separators
+        return "\n\n" + "\n\n---\n\n".join(combined_output)
+
+
+class _AsyncBlockRunner(_BlockRunner):
+    """Block runner for the asyncio chat pipeline.
+    
+    Blocks still execute on the scheduler's worker threads; their output and
+    completion are handed to the event loop, so waiting for a kernel never
+    blocks the loop's thread.
+    """
+    
+    def submit(self, code: str) -> Dict[str, Any]:
+        """Queue a block for execution and return its ``code`` event (call from the event loop)."""
+        index, code = self._next_block(code)
+        loop = asyncio.get_running_loop()
+        events: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        
+        def relay(text: Optional[str]):
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, text)
+            except RuntimeError:
+                # The loop is gone (server shutting down); the kernel still finishes the cell
+                pass
+        
+        # Output arrives before the future resolves, so None marks the end of the block
+        future = self.service.scheduler.submit_code(self.project_id, code, on_output=relay)
+        future.add_done_callback(lambda _: relay(None))
+        self._pending.append((index, future, events))
+        return {'type': 'code', 'block': index + 1, 'code': code}
+    
+    async def poll(self, wait: bool) -> AsyncIterator[Dict[str, Any]]:
+        """Yield output and result events, awaiting all blocks if ``wait``."""
+        while self._pending:
+            index, future, events = self._pending[0]
+            if wait:
+                text = await events.get()
+            else:
+                try:
+                    text = events.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+            
+            if text is not None:
+                yield {'type': 'output', 'block': index + 1, 'text': text}
+                continue
+            
+            self._pending.popleft()
+            yield self._finish(index, future)
+
+
 class CodeExecutionService:
     """Service to extract and execute code blocks from AI responses."""
     
-    def __init__(self, notebook_manager: NotebookManager):
-        """Initialize the service with a notebook manager."""
+    def __init__(self, notebook_manager: NotebookManager, scheduler: Optional[ExecutionScheduler] = None,
+                 output_shaper: Optional[OutputShaper] = None):
+        """Initialize the service with a notebook manager.
+        
+        Args:
+            notebook_manager: Notebook manager whose kernels run the code
+            scheduler: Scheduler that orders execution per project (one is created if omitted)
+            output_shaper: Caps the output fed back to the model (one with default
+                limits, saving full outputs next to the notebooks, is created if omitted)
+        """
         self.notebook_manager = notebook_manager
+        self.scheduler = scheduler or ExecutionScheduler(notebook_manager)
+        self.output_shaper = output_shaper or OutputShaper(os.path.join(notebook_manager.notebooks_dir, "outputs"))
     
     def extract_code_blocks(self, text: str) -> List[str]:
         """Extract Python code blocks from markdown text.
@@ -22,60 +184,121 @@ class CodeExecutionService:
         Returns:
             List of extracted Python code blocks
         """
-        # Match markdown code blocks: ```python followed by code and closing ```
-        pattern = r'```python\s*(.*?)```'
+        return CODE_BLOCK_PATTERN.findall(text)
+    
+    def format_block_result(self, index: int, result: Dict[str, Any]) -> str:
+        """Format one block's execution result for the follow-up prompt.
         
-        # Find all matches using re.DOTALL to include newlines
-        matches = re.findall(pattern, text, re.DOTALL)
+        Args:
+            index: Zero-based position of the block in the response
+            result: Result dictionary from NotebookManager.execute_code
+            
+        Returns:
+            The formatted block output
+        """
+        block_output = f"Code Block {index+1} Execution Results:\n"
         
-        return matches
+        if result['success']:
+            if result['output'].strip():
+                block_output += result['output']
+            else:
+                block_output += "(Code executed successfully with no output)"
+        else:
+            block_output += f"Execution Error:\n{result['error']}"
+        
+        return block_output
     
-    def execute_code_blocks(self, project_id: str, text: str) -> Tuple[bool, str]:
-        """Extract and execute all Python code blocks in the text.
+    def stream_code_blocks(self, project_id: str, text: str) -> Iterator[Dict[str, Any]]:
+        """Extract and execute all Python code blocks, yielding events as they happen.
+        
+        Yields a ``code`` event before each block runs, ``output`` events with
+        kernel output as it arrives, a ``result`` event when the block
+        finishes and, if there were any blocks, a final ``execution_output``
+        event carrying the combined output for the follow-up prompt.
         
         Args:
             project_id: The project identifier
             text: Text containing Python code blocks
-            
-        Returns:
-            Tuple of (has_code_blocks, execution_output)
         """
         logger.info(f"the ai text: {text}\n")
-        code_blocks = self.extract_code_blocks(text)
+        runner = _BlockRunner(self, project_id)
         
-        if not code_blocks:
-            return False, ""
+        for code in self.extract_code_blocks(text):
+            yield runner.submit(code)
+            yield from runner.poll(wait=True)
         
-        # Execute each code block and collect outputs
-        combined_output = []
+        if runner.submitted:
+            yield {'type': 'execution_output', 'output': runner.execution_output()}
+    
+    def stream_pipelined_blocks(self, project_id: str, chunks: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """Execute code blocks while the model response is still streaming.
         
-        for i, code in enumerate(code_blocks):
-            logger.info(f"Executing code block {i+1}/{len(code_blocks)} for project {project_id}")
-            
-            # Remove leading/trailing whitespace
-            code = code.strip()
-            logger.info(f"Executed code: {code}\n") 
-            
-            # Execute the code block
-            result = self.notebook_manager.execute_code(project_id, code)
-            
-            # Format the output
-            block_output = f"Code Block {i+1} Execution Results:\n"
-            
-            if result['success']:
-                if result['output'].strip():
-                    block_output += result['output']
-                else:
-                    block_output += "(Code executed successfully with no output)"
-            else:
-                block_output += f"Execution Error:\n{result['error']}"
-            
-            combined_output.append(block_output)
+        Each ``python`` block is submitted to the project's kernel as soon as
+        its closing fence arrives, so the kernel works while the model keeps
+        generating. Yields ``text`` events for every chunk, the same block
+        events as ``stream_code_blocks`` and, if there were any blocks, a final
+        ``execution_output`` event with the results in block order.
         
-        # Join all outputs with separators
-        execution_output = "\n\n" + "\n\n---\n\n".join(combined_output)
+        Args:
+            project_id: The project identifier
+            chunks: Iterator over the streamed response text
+        """
+        extractor = StreamingCodeBlockExtractor()
+        runner = _BlockRunner(self, project_id)
+        
+        for chunk in chunks:
+            yield {'type': 'text', 'text': chunk}
+            for code in extractor.feed(chunk):
+                yield runner.submit(code)
+            yield from runner.poll(wait=False)
+        
+        logger.info(f"the ai text: {extractor.buffer}\n")
+        yield from runner.poll(wait=True)
         
-        return True, execution_output
+        if runner.submitted:
+            yield {'type': 'execution_output', 'output': runner.execution_output()}
+    
+    async def astream_pipelined_blocks(self, project_id: str, chunks: AsyncIterable[str]) -> AsyncIterator[Dict[str, Any]]:
+        """Async version of ``stream_pipelined_blocks`` for the asyncio chat pipeline.
+        
+        Takes the streamed response as an async iterator and yields the same
+        events. Execution is awaited rather than polled from a request thread.
+        
+        Args:
+            project_id: The project identifier
+            chunks: Async iterator over the streamed response text
+        """
+        extractor = StreamingCodeBlockExtractor()
+        runner = _AsyncBlockRunner(self, project_id)
+        
+        async for chunk in chunks:
+            yield {'type': 'text', 'text': chunk}
+            for code in extractor.feed(chunk):
+                yield runner.submit(code)
+            async for event in runner.poll(wait=False):
+                yield event
+        
+        logger.info(f"the ai text: {extractor.buffer}\n")
+        async for event in runner.poll(wait=True):
+            yield event
+        
+        if runner.submitted:
+            yield {'type': 'execution_output', 'output': runner.execution_output()}
+    
+    def execute_code_blocks(self, project_id: str, text: str) -> Tuple[bool, str]:
+        """Extract and execute all Python code blocks in the text.
+        
+        Args:
+            project_id: The project identifier
+            text: Text containing Python code blocks
+            
+        Returns:
+            Tuple of (has_code_blocks, execution_output)
+        """
+        for event in self.stream_code_blocks(project_id, text):
+            if event['type'] == 'execution_output':
+                return True, event['output']
+        return False, ""
 
     def execute_code_in_notebook(self, paper_id: str, code: str) -> dict:
         """Executes code in the notebook associated with the given paper_id.
@@ -87,7 +310,7 @@ class CodeExecutionService:
         Returns:
             A dictionary containing the execution result.
         """
-        return self.notebook_manager.execute_code(paper_id, code)
+        return self.scheduler.execute_code(paper_id, code)
 
 # Test the code extraction and execution if run directly
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from ..core.notebook_manager import NotebookManager
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionScheduler:
+    """Runs kernel work in order per project and in parallel across projects.
+
+    Every project has its own FIFO queue. At most one job per project runs at a
+    time, so concurrent requests for the same session never interleave on its
+    kernel client, while different projects share a bounded worker pool. There
+    is no global lock around execution: a slow cell only holds up its own queue.
+    """
+
+    def __init__(self, notebook_manager: NotebookManager, max_workers: int = 4):
+        """Initialize the scheduler.
+
+        Args:
+            notebook_manager: Notebook manager whose kernels run the code
+            max_workers: Number of projects that may execute at the same time
+        """
+        self.notebook_manager = notebook_manager
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kernel-exec")
+        self._queues: Dict[str, Deque[Tuple[Future, Callable, tuple, dict]]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, project_id: str, fn: Callable, *args, **kwargs) -> Future:
+        """Queue ``fn(*args, **kwargs)`` behind the project's earlier work.
+
+        Returns:
+            Future resolving to the return value of ``fn``
+        """
+        future: Future = Future()
+        with self._lock:
+            pending = self._queues.get(project_id)
+            if pending is None:
+                # Nothing running for this project: start draining its queue
+                self._queues[project_id] = deque([(future, fn, args, kwargs)])
+                self._executor.submit(self._run_next, project_id)
+            else:
+                pending.append((future, fn, args, kwargs))
+        return future
+
+    def submit_code(self, project_id: str, code: str, on_output: Optional[Callable[[str], None]] = None) -> Future:
+        """Queue code for execution in the project's kernel.
+
+        Args:
+            project_id: The project identifier
+            code: Python code to execute
+            on_output: Optional callback receiving output as it is produced (called from a worker thread)
+
+        Returns:
+            Future resolving to the NotebookManager.execute_code result
+        """
+        return self.submit(
+            project_id, self.notebook_manager.execute_code, project_id, code,
+            submitted_at=time.perf_counter(), on_output=on_output
+        )
+
+    def execute_code(self, project_id: str, code: str, on_output: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """Execute code in the project's kernel once earlier work has finished."""
+        return self.submit_code(project_id, code, on_output).result()
+
+    def queue_depth(self, project_id: str) -> int:
+        """Number of jobs queued or running for a project."""
+        with self._lock:
+            return len(self._queues.get(project_id, ()))
+
+    def _run_next(self, project_id: str):
+        with self._lock:
+            future, fn, args, kwargs = self._queues[project_id][0]
+
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                logger.error(f"Scheduled job for project {project_id} failed: {e}")
+                future.set_exception(e)
+
+        with self._lock:
+            pending = self._queues[project_id]
+            pending.popleft()
+            if pending:
+                # Go back through the pool so other projects get a turn between our jobs
+                self._executor.submit(self._run_next, project_id)
+            else:
+                del self._queues[project_id]
+
+    def shutdown(self):
+        """Stop accepting work and wait for running jobs to finish."""
+        self._executor.shutdown(wait=True)
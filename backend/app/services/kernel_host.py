@@ -0,0 +1,413 @@
+import os
+import time
+import socket
+import logging
+import argparse
+import threading
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..config import settings
+from ..core.notebook_manager import NotebookManager
+from ..database.session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two heartbeats of a kernel host
+HEARTBEAT_INTERVAL = 5
+
+# A host whose last heartbeat is older than this is considered gone
+HOST_TIMEOUT = 20
+
+
+class HostUnreachableError(ConnectionError):
+    """Raised when a request could not be delivered to a kernel host, so nothing ran there."""
+
+
+class KernelHostRegistry:
+    """Maps each project to the kernel host process that runs its kernel.
+
+    Hosts register themselves and send heartbeats; a project is routed to the
+    live host with the fewest projects the first time it runs code, and sticks
+    to it afterwards. If its host disappears the project is moved to another
+    one, which rebuilds the kernel from the notebook's snapshot and history.
+    The registry lives in the session store, so every HTTP worker sees it.
+    """
+
+    HOSTS = "kernel_hosts"
+    ROUTES = "kernel_routes"
+
+    def __init__(self, store: SessionStore, host_timeout: float = HOST_TIMEOUT):
+        """Initialize the registry.
+
+        Args:
+            store: Session store shared by the HTTP workers and the hosts
+            host_timeout: Seconds without a heartbeat after which a host is considered gone
+        """
+        self.store = store
+        self.host_timeout = host_timeout
+
+    def register_host(self, host_id: str, address: Tuple[str, int]):
+        """Announce a host, or refresh its heartbeat."""
+        self.store.put(self.HOSTS, host_id, {
+            'host_id': host_id,
+            'address': list(address),
+            'heartbeat': time.time(),
+        })
+
+    def unregister_host(self, host_id: str):
+        """Remove a host that is shutting down."""
+        self.store.delete(self.HOSTS, host_id)
+
+    def live_hosts(self) -> List[Dict[str, Any]]:
+        """Hosts that sent a heartbeat recently."""
+        cutoff = time.time() - self.host_timeout
+        hosts = (self.store.get(self.HOSTS, host_id) for host_id in self.store.keys(self.HOSTS))
+        return [host for host in hosts if host and host['heartbeat'] >= cutoff]
+
+    def host_load(self, host_id: str) -> int:
+        """Number of projects routed to a host."""
+        return len(self.store.find(self.ROUTES, 'host_id', host_id))
+
+    def route(self, project_id: str) -> Dict[str, Any]:
+        """Return the host serving a project, assigning one if needed.
+
+        The assignment is a compare-and-set in the store: when several workers
+        route a new (or orphaned) project at the same time, one of them wins
+        and the others use its choice, so the project only ever has one kernel.
+        """
+        while True:
+            hosts = {host['host_id']: host for host in self.live_hosts()}
+            if not hosts:
+                raise RuntimeError("No kernel hosts are available")
+
+            entry = self.store.get_entry(self.ROUTES, project_id)
+            assigned, revision = entry if entry else (None, None)
+            if assigned and assigned['host_id'] in hosts:
+                return hosts[assigned['host_id']]
+
+            host_id = min(hosts, key=self.host_load)
+            stored = self.store.put_if_revision(
+                self.ROUTES, project_id, {'host_id': host_id}, revision, index={'host_id': host_id}
+            )
+            if stored is None:
+                # Another worker assigned the project first: look again and follow its choice
+                continue
+            if assigned:
+                logger.warning(f"Kernel host {assigned['host_id']} is gone; moved project {project_id} to {host_id}")
+            return hosts[host_id]
+
+    def forget_host(self, host_id: str):
+        """Mark a host that refused connections as gone, so its projects move elsewhere."""
+        host = self.store.get(self.HOSTS, host_id)
+        if host:
+            host['heartbeat'] = 0
+            self.store.put(self.HOSTS, host_id, host)
+
+
+class KernelHostServer:
+    """Process that owns kernels and executes code in them on request.
+
+    Requests arrive over ``multiprocessing.connection`` (authenticated with a
+    shared key). While code runs, its output is streamed back as it is
+    produced, followed by the result of NotebookManager.execute_code.
+    """
+
+    def __init__(self, host_id: str, address: Tuple[str, int], authkey: bytes,
+                 registry: KernelHostRegistry, notebook_manager: NotebookManager,
+                 advertised_address: Optional[Tuple[str, int]] = None):
+        """Initialize the server.
+
+        Args:
+            host_id: Unique name of this host in the registry
+            address: (host, port) to listen on
+            authkey: Key shared with the clients
+            registry: Registry to announce this host in
+            notebook_manager: Notebook manager running this host's kernels
+            advertised_address: Address the clients should connect to (defaults to ``address``)
+        """
+        self.host_id = host_id
+        self.authkey = authkey
+        self.registry = registry
+        self.notebook_manager = notebook_manager
+        self.listener = Listener(address, authkey=authkey)
+        self.advertised_address = advertised_address or self.listener.address
+        self._stopping = threading.Event()
+
+    def _heartbeat_loop(self):
+        while not self._stopping.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.registry.register_host(self.host_id, self.advertised_address)
+            except Exception as e:
+                logger.error(f"Kernel host {self.host_id} could not send its heartbeat: {e}")
+
+    def _dispatch(self, request: Dict[str, Any], send: Callable[[Dict[str, Any]], None]) -> Any:
+        method = request['method']
+        if method == 'execute_code':
+            def on_output(text):
+                send({'type': 'output', 'text': text})
+            return self.notebook_manager.execute_code(request['project_id'], request['code'], on_output=on_output)
+        if method == 'ensure_notebook_exists':
+            return self.notebook_manager.ensure_notebook_exists(request['project_id'])
+        if method == 'compact_notebook':
+            return self.notebook_manager.compact_notebook(request['project_id'])
+        if method == 'shutdown_kernel':
+            return self.notebook_manager.shutdown_kernel(request['project_id'])
+        if method == 'kernel_id':
+            return self.notebook_manager.kernel_id(request['project_id'])
+        if method == 'kernel_stats':
+            return self.notebook_manager.kernel_stats()
+        if method == 'ping':
+            return self.host_id
+        raise ValueError(f"Unknown method: {method}")
+
+    def _serve_connection(self, connection):
+        send_lock = threading.Lock()
+
+        def send(message):
+            with send_lock:
+                connection.send(message)
+
+        try:
+            while True:
+                try:
+                    request = connection.recv()
+                except EOFError:
+                    break
+                try:
+                    send({'type': 'result', 'value': self._dispatch(request, send)})
+                except Exception as e:
+                    logger.error(f"Kernel host {self.host_id} failed to handle {request.get('method')}: {e}")
+                    send({'type': 'error', 'error': str(e)})
+        finally:
+            connection.close()
+
+    def serve_forever(self):
+        """Register this host and handle connections until ``stop`` is called."""
+        self.registry.register_host(self.host_id, self.advertised_address)
+        threading.Thread(target=self._heartbeat_loop, daemon=True, name="kernel-host-heartbeat").start()
+        logger.info(f"Kernel host {self.host_id} listening on {self.listener.address}")
+        try:
+            while not self._stopping.is_set():
+                try:
+                    connection = self.listener.accept()
+                except OSError:
+                    if self._stopping.is_set():
+                        break
+                    raise
+                except Exception as e:
+                    # Failed authentication and the like only affect that one client
+                    logger.warning(f"Kernel host {self.host_id} rejected a connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+        finally:
+            self.registry.unregister_host(self.host_id)
+            self.notebook_manager.cleanup()
+
+    def stop(self):
+        """Stop accepting connections and withdraw this host from the registry."""
+        self._stopping.set()
+        self.registry.unregister_host(self.host_id)
+        self.listener.close()
+
+
+class KernelHostClient:
+    """Runs code on the kernel host that owns each project.
+
+    Offers the parts of the NotebookManager interface the HTTP tier uses, so
+    it can replace the in-process notebook manager when kernels run in
+    dedicated host processes. Notebooks are written by the hosts into the
+    shared NOTEBOOKS_DIR.
+    """
+
+    def __init__(self, registry: KernelHostRegistry, authkey: bytes, notebooks_dir: str):
+        """Initialize the client.
+
+        Args:
+            registry: Registry mapping projects to hosts
+            authkey: Key shared with the hosts
+            notebooks_dir: Directory the hosts write notebooks to
+        """
+        self.registry = registry
+        self.authkey = authkey
+        self.notebooks_dir = notebooks_dir
+
+    def _call_host(self, host: Dict[str, Any], request: Dict[str, Any],
+                   on_output: Optional[Callable[[str], None]] = None) -> Any:
+        try:
+            connection = Client(tuple(host['address']), authkey=self.authkey)
+        except (OSError, EOFError) as e:
+            raise HostUnreachableError(str(e)) from e
+        with connection:
+            try:
+                connection.send(request)
+            except (OSError, EOFError) as e:
+                raise HostUnreachableError(str(e)) from e
+            while True:
+                message = connection.recv()
+                if message['type'] == 'output':
+                    if on_output is not None:
+                        on_output(message['text'])
+                elif message['type'] == 'result':
+                    return message['value']
+                else:
+                    raise RuntimeError(f"Kernel host {host['host_id']}: {message['error']}")
+
+    def _call(self, project_id: str, request: Dict[str, Any],
+              on_output: Optional[Callable[[str], None]] = None) -> Any:
+        """Send a request to the project's host, moving the project once if the host is unreachable.
+
+        Only requests that never reached the host are retried. If the connection
+        drops after the request was sent, the error is raised, since the host may
+        already have acted on it.
+        """
+        for attempt in range(2):
+            host = self.registry.route(project_id)
+            try:
+                return self._call_host(host, request, on_output)
+            except HostUnreachableError as e:
+                logger.error(f"Kernel host {host['host_id']} is unreachable: {e}")
+                self.registry.forget_host(host['host_id'])
+                if attempt == 1:
+                    raise
+
+    def execute_code(self, project_id: str, code: str, submitted_at: Optional[float] = None,
+                     on_output: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """Execute code in the project's kernel on its host.
+
+        Args:
+            project_id: The project identifier
+            code: Python code to execute
+            submitted_at: Accepted for compatibility; queueing on the host is timed there
+            on_output: Optional callback receiving output as it is produced
+
+        Returns:
+            The NotebookManager.execute_code result from the host, or a failed result
+            if the host was lost while the code ran
+        """
+        request = {'method': 'execute_code', 'project_id': project_id, 'code': code}
+        try:
+            return self._call(project_id, request, on_output)
+        except HostUnreachableError:
+            raise
+        except (ConnectionError, EOFError) as e:
+            # The cell may have run in part or in full, and its output was already streamed, so it is not re-run
+            reason = str(e) or type(e).__name__
+            logger.error(f"Lost the kernel host of project {project_id} while executing code: {reason}")
+            return {
+                'success': False,
+                'output': '',
+                'error': (f"The kernel host stopped responding while this code ran ({reason}). It was not run again; "
+                          f"check which of its effects took place before continuing."),
+                'timed_out': False,
+                'timing': None,
+            }
+
+    def ensure_notebook_exists(self, project_id: str) -> str:
+        """Create the project's notebook on its host if it doesn't exist."""
+        return self._call(project_id, {'method': 'ensure_notebook_exists', 'project_id': project_id})
+
+    def compact_notebook(self, project_id: str) -> str:
+        """Fold the project's journal into its notebook and return the notebook path."""
+        return self._call(project_id, {'method': 'compact_notebook', 'project_id': project_id})
+
+    def shutdown_kernel(self, project_id: str):
+        """Shut down the project's kernel on its host."""
+        return self._call(project_id, {'method': 'shutdown_kernel', 'project_id': project_id})
+
+    def kernel_id(self, project_id: str) -> Optional[str]:
+        """Id of the project's live kernel on its host, or None if it has none."""
+        return self._call(project_id, {'method': 'kernel_id', 'project_id': project_id})
+
+    def kernel_stats(self) -> Dict[str, Any]:
+        """Kernel statistics of every live host, by host id."""
+        stats = {}
+        for host in self.registry.live_hosts():
+            try:
+                stats[host['host_id']] = self._call_host(host, {'method': 'kernel_stats'})
+                stats[host['host_id']]['projects_routed'] = self.registry.host_load(host['host_id'])
+            except (ConnectionError, EOFError) as e:
+                stats[host['host_id']] = {'error': str(e)}
+        return {'hosts': stats}
+
+    def cleanup(self):
+        """Nothing to release: kernels belong to the hosts."""
+
+
+def create_notebook_manager() -> NotebookManager:
+    """Build the notebook manager a host (or a single-process server) runs kernels with."""
+    return NotebookManager(
+        settings.NOTEBOOKS_DIR,
+        kernel_pool_size=settings.KERNEL_POOL_SIZE,
+        max_kernels=settings.MAX_KERNELS,
+        max_kernel_memory_mb=settings.MAX_KERNEL_MEMORY_MB,
+        hibernate_idle_seconds=settings.HIBERNATE_IDLE_SECONDS,
+        checkpoint_every_cells=settings.CHECKPOINT_EVERY_CELLS,
+        replay_time_budget=settings.REPLAY_TIME_BUDGET,
+        execution_timeout=settings.MAX_CODE_EXECUTION_TIME,
+    )
+
+
+def require_authkey() -> bytes:
+    """The key shared by hosts and clients; there is deliberately no default.
+
+    ``multiprocessing.connection`` unpickles what it receives, so anyone who
+    can reach a host and knows the key can run code on it.
+    """
+    if not settings.KERNEL_HOST_AUTHKEY:
+        raise ValueError("KERNEL_HOST_AUTHKEY must be set to a secret shared by the web workers and kernel hosts")
+    return settings.KERNEL_HOST_AUTHKEY.encode()
+
+
+def run_host(host_id: str, port: int, bind: str = "127.0.0.1", advertise: Optional[str] = None):
+    """Run a kernel host process until it is interrupted."""
+    from ..database.session_store import session_store
+
+    logging.basicConfig(level=logging.INFO)
+    authkey = require_authkey()
+    if not advertise:
+        # Clients on other machines can only reach a host listening on a routable interface
+        advertise = bind if bind not in ("0.0.0.0", "") else socket.gethostname()
+    server = KernelHostServer(
+        host_id, (bind, port), authkey,
+        KernelHostRegistry(session_store), create_notebook_manager(),
+        advertised_address=(advertise, port),
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+# Start kernel hosts: python -m backend.app.services.kernel_host --port 7001 [--hosts 3]
+if __name__ == "__main__":
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="Run kernel host processes")
+    parser.add_argument("--port", type=int, default=7001, help="Port of the first host")
+    parser.add_argument("--hosts", type=int, default=1, help="Number of host processes to start on consecutive ports")
+    parser.add_argument("--bind", default="127.0.0.1",
+                        help="Interface to listen on (use a private interface, never a public one, for other machines)")
+    parser.add_argument("--advertise", default=None, help="Host name the clients should connect to")
+    parser.add_argument("--host-id", default=None, help="Name of the host (defaults to <hostname>:<port>)")
+    args = parser.parse_args()
+    require_authkey()
+
+    processes = []
+    for index in range(args.hosts):
+        port = args.port + index
+        host_id = args.host_id if args.host_id and args.hosts == 1 else f"{socket.gethostname()}:{port}"
+        process = multiprocessing.Process(
+            target=run_host, args=(host_id, port, args.bind, args.advertise), name=f"kernel-host-{port}"
+        )
+        process.start()
+        processes.append(process)
+        print(f"Started kernel host {host_id} (pid {process.pid})")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("\nStopping kernel hosts...")
+        for process in processes:
+            process.join()
@@ -0,0 +1,194 @@
+import os
+import re
+import uuid
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..core.history_manager import ANSI_ESCAPE
+
+logger = logging.getLogger(__name__)
+
+# First line of a traceback frame in IPython and plain Python tracebacks
+FRAME_START = re.compile(r'^\s*(Cell In\[\d+\]|Input In \[\d+\]|<ipython-input-|File \S)')
+
+# Frames that come from the user's own code rather than a library
+USER_FRAME = re.compile(r'^\s*(Cell In\[\d+\]|Input In \[\d+\]|<ipython-input-)')
+
+# Room kept in a head/tail budget for the marker line saying what was cut
+MARKER_CHARS = 32
+
+# Output ids are generated here, so anything else is rejected when reading them back
+OUTPUT_ID = re.compile(r'^[0-9a-f]{12}$')
+
+
+def collapse_repeated_lines(text: str) -> str:
+    """Collapse runs of identical consecutive lines into one line plus a count."""
+    lines = text.split("\n")
+    collapsed = []
+    index = 0
+    while index < len(lines):
+        run_end = index + 1
+        while run_end < len(lines) and lines[run_end] == lines[index]:
+            run_end += 1
+        collapsed.append(lines[index])
+        repeats = run_end - index - 1
+        if repeats > 2:
+            collapsed.append(f"[... previous line repeated {repeats} more times ...]")
+        else:
+            collapsed.extend(lines[index + 1:run_end])
+        index = run_end
+    return "\n".join(collapsed)
+
+
+def head_tail(text: str, max_chars: int) -> Tuple[str, bool]:
+    """Keep the first and last lines of a text so it fits in ``max_chars``, marker included.
+
+    Returns:
+        Tuple of (text, whether anything was cut)
+    """
+    if len(text) <= max_chars:
+        return text, False
+    if max_chars <= MARKER_CHARS:
+        return "", True
+
+    head_budget = (max_chars - MARKER_CHARS) * 2 // 3
+    tail_budget = max_chars - MARKER_CHARS - head_budget
+    lines = text.split("\n")
+
+    head, used = [], 0
+    for line in lines:
+        if used + len(line) + 1 > head_budget:
+            break
+        head.append(line)
+        used += len(line) + 1
+
+    tail, used = [], 0
+    for line in reversed(lines[len(head):]):
+        if used + len(line) + 1 > tail_budget:
+            break
+        tail.append(line)
+        used += len(line) + 1
+    tail.reverse()
+
+    if not head and not tail:
+        # A single enormous line: fall back to cutting characters
+        return f"{text[:head_budget]}\n[... output truncated ...]\n{text[-tail_budget:]}", True
+
+    omitted = len(lines) - len(head) - len(tail)
+    return "\n".join(head + [f"[... {omitted} lines omitted ...]"] + tail), True
+
+
+def condense_traceback(traceback_text: str) -> str:
+    """Reduce a traceback to the frames that matter.
+
+    Keeps the header, every frame from the user's own cells, the frame where
+    the exception was raised and the final exception line. Library frames in
+    between are replaced by a count.
+    """
+    lines = ANSI_ESCAPE.sub('', traceback_text).split("\n")
+
+    header, frames = [], []
+    for line in lines:
+        if FRAME_START.match(line):
+            frames.append([line])
+        elif frames:
+            frames[-1].append(line)
+        else:
+            header.append(line)
+
+    if len(frames) <= 2:
+        return "\n".join(lines)
+
+    kept, omitted = [], 0
+    for index, frame in enumerate(frames):
+        if USER_FRAME.match(frame[0]) or index == len(frames) - 1:
+            if omitted:
+                kept.append([f"[... {omitted} library frames omitted ...]"])
+                omitted = 0
+            kept.append(frame)
+        else:
+            omitted += 1
+
+    return "\n".join(header + [line for frame in kept for line in frame])
+
+
+class OutputShaper:
+    """Shapes code execution output before it is fed back to the model.
+
+    Output is capped per block and per turn, keeping its head and tail.
+    Repeated lines are collapsed and tracebacks are condensed. Whenever
+    anything is cut or condensed, the original output is saved on disk under
+    an id that the user can use to retrieve it.
+    """
+
+    def __init__(self, outputs_dir: str, max_block_chars: int = 4000, max_turn_chars: int = 12000):
+        """Initialize the shaper.
+
+        Args:
+            outputs_dir: Directory where full outputs are kept, one subdirectory per project
+            max_block_chars: Maximum characters of output per code block
+            max_turn_chars: Maximum characters of output across all blocks of one reply
+        """
+        self.outputs_dir = outputs_dir
+        self.max_block_chars = max_block_chars
+        self.max_turn_chars = max_turn_chars
+
+    def get_output_path(self, project_id: str, output_id: str) -> Optional[str]:
+        """Path of a saved full output, or None if the id is not valid."""
+        if not OUTPUT_ID.match(output_id) or os.sep in project_id or project_id.startswith('.'):
+            return None
+        return os.path.join(self.outputs_dir, project_id, f"{output_id}.txt")
+
+    def save_full_output(self, project_id: str, text: str) -> str:
+        """Save untruncated output and return its id."""
+        output_id = uuid.uuid4().hex[:12]
+        project_dir = os.path.join(self.outputs_dir, project_id)
+        os.makedirs(project_dir, exist_ok=True)
+        with open(os.path.join(project_dir, f"{output_id}.txt"), 'w') as f:
+            f.write(text)
+        return output_id
+
+    def shape(self, project_id: str, text: str, max_chars: int, is_traceback: bool = False) -> str:
+        """Shape one block's output or traceback to fit in ``max_chars``, including the note on the saved output."""
+        plain = ANSI_ESCAPE.sub('', text)
+        shaped = collapse_repeated_lines(condense_traceback(plain) if is_traceback else plain)
+        if shaped == plain and len(shaped) <= max_chars:
+            return shaped
+
+        # Anything beyond colour codes changed, so the original is kept
+        output_id = self.save_full_output(project_id, text)
+        note = f"[Output truncated from {len(text)} characters; full output saved as {output_id}]"
+        shaped, truncated = head_tail(shaped, max_chars - len(note) - 1)
+        if not truncated:
+            note = note.replace("truncated", "condensed", 1)
+        shaped = f"{shaped}\n{note}" if shaped else note
+        logger.info(f"Shaped output for project {project_id} from {len(text)} to {len(shaped)} characters")
+        # With the turn budget nearly used up, not even the note fits
+        return shaped if len(shaped) <= max_chars else ""
+
+    def shape_results(self, project_id: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Shape the results of all blocks in one reply under the per-turn budget.
+
+        Args:
+            project_id: The project identifier
+            results: Execution results from NotebookManager.execute_code, in block order
+
+        Returns:
+            Copies of the results with ``output`` and ``error`` shaped
+        """
+        remaining = self.max_turn_chars
+        shaped_results = []
+        for index, result in enumerate(results):
+            # Share what is left of the turn budget fairly among the remaining blocks
+            budget = min(self.max_block_chars, remaining // (len(results) - index))
+            shaped = dict(result)
+            if result.get('error'):
+                # A block with both gives at most half its budget to the traceback
+                error_budget = budget // 2 if result.get('output') else budget
+                shaped['error'] = self.shape(project_id, result['error'], error_budget, is_traceback=True)
+                budget -= len(shaped['error'])
+            if result.get('output'):
+                shaped['output'] = self.shape(project_id, result['output'], budget)
+            remaining -= len(shaped.get('output') or '') + len(shaped.get('error') or '')
+            shaped_results.append(shaped)
+        return shaped_results
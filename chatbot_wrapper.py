@@ -1,10 +1,16 @@
 import requests
 import json
 import os
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # API endpoint configuration
 BASE_URL = "http://localhost:8080"
 
+# Number of upload chunks sent at the same time
+UPLOAD_WORKERS = 4
+
 class ChatbotWrapper:
     def __init__(self):
         self.user_id = "test_user"  # Default user ID
@@ -68,7 +74,7 @@ class ChatbotWrapper:
             print("\n❌ Please enter a valid number.")
     
     def upload_file(self):
-        """Upload a file to the current session"""
+        """Upload a file to the current session in resumable chunks"""
         if not self.session_active or not self.current_paper_id:
             print("\n❌ No active session. Please initiate a session first.")
             return
@@ -79,25 +85,73 @@ class ChatbotWrapper:
             print(f"\n❌ File not found: {file_path}")
             return
         
-        url = f"{BASE_URL}/upload_file"
-        
         try:
-            with open(file_path, 'rb') as file:
-                files = {'file': (os.path.basename(file_path), file)}
-                data = {'user_id': self.user_id, 'paper_id': self.current_paper_id}
-                
-                response = requests.post(url, files=files, data=data)
-                response.raise_for_status()
-                data = response.json()
-                print(f"\n✅ File uploaded successfully: {os.path.basename(file_path)}")
-                print(f"   Server response: {data.get('message', 'No message')}")
+            print("\n⏳ Hashing file...")
+            payload = json.dumps({
+                "user_id": self.user_id,
+                "paper_id": self.current_paper_id,
+                "filename": os.path.basename(file_path),
+                "total_size": os.path.getsize(file_path),
+                "sha256": self._hash_file(file_path)
+            })
+            headers = {'Content-Type': 'application/json'}
+            response = requests.post(f"{BASE_URL}/upload/initiate", headers=headers, data=payload)
+            response.raise_for_status()
+            upload = response.json()
+            
+            # Re-initiating an interrupted upload returns the chunks that are still missing
+            missing = upload["missing_chunks"]
+            if len(missing) < upload["total_chunks"]:
+                print(f"\n↪️  Resuming upload: {upload['total_chunks'] - len(missing)} of {upload['total_chunks']} chunks already sent")
+            
+            with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+                futures = [executor.submit(self._send_chunk, file_path, upload, index) for index in missing]
+                for sent, future in enumerate(as_completed(futures), 1):
+                    future.result()
+                    print(f"\r   Sent {sent}/{len(missing)} chunks", end="", flush=True)
+            
+            response = requests.post(f"{BASE_URL}/upload/{upload['upload_id']}/complete")
+            response.raise_for_status()
+            data = response.json()
+            print(f"\n✅ File uploaded successfully: {os.path.basename(file_path)}")
+            print(f"   Server response: {data.get('message', 'No message')}")
         except FileNotFoundError:
             print(f"\n❌ Error: File not found at {file_path}")
         except requests.exceptions.RequestException as e:
             print(f"\n❌ Upload failed: {e}")
+            print("   Upload the same file again to resume from the last completed chunk.")
+    
+    def _hash_file(self, file_path):
+        """Compute the SHA-256 hash of a file in chunks"""
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                hasher.update(block)
+        return hasher.hexdigest()
+    
+    def _send_chunk(self, file_path, upload, index, retries=3):
+        """Send one chunk of a file, retrying on failure"""
+        with open(file_path, 'rb') as file:
+            file.seek(index * upload["chunk_size"])
+            chunk = file.read(upload["chunk_size"])
+        
+        url = f"{BASE_URL}/upload/{upload['upload_id']}/chunk/{index}"
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'X-Chunk-Sha256': hashlib.sha256(chunk).hexdigest()
+        }
+        for attempt in range(retries):
+            try:
+                response = requests.put(url, headers=headers, data=chunk)
+                response.raise_for_status()
+                return
+            except requests.exceptions.RequestException:
+                if attempt == retries - 1:
+                    raise
+                time.sleep(2 ** attempt)
     
     def send_message(self):
-        """Send a message to the chatbot and display the response"""
+        """Send a message to the chatbot and render the streamed response"""
         if not self.session_active or not self.current_paper_id:
             print("\n❌ No active session. Please initiate a session first.")
             return
@@ -108,27 +162,57 @@ class ChatbotWrapper:
             print("\n❌ Message cannot be empty.")
             return
         
-        url = f"{BASE_URL}/chat"
+        url = f"{BASE_URL}/chat/stream"
         payload = json.dumps({
             "user_id": self.user_id, 
             "message": message, 
             "paper_id": self.current_paper_id
         })
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', 'Accept': 'text/event-stream'}
         
         try:
             print("\n⏳ Waiting for response...")
-            response = requests.post(url, headers=headers, data=payload)
-            response.raise_for_status()
-            data = response.json()
-            
-            print("\n🤖 Chatbot Response:")
-            print("=" * 80)
-            print(data.get("response", "No response received"))
-            print("=" * 80)
+            with requests.post(url, headers=headers, data=payload, stream=True) as response:
+                response.raise_for_status()
+                print("\n🤖 Chatbot Response:")
+                print("=" * 80)
+                for event in self._iter_events(response):
+                    self._render_event(event)
+                print("=" * 80)
         except requests.exceptions.RequestException as e:
             print(f"\n❌ Failed to send message: {e}")
     
+    def _iter_events(self, response):
+        """Parse a Server-Sent Events response into event dictionaries"""
+        data_lines = []
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                if line.startswith("data:"):
+                    data_lines.append(line[len("data:"):].strip())
+            elif data_lines:
+                yield json.loads("\n".join(data_lines))
+                data_lines = []
+    
+    def _render_event(self, event):
+        """Print one streamed chat event"""
+        event_type = event.get("type")
+        if event_type == "text":
+            print(event["text"], end="", flush=True)
+        elif event_type == "message":
+            print()
+        elif event_type == "code":
+            print(f"\n▶️  Running code block {event['block']}...")
+        elif event_type == "output":
+            print(event["text"], end="", flush=True)
+        elif event_type == "result":
+            timing = event.get("timing") or {}
+            if event["success"]:
+                print(f"\n✅ Code block {event['block']} finished in {timing.get('run_time', 0):.1f}s\n")
+            else:
+                print(f"\n❌ Code block {event['block']} failed:\n{event['error']}\n")
+        elif event_type == "error":
+            print(f"\n❌ Error: {event['error']}")
+    
     def run(self):
         """Main loop for the chatbot wrapper"""
         print("\n🤖 Welcome to the Chatbot Wrapper!")